@@ -0,0 +1,71 @@
+"""
+    Benchmark of the datahub_daily_check partner lookups.
+
+    Compares the per-partner where/dropna scans check_all_bucket_folders used
+    to run with the partner index it builds once per check, on synthetic
+    schedules of thousands of partners. No bucket requests are made.
+
+    Usage:
+        python -m benchmarks.bench_daily_check_lookup --partners 1000 5000
+"""
+import argparse
+import time
+
+from benchmarks.bench_daily_check_manifest import make_schedule
+from datahub_daily_check.datahub_daily_check import (
+    get_partner_files,
+    get_partner_index,
+)
+
+
+def legacy_due_partners(partner_files, time_check, time_schedule, partner_schedule):
+    """This is the previous lookup, four full frame scans per partner"""
+    due_partners = []
+    bucket_prefixes = partner_files['partner'].drop_duplicates(keep='first').dropna()
+    for prefix in bucket_prefixes.values.tolist():
+        time_in_file_Schedule = set(time_schedule['run_hour'].where(
+            time_schedule['partner'] == prefix).dropna(axis='rows', how='all'))
+        if time_check in time_in_file_Schedule:
+            lstfiles = set(partner_files['files'].where(
+                partner_files['partner'] == prefix).dropna(axis='rows', how='all'))
+            internal_emails = partner_schedule['internal_emails'].where(
+                partner_schedule['partner'] == prefix).dropna(axis='rows', how='all').values.tolist()[0]
+            external_emails = partner_schedule['partner_emails'].where(
+                partner_schedule['partner'] == prefix).dropna(axis='rows', how='all').values.tolist()[0]
+            due_partners.append((prefix, lstfiles, internal_emails, external_emails))
+    return due_partners
+
+
+def indexed_due_partners(partner_files, time_check, time_schedule, partner_schedule):
+    """This is the current lookup, one partner index per check"""
+    partner_index = get_partner_index(partner_files, time_schedule, partner_schedule)
+    return [(prefix, partner['files'], partner['internal_emails'], partner['partner_emails'])
+            for prefix, partner in partner_index.items()
+            if time_check in partner['run_hours']]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--partners", type=int, nargs="+", default=[100, 1000, 5000])
+    args = parser.parse_args(argv)
+
+    print("%10s %12s %12s" % ("partners", "index_s", "legacy_s"))
+    for no_of_partners in args.partners:
+        schedule = make_schedule(no_of_partners)
+        partner_files, time_schedule = get_partner_files(schedule, "20200902.csv")
+        frames = (partner_files, "23:59", time_schedule, schedule)
+
+        index_seconds, due = timed(indexed_due_partners, *frames)
+        legacy_seconds, legacy_due = timed(legacy_due_partners, *frames)
+        assert due == legacy_due
+        print("%10d %12.3f %12.3f" % (no_of_partners, index_seconds, legacy_seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+    Benchmark of the datahub_daily_check expected-file manifest builder.
+
+    Builds the manifest for synthetic partner schedules of growing size and
+    compares get_partner_files with the previous per-row DataFrame.append
+    builder (emulated with pd.concat, append is gone from modern pandas).
+
+    Usage:
+        python -m benchmarks.bench_daily_check_manifest --partners 10 100 1000
+"""
+import argparse
+import time
+
+import pandas as pd
+
+from datahub_daily_check.datahub_daily_check import (
+    get_files_to_check,
+    get_partner_files,
+)
+
+
+def make_schedule(no_of_partners, no_of_programs=3):
+    """This returns a synthetic partner schedule shaped like partner_schedule.csv"""
+    rows = []
+    for i in range(no_of_partners):
+        programs = ["program-%d-%d" % (i, j) for j in range(no_of_programs)]
+        rows.append({
+            'partner': "partner-%d" % i,
+            'programs': ",".join(programs),
+            'partner_emails': "partner-%d@example.org" % i,
+            'internal_emails': "data-engineering-team@coursera.org",
+            'run_hour': "23:59",
+            'ignore_files': programs[0] + ":applications|" + programs[1] + ":students,terms",
+            'swap_files': "terms,degree_terms" if i % 2 else "nan",
+        })
+    return pd.DataFrame(rows)
+
+
+def legacy_partner_files(partner_schedule, date_placeholder):
+    """This is the previous builder, one frame copy per expected file"""
+    time_schedule = pd.DataFrame(columns=['partner', 'run_hour'])
+    partner_files = pd.DataFrame(columns=['partner', 'files'])
+    for _, row in partner_schedule.iterrows():
+        programs = [str(row['partner']) + "/" + str(x)
+                    for x in row['programs'].split(",") if x != '']
+        swap_files = [i.split(",") for i in row['swap_files'].split(
+            ":") if row['swap_files'] != 'nan']
+        for program in programs:
+            ignore_files = []
+            for ignore_program in row['ignore_files'].split('|'):
+                if program == str(row['partner']) + "/" + ignore_program.split(':')[0]:
+                    ignore_files += ignore_program.split(':')[1].split(',')
+                    break
+            for file in get_files_to_check(program, date_placeholder, ignore_files, swap_files):
+                partner_files = pd.concat([partner_files, pd.DataFrame(
+                    [{'partner': row['partner'], 'files': file}])], ignore_index=True)
+        for x in [x for x in row['run_hour'].split(",") if x != '']:
+            time_schedule = pd.concat([time_schedule, pd.DataFrame(
+                [{'partner': row['partner'], 'run_hour': x}])], ignore_index=True)
+    return (partner_files, time_schedule)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--partners", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--legacy-max", type=int, default=250,
+                        help="largest schedule to run the quadratic builder on")
+    args = parser.parse_args(argv)
+
+    print("%10s %10s %12s %12s" % ("partners", "files", "builder_s", "legacy_s"))
+    for no_of_partners in args.partners:
+        schedule = make_schedule(no_of_partners)
+        seconds, (partner_files, _) = timed(get_partner_files, schedule, "20200902.csv")
+        legacy = "-"
+        if no_of_partners <= args.legacy_max:
+            legacy_seconds, (legacy_files, _) = timed(
+                legacy_partner_files, schedule, "20200902.csv")
+            assert list(legacy_files['files']) == list(partner_files['files'])
+            legacy = "%.3f" % legacy_seconds
+        print("%10d %10d %12.3f %12s" % (no_of_partners, len(partner_files), seconds, legacy))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+    Benchmark of the datahub_daily_check cold start and schedule latency.
+
+    Compares the stdlib schedule path (load_partner_schedule, get_schedule_manifest,
+    build_partner_index) the scheduled check runs with the pandas path
+    (get_partner_shedule, get_partner_files, get_partner_index):
+        - startup: importing the lambda module in a fresh interpreter,
+          with and without pandas
+        - latency: loading the bundled and synthetic schedules into a partner index
+
+    Usage:
+        python -m benchmarks.bench_daily_check_startup --runs 5 --partners 10 1000
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_daily_check_manifest import make_schedule
+from datahub_daily_check.datahub_daily_check import (
+    build_partner_index,
+    get_partner_files,
+    get_partner_index,
+    get_partner_shedule,
+    get_schedule_manifest,
+    load_partner_schedule,
+)
+
+ScheduleFile = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "datahub_daily_check", "partner_schedule.csv")
+
+DATE_PLACEHOLDER = "20200902.csv"
+
+
+def time_import(statement, runs):
+    """This returns the median seconds to run an import statement in a fresh interpreter"""
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds)
+
+
+def stdlib_index(metadata_file):
+    schedule_rows = load_partner_schedule(metadata_file)
+    expected_files, run_hours = get_schedule_manifest(schedule_rows, DATE_PLACEHOLDER)
+    return build_partner_index(expected_files, run_hours, schedule_rows)
+
+
+def pandas_index(metadata_file):
+    partner_schedule = get_partner_shedule(metadata_file)
+    partner_files, time_schedule = get_partner_files(partner_schedule, DATE_PLACEHOLDER)
+    return get_partner_index(partner_files, time_schedule, partner_schedule)
+
+
+def time_index(function, metadata_file, runs):
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        partner_index = function(metadata_file)
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds), partner_index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--partners", type=int, nargs="+", default=[100, 1000])
+    args = parser.parse_args(argv)
+
+    module = "import datahub_daily_check.datahub_daily_check"
+    print("%-24s %12s" % ("startup", "median_s"))
+    print("%-24s %12.3f" % ("interpreter", time_import("pass", args.runs)))
+    print("%-24s %12.3f" % ("stdlib path", time_import(module, args.runs)))
+    print("%-24s %12.3f" % ("pandas path", time_import("import pandas; " + module, args.runs)))
+
+    print()
+    print("%-24s %12s %12s" % ("schedule", "stdlib_s", "pandas_s"))
+    with tempfile.TemporaryDirectory() as tmp:
+        schedules = [("partner_schedule.csv", ScheduleFile)]
+        for no_of_partners in args.partners:
+            metadata_file = os.path.join(tmp, "schedule_%d.csv" % no_of_partners)
+            make_schedule(no_of_partners).to_csv(metadata_file, index=False)
+            schedules.append(("%d partners" % no_of_partners, metadata_file))
+
+        for name, metadata_file in schedules:
+            stdlib_seconds, index = time_index(stdlib_index, metadata_file, args.runs)
+            pandas_seconds, legacy_index = time_index(pandas_index, metadata_file, args.runs)
+            assert index == legacy_index
+            print("%-24s %12.4f %12.4f" % (name, stdlib_seconds, pandas_seconds))
+
+
+if __name__ == "__main__":
+    main()
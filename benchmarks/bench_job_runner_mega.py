@@ -0,0 +1,63 @@
+"""
+    Benchmark of the datahub_job_runner MEGA calls against a local stand-in server.
+
+    Triggers jobs the way the 23:59 burst does, many files mapping to a few jobs,
+    and compares the pooled session with the latest id cache (MegaJob) with the
+    previous calls: two requests.post per trigger, each on a new connection.
+
+    Usage:
+        python -m benchmarks.bench_job_runner_mega --triggers 500 --jobs 20 --latency 0.002
+"""
+import argparse
+import time
+
+import requests
+
+from benchmarks.mega_stub import MegaStub
+from datahub_common import mega
+from datahub_common.mega import MEGA_HTTP_HEADERS, MegaJob
+
+
+def legacy_trigger(base_url, job_id, user="datahub@coursera.org"):
+    """This is the previous MegaJob: a getLatest and an execute post, no session"""
+    latest_id = requests.post(
+        base_url + "/api/megaJobManager.v1?action=getLatest&id=" + job_id,
+        headers=MEGA_HTTP_HEADERS, json={}).json()["id"]
+    requests.post(
+        base_url + "/api/megaJobManager.v1?action=execute&id=" + latest_id
+        + "&requesterEmailOverride=" + user,
+        headers=MEGA_HTTP_HEADERS, json={})
+
+
+def pooled_trigger(base_url, job_id):
+    MegaJob(job_id).execute_mega_job()
+
+
+def run(trigger, no_of_triggers, no_of_jobs, latency):
+    with MegaStub(latency=latency) as stub:
+        mega.MEGA_BASE_URL = stub.base_url
+        mega._latest_ids.clear()
+        start = time.perf_counter()
+        for i in range(no_of_triggers):
+            trigger(stub.base_url, "job-%d" % (i % no_of_jobs))
+        seconds = time.perf_counter() - start
+    return seconds, len(stub.requests), len(stub.connections)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--triggers", type=int, default=500)
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.002, help="server seconds per request")
+    args = parser.parse_args(argv)
+
+    print("%-8s %10s %10s %12s %10s" % ("path", "seconds", "requests", "connections", "ms/trigger"))
+    for name, trigger in [("legacy", legacy_trigger), ("pooled", pooled_trigger)]:
+        seconds, no_of_requests, no_of_connections = run(
+            trigger, args.triggers, args.jobs, args.latency)
+        print("%-8s %10.3f %10d %12d %10.2f" % (
+            name, seconds, no_of_requests, no_of_connections, seconds * 1000 / args.triggers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+    Load test of datahub_job_runner.lambda_handler against moto and the MEGA stand-in.
+
+    Replays thousands of synthetic partner file events the way the 23:59 burst
+    lands them: every job gets several files a day, over several days. Events are
+    delivered at least once, a share of them twice, and the messages of an SQS
+    batch which failed are delivered again, like SQS retries them.
+
+        single: one EventBridge event per invocation (the previous trigger)
+        batch: SQS batches of --batch-size events (batch_handler), with a batching
+            window SQS hands a Lambda up to 10000 messages at once
+
+    Reports throughput, p50/p99 dispatch latency (from the invocation receiving an
+    event to it returning) and the duplicate executions: jobs executed more than
+    once a day. A job missed is a day it was never executed. A file of a job landing
+    in a later batch than the job was dispatched in runs the job again, so batch
+    duplicates come down as --batch-size grows; redelivered events never run a job.
+
+    Usage:
+        python -m benchmarks.load_job_runner --jobs 50 --files 4 --days 10 \\
+            --latency 0.005 --error-rate 0.02 --redeliver 0.05
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from moto import mock_s3
+
+try:
+    from moto import mock_dynamodb
+except ImportError:  # moto < 3
+    from moto import mock_dynamodb2 as mock_dynamodb
+
+from benchmarks.mega_stub import MegaStub
+from datahub_common import mega
+from datahub_job_runner import datahub_job_runner
+
+JOBS_CSV_HEADER = "s3_key,mega_job_id,script_url\n"
+
+
+def make_events(no_of_jobs, files_per_job, no_of_days):
+    """This function returns the file keys and events of a synthetic load
+
+    return:
+        jobs_csv (str): jobs csv of the s3 key templates
+        files (list): keys of the partner files
+        events (list): EventBridge event of every file
+    """
+    jobs_csv = JOBS_CSV_HEADER
+    templates = []
+    for job in range(no_of_jobs):
+        for file in range(files_per_job):
+            template = (
+                "partner-%d/program/enrollments/file-%d_{DATE_PLACEHOLDER}.csv"
+                % (
+                    job,
+                    file,
+                )
+            )
+            jobs_csv += "%s,job-%d,https://mega/job-%d\n" % (template, job, job)
+            templates.append(template)
+
+    files, events = [], []
+    for day in range(no_of_days):
+        for i, template in enumerate(templates):
+            key = template.format(DATE_PLACEHOLDER="202009%02d" % (day + 1))
+            files.append(key)
+            events.append(
+                {
+                    # the burst lands within one debounce window a day
+                    "time": "2020-09-%02dT23:59:%02dZ" % (day + 1, i % 40 + 10),
+                    "detail": {
+                        "requestParameters": {
+                            "bucketName": datahub_job_runner.PARTNER_BUCKET,
+                            "key": key,
+                        }
+                    },
+                }
+            )
+    return jobs_csv, files, events
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+class LoadTest:
+    """This class replays events through lambda_handler and collects the results
+
+    Attributes:
+        mode (str): single or batch
+        batch_size (int): events of an SQS batch
+        redeliver (float): share of the events delivered twice
+        containers (int): Lambda containers invoked at once
+        seed (int): seed of the delivery order
+    """
+
+    def __init__(self, mode, batch_size=10, redeliver=0.0, containers=1, seed=0):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.redeliver = redeliver
+        self.containers = containers
+        self.random = random.Random(seed)
+        self.latencies = []
+        self.invocations = 0
+        self.failures = 0
+
+    def get_deliveries(self, events):
+        """This method returns the events in delivery order, some of them twice
+
+        The files of a day land in any order within its burst, days one after the other
+        """
+        days = {}
+        for event in events:
+            days.setdefault(event["time"][:10], []).append(event)
+        deliveries = []
+        for day in sorted(days):
+            burst = days[day] + [
+                x for x in days[day] if self.random.random() < self.redeliver
+            ]
+            self.random.shuffle(burst)
+            deliveries += burst
+        return deliveries
+
+    def invoke(self, events):
+        """This method invokes lambda_handler once
+
+        return:
+            failed (list): events to deliver again
+        """
+        if self.mode == "single":
+            start = time.perf_counter()
+            datahub_job_runner.lambda_handler(events[0], None)
+            self.latencies.append(time.perf_counter() - start)
+            return []
+
+        messages = {"m%d" % i: event for i, event in enumerate(events)}
+        batch = {
+            "Records": [
+                {"messageId": message_id, "body": json.dumps(event)}
+                for message_id, event in messages.items()
+            ]
+        }
+        start = time.perf_counter()
+        response = datahub_job_runner.lambda_handler(batch, None)
+        self.latencies += [time.perf_counter() - start] * len(events)
+        return [messages[x["itemIdentifier"]] for x in response["batchItemFailures"]]
+
+    def run(self, events):
+        """This method delivers events until none of them failed
+
+        return:
+            seconds (float): wall time of the run
+        """
+        size = 1 if self.mode == "single" else self.batch_size
+        pending = self.get_deliveries(events)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.containers) as pool:
+            while pending:
+                batches = [pending[i : i + size] for i in range(0, len(pending), size)]
+                self.invocations += len(batches)
+                pending = [
+                    x for failed in pool.map(self.invoke, batches) for x in failed
+                ]
+                self.failures += len(pending)
+        return time.perf_counter() - start
+
+
+def run(args, mode):
+    jobs_csv, files, events = make_events(args.jobs, args.files, args.days)
+    with mock_s3(), mock_dynamodb(), MegaStub(
+        latency=args.latency, error_rate=args.error_rate, seed=args.seed
+    ) as stub:
+        client = boto3.client("s3", region_name="us-east-1")
+        for bucket in (
+            mega.JOBS_BUCKET,
+            datahub_job_runner.PARTNER_BUCKET,
+        ):
+            client.create_bucket(Bucket=bucket)
+        dynamodb_client = boto3.client("dynamodb", region_name="us-east-1")
+        dynamodb_client.create_table(
+            TableName=datahub_job_runner.DISPATCH_TABLE,
+            KeySchema=[{"AttributeName": "dispatch_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "dispatch_id", "AttributeType": "S"}
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        client.put_object(
+            Bucket=mega.JOBS_BUCKET,
+            Key=mega.JOBS_KEY,
+            Body=jobs_csv,
+        )
+        for key in files:
+            client.put_object(
+                Bucket=datahub_job_runner.PARTNER_BUCKET, Key=key, Body=b"id\n1\n"
+            )
+
+        emails = Counter()
+        patches = {
+            (datahub_job_runner, "s3"): client,
+            (datahub_job_runner, "_dynamodb_client"): dynamodb_client,
+            (mega, "job_index"): mega.JobIndex(client=client),
+            (mega, "MEGA_BASE_URL"): stub.base_url,
+            (mega, "MEGA_RETRY_DELAY"): args.retry_delay,
+            (mega, "_latest_ids"): {},
+            (datahub_job_runner, "send_email"): lambda metric_name, tags, job: (
+                emails.update([metric_name])
+            ),
+        }
+        originals = {name: getattr(*name) for name in patches}
+        load_test = LoadTest(
+            mode, args.batch_size, args.redeliver, args.containers, args.seed
+        )
+        logging.disable(logging.CRITICAL)
+        try:
+            for name, value in patches.items():
+                setattr(*name, value)
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds = load_test.run(events)
+        finally:
+            for name, value in originals.items():
+                setattr(*name, value)
+            logging.disable(logging.NOTSET)
+
+    executions = Counter()
+    for versioned_job_id, count in stub.executions.items():
+        executions[versioned_job_id.split("~")[0]] += count
+    job_ids = ["job-%d" % job for job in range(args.jobs)]
+    return {
+        "mode": mode,
+        "events": len(events),
+        "invocations": load_test.invocations,
+        "seconds": seconds,
+        "events/s": len(events) / seconds,
+        "p50_ms": percentile(load_test.latencies, 0.50) * 1000,
+        "p99_ms": percentile(load_test.latencies, 0.99) * 1000,
+        "executions": sum(executions.values()),
+        "duplicates": sum(max(0, executions[x] - args.days) for x in job_ids),
+        "missed": sum(max(0, args.days - executions[x]) for x in job_ids),
+        "mega_errors": stub.errors,
+        "failure_emails": sum(emails.values()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--files", type=int, default=4, help="files of a job a day")
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--mode", choices=["single", "batch"], action="append")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--containers", type=int, default=1)
+    parser.add_argument("--redeliver", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.005, help="MEGA seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-delay", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = [run(args, mode) for mode in args.mode or ["single", "batch"]]
+    columns = list(results[0])
+    print(" ".join("%12s" % x for x in columns))
+    for result in results:
+        print(
+            " ".join(
+                "%12.1f" % x if isinstance(x, float) else "%12s" % x
+                for x in result.values()
+            )
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Local stand-in for the MEGA megaJobManager.v1 endpoints used by datahub_common.mega.
+
+    POST /api/megaJobManager.v1?action=getLatest&id={job_id} => {"id": "{job_id}~v1"}
+    POST /api/megaJobManager.v1?action=execute&id={versioned_job_id}&... => {}
+
+Every request is recorded, with the connection it came in on, so a caller can
+tell how many round trips and connections it used. Latency and an error rate
+can be injected: a failed request is answered with error_status before MEGA
+took it, so a failed execute did not run the job.
+
+Usage:
+    with MegaStub(latency=0.005, error_rate=0.01) as stub:
+        mega.MEGA_BASE_URL = stub.base_url
+
+    python -m benchmarks.mega_stub --port 30003 --latency 0.05 --error-rate 0.01
+    MEGA_BASE_URL=http://127.0.0.1:30003 python ...
+"""
+
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class MegaStubHandler(BaseHTTPRequestHandler):
+    # keep-alive, like the envoy gateway
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # headers and body are separate writes, don't let nagle hold the body back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        stub.record(query.get("action"), query.get("id"), self.client_address)
+
+        if stub.latency:
+            time.sleep(stub.latency)
+        if url.path != "/api/megaJobManager.v1":
+            return self.reply(404, {"error": "not found"})
+        if stub.inject_error():
+            return self.reply(stub.error_status, {"error": "injected"})
+        if query.get("action") == "getLatest":
+            return self.reply(200, {"id": query["id"] + "~v1"})
+        if query.get("action") == "execute":
+            stub.execute(query["id"])
+            return self.reply(200, {})
+        return self.reply(400, {"error": "unknown action"})
+
+    def reply(self, status, body):
+        body = json.dumps(body).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MegaStub:
+    """This class runs the stand-in server on a local port in a background thread
+
+    Attributes:
+        latency (float): seconds every request takes
+        error_rate (float): share of the requests failed with error_status
+        error_status (int): status of a failed request
+        seed (int): seed of the injected errors, for repeatable runs
+        port (int): port to listen on, any free port if 0
+        requests (list): (action, id) of every request
+        connections (set): client addresses the requests came in on
+        executions (Counter): versioned job id => jobs executed
+        errors (int): requests failed
+    """
+
+    def __init__(
+        self, latency=0.0, error_rate=0.0, error_status=503, seed=None, port=0
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.requests = []
+        self.connections = set()
+        self.executions = Counter()
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), MegaStubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.base_url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = None
+
+    def record(self, action, job_id, client_address):
+        with self.lock:
+            self.requests.append((action, job_id))
+            self.connections.add(client_address)
+
+    def inject_error(self):
+        with self.lock:
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+    def execute(self, versioned_job_id):
+        with self.lock:
+            self.executions[versioned_job_id] += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the MEGA API")
+    parser.add_argument("--port", type=int, default=30003)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per request"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    stub = MegaStub(
+        args.latency, args.error_rate, args.error_status, args.seed, args.port
+    )
+    print("MEGA stand-in on " + stub.base_url)
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+        print("executions: " + json.dumps(dict(stub.executions)))
+
+
+if __name__ == "__main__":
+    main()
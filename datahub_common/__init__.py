@@ -0,0 +1,15 @@
+"""
+    This package holds the modules shared by the DataHub lambdas:
+        partner_artifact: format and build of the compiled partner artifact
+        mega: MEGA client executing the jobs, job index and dispatch alerts,
+            used by datahub_job_runner and datahub_degree_validator (pipeline mode)
+
+    A lambda never imports the package of another lambda, which is not deployed
+    with it. The datahub_common folder is packaged with every lambda instead, next
+    to its own folder, eg. for the job runner:
+        zip -r datahub_job_runner.zip datahub_job_runner datahub_common
+
+    The shared modules only depend on the standard library and boto3, mega also
+    needs requests: it is in the job runner layer, add it to the validator layer
+    to run the validator in the pipeline mode (DATAHUB_DISPATCH_JOBS=1).
+"""
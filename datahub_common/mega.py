@@ -0,0 +1,330 @@
+'''
+    This module is the MEGA client shared by datahub_job_runner and the pipeline mode
+    of datahub_degree_validator (DATAHUB_DISPATCH_JOBS=1):
+        - MegaJob: executes the latest version of a MEGA job
+        - post_mega: MEGA requests on a keep-alive session, retried with backoff
+        - get_job_keys: MEGA job of every s3 key template, from the partner artifact
+          or the cached jobs csv
+        - log and send_email: dispatch metrics and failure alerts
+    It is packaged with both lambdas, see datahub_common/__init__.py
+'''
+
+import csv
+import json
+import logging
+import os
+import random
+import threading
+import time
+import boto3
+import requests
+import urllib3
+from botocore.exceptions import ClientError
+from datahub_common.partner_artifact import PARTNER_ARTIFACT_FORMAT
+
+s3 = boto3.client('s3')
+
+# MEGA API, eg. a local stand-in: python -m benchmarks.mega_stub
+MEGA_BASE_URL = os.environ.get('MEGA_BASE_URL', 'http://envoy-gateway.prod.dkandu.me:30003')
+MEGA_HTTP_HEADERS = {
+    'X-Coursera-Source': 'Internal',
+    'X-Coursera-Destination-Service': 'mega'
+}
+# (connect, read) timeouts of a MEGA request in seconds
+MEGA_TIMEOUT = (3.05, 10)
+# attempts of a MEGA request and the first backoff delay in seconds
+MEGA_RETRIES = 3
+MEGA_RETRY_DELAY = 0.2
+MEGA_RETRY_STATUSES = (429, 500, 502, 503, 504)
+# keep-alive connections kept by the MEGA session
+MEGA_POOL_SIZE = 10
+# seconds a job's latest versioned id is reused before getLatest is called again
+LATEST_ID_TTL = int(os.environ.get('LATEST_ID_TTL', '300'))
+
+# MEGA session and latest ids of this Lambda container: job id => (latest id, fetched at)
+_mega_session = None
+_latest_ids = {}
+_mega_lock = threading.Lock()
+
+# export of s3 jobs to s3: https://tools.coursera.org/mega/s3Export/SUy04I2YEemSJm-AiuSdSA~S3_EXPORT_JOB
+JOBS_BUCKET = 'oaljadda'
+JOBS_KEY = 'jobs/s3_import_jobs.csv'
+# partner artifact loaded by this Lambda container
+_partner_artifact = None
+# seconds the job index is used before it is revalidated against the jobs csv
+JOB_INDEX_TTL = int(os.environ.get('JOB_INDEX_TTL', '300'))
+
+
+class JobIndex:
+    '''
+    Index of the MEGA job of every s3 key template, kept by a warm Lambda container
+    Once the TTL expires the jobs csv is revalidated by its ETag and
+    downloaded again only when it changed
+    '''
+
+    def __init__(self, bucket=JOBS_BUCKET, key=JOBS_KEY, ttl=JOB_INDEX_TTL, client=None):
+        self.bucket = bucket
+        self.key = key
+        self.ttl = ttl
+        self.client = client
+        self.keys = None
+        self.etag = None
+        self.checked_at = 0
+        self.lookups = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        '''
+        Returns the index: s3_key => [mega_job_id, script_url]
+        '''
+        with self.lock:
+            self.lookups += 1
+            if self.keys is not None and time.time() - self.checked_at < self.ttl:
+                self.hits += 1
+                self.log_lookup('hit')
+                return self.keys
+
+            start = time.perf_counter()
+            client = self.client or s3
+            try:
+                if self.etag:
+                    res = client.get_object(Bucket=self.bucket, Key=self.key, IfNoneMatch=self.etag)
+                else:
+                    res = client.get_object(Bucket=self.bucket, Key=self.key)
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('304', 'NotModified'):
+                    # unchanged since the last download
+                    self.checked_at = time.time()
+                    self.hits += 1
+                    self.log_lookup('revalidated', start)
+                    return self.keys
+                if self.keys is None:
+                    raise
+                # keep running on the last index while the jobs csv cannot be read
+                logging.exception(e)
+                self.log_lookup('stale', start)
+                return self.keys
+
+            self.keys = parse_job_keys(res['Body'].read().decode('utf-8'))
+            self.etag = res.get('ETag')
+            self.checked_at = time.time()
+            self.log_lookup('refreshed', start)
+            return self.keys
+
+    def log_lookup(self, result, start=None):
+        tags = ['result:{}'.format(result),
+                'hit_rate:{:.3f}'.format(self.hits / self.lookups)]
+        if start is not None:
+            tags.append('latency_ms:{:.1f}'.format((time.perf_counter() - start) * 1000))
+        log(metric_name='job_index_lookup', tags=tags)
+
+
+job_index = JobIndex()
+
+
+class MegaJob:
+    def __init__(self, jobId, user='datahub@coursera.org'):
+        self.base_url = MEGA_BASE_URL
+        self.http_headers = MEGA_HTTP_HEADERS
+        self.jobId = jobId
+        self.user = user
+        self.latest_id = get_latest_id(self.jobId)
+        # print(self.latest_id)
+
+    def execute_mega_job(self):
+        MEGA_JOB_EXECUTE_TEMPLATE = self.base_url + \
+            '/api/megaJobManager.v1?action=execute&id={versioned_job_id}&requesterEmailOverride={user}'
+
+        # a job must not run twice: only retried when MEGA did not take the request
+        return post_mega(MEGA_JOB_EXECUTE_TEMPLATE.format(
+            versioned_job_id=self.latest_id, user=self.user), idempotent=False)
+
+
+def get_latest_id(job_id):
+    '''
+    Returns the latest versioned id of a MEGA job, cached for LATEST_ID_TTL seconds
+    '''
+    with _mega_lock:
+        cached = _latest_ids.get(job_id)
+    if cached is not None and time.time() - cached[1] < LATEST_ID_TTL:
+        return cached[0]
+
+    MEGA_JOB_LATEST_TEMPLATE = MEGA_BASE_URL + \
+        '/api/megaJobManager.v1?action=getLatest&id={job_id}'
+    latest_id = post_mega(MEGA_JOB_LATEST_TEMPLATE.format(job_id=job_id)).json()['id']
+    with _mega_lock:
+        _latest_ids[job_id] = (latest_id, time.time())
+    return latest_id
+
+
+def get_mega_session():
+    '''
+    Returns the keep-alive session shared by the MEGA requests
+    '''
+    global _mega_session
+    with _mega_lock:
+        if _mega_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MEGA_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _mega_session = session
+        return _mega_session
+
+
+def post_mega(url, idempotent=True, retries=None, delay=None):
+    '''
+    Posts a MEGA request, backing off with jitter on transient failures
+    A request which is not idempotent is only retried when MEGA did not take it:
+    connection failures and 429/503 responses
+    '''
+    retries = retries or MEGA_RETRIES
+    delay = MEGA_RETRY_DELAY if delay is None else delay
+    retry_statuses = MEGA_RETRY_STATUSES if idempotent else (429, 503)
+    for attempt in range(retries):
+        last_attempt = attempt == retries - 1
+        try:
+            res = get_mega_session().post(url, headers=MEGA_HTTP_HEADERS, json={}, timeout=MEGA_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if last_attempt or (is_request_sent(e) and not idempotent):
+                raise
+        else:
+            if res.status_code not in retry_statuses or last_attempt:
+                res.raise_for_status()
+                return res
+        log(metric_name='mega_request_retry', tags=['attempt:{}'.format(attempt + 1)])
+        time.sleep(delay * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def is_execute_sent(error):
+    '''
+    Tells if a failed execute request may have run the job: MEGA took it unless the
+    connection failed or MEGA refused it (4xx, 503)
+    '''
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return is_request_sent(error)
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500 and error.response.status_code != 503
+    return True
+
+
+def is_request_sent(error):
+    '''
+    Tells if a failed request may have reached MEGA, only connection failures did not
+    '''
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return False
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return not isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def get_job_keys():
+    '''
+    Returns the MEGA job of every s3 key template: s3_key => [mega_job_id, script_url]
+    The compiled partner artifact is used when PARTNER_ARTIFACT is set
+    (a bundled file or s3://bucket/key), otherwise the jobs csv is read
+    '''
+    global _partner_artifact
+    artifact_file = os.environ.get('PARTNER_ARTIFACT')
+    if artifact_file:
+        try:
+            if _partner_artifact is None:
+                _partner_artifact = load_partner_artifact(artifact_file)
+            return _partner_artifact['jobs']
+        except BaseException as e:
+            # fall back to the jobs csv
+            logging.exception(e)
+
+    # query to get s3 jobs: https://tools.coursera.org/mega/latestquery/0ZjJII2XEemSJm-AiuSdSA
+    return job_index.get()
+
+
+def parse_job_keys(body):
+    '''
+    Returns the MEGA job of every s3 key template of the jobs csv
+    '''
+    reader = csv.DictReader(body.splitlines(True))
+    keys = {}
+    for line in reader:
+        keys[line['s3_key']] = [line['mega_job_id'], line['script_url']]
+    return keys
+
+
+def load_partner_artifact(artifact_file):
+    '''
+    Loads the compiled partner artifact from a file or s3://bucket/key
+    '''
+    if artifact_file.startswith('s3://'):
+        bucket, _, key = artifact_file[len('s3://'):].partition('/')
+        body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+    else:
+        with open(artifact_file, 'rb') as artifact:
+            body = artifact.read()
+    artifact = json.loads(body)
+    if artifact.get('format') != PARTNER_ARTIFACT_FORMAT:
+        raise ValueError('Unsupported partner artifact format: {}'.format(artifact.get('format')))
+    return artifact
+
+
+def log(metric_name, metric_type='count', metric_value=1, tags=[]):
+    '''
+    DataDog log format for future integration:
+    https://docs.datadoghq.com/integrations/amazon_lambda/
+    MONITORING|unix_epoch_timestamp|metric_value|metric_type|my.metric.name|#tag1:value,tag2
+    print("MONITORING|{}|{}|{}|{}|#{}".format(
+        int(time.time()), metric_value, metric_type, 'hasher.lambda.' + metric_name, ','.join(tags)
+    ))
+    '''
+    # Print JSON for Insights to parse and query
+    log_dict = {}
+    log_dict['metric'] = metric_name
+    for tag in tags:
+        k = tag.split(':')[0]
+        v = tag.split(':')[1]
+        log_dict[k] = v
+    print(json.dumps(log_dict))
+
+
+# Send Alert Email
+
+
+def send_email(metric_name, tags, jobId):
+    '''
+    This method sends an email
+
+    '''
+    fromEmail = "datahub@coursera.org"
+    replyTo = "datahub@coursera.org"
+
+    subject = metric_name
+    client = boto3.client('ses')
+    toEmail = ["data-engineering-team@coursera.org",
+               "sam@coursera.org", "mfitzmaurice@coursera.org"]
+    message = "\n\n" + metric_name + ": For " + \
+        tags[1] + " " + tags[0] + " " + jobId
+    response = client.send_email(
+        Source=fromEmail,
+        Destination={
+            'ToAddresses': toEmail,
+        },
+        Message={
+            'Subject': {
+                'Data': subject,
+                'Charset': 'utf8'
+            },
+            'Body': {
+                'Text': {
+                    'Data': message,
+                    'Charset': 'utf8'
+                }
+            }
+        },
+        ReplyToAddresses=[
+            replyTo
+        ]
+    )
+    # Print Message in Cloud watch.
+    print(response)
+    print(message)
+    return None
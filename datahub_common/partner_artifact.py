@@ -0,0 +1,303 @@
+"""
+    This script is the DataHub Partner Artifact build:
+    Compiles the partner knowledge the three lambdas parse from csv files into one
+    versioned json artifact they load at init:
+        1. Partner schedule rows (datahub_daily_check, Settings.get_partner_schedule)
+           with a partner index of programs, run hours, contacts and file rules
+        2. File name swap rules, parsed once (Settings.get_swap_rules)
+        3. MEGA job of every s3 key template (datahub_job_runner)
+
+    datahub_daily_check/partner_schedule.csv is the source of truth of the partner
+    schedule. The other copies, eg. the partner_schedule.csv of the validator settings,
+    are passed with --schedule-copy: the build fails if a copy differs from it.
+
+    The check step rebuilds the artifact from the source csv files and reports every
+    section which is out of date, eg. in a deploy pipeline before shipping the artifact.
+
+    The lambdas load the artifact when configured, else they read the csv files:
+        datahub_daily_check: PARTNER_ARTIFACT, artifact bundled with the function
+        datahub_job_runner: PARTNER_ARTIFACT, bundled artifact or s3://bucket/key
+        datahub_degree_validator: DATAHUB_PARTNER_ARTIFACT, key in the settings bucket
+
+    The lambdas only import PARTNER_ARTIFACT_FORMAT from this module, the build
+    helpers of the lambdas are imported by the build itself.
+
+    Usage:
+        python -m datahub_common.partner_artifact build \\
+            --schedule datahub_daily_check/partner_schedule.csv \\
+            --schedule-copy settings/partner_schedule.csv \\
+            --jobs s3_import_jobs.csv --output partner_artifact.json
+        python -m datahub_common.partner_artifact check \\
+            --artifact partner_artifact.json \\
+            --schedule datahub_daily_check/partner_schedule.csv \\
+            --schedule-copy settings/partner_schedule.csv \\
+            --jobs s3_import_jobs.csv
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+from collections import OrderedDict
+from datetime import datetime
+
+# format of the compiled partner artifact, the lambdas refuse other formats
+PARTNER_ARTIFACT_FORMAT = 1
+
+# sections of the artifact built from the source csv files
+SECTIONS = ("schedule", "partners", "swap_rules", "jobs")
+
+
+class ScheduleMismatch(ValueError):
+    """Raised when a copy of the partner schedule differs from the source of truth"""
+
+
+def read_csv_rows(file_name):
+    """This function reads a csv file, missing values are None (pandas reads NaN)
+
+    return:
+        rows (list): OrderedDict of every row which is not empty
+    """
+    from datahub_daily_check.datahub_daily_check import NA_VALUES
+
+    rows = []
+    with open(file_name, encoding="utf-8-sig", newline="") as csv_file:
+        for row in csv.DictReader(csv_file):
+            row = OrderedDict(
+                (col, None if value is None or value in NA_VALUES else value)
+                for col, value in row.items()
+            )
+            if any(value is not None for value in row.values()):
+                rows.append(row)
+    return rows
+
+
+def get_sha256(file_name):
+    with open(file_name, "rb") as source:
+        return hashlib.sha256(source.read()).hexdigest()
+
+
+def build_schedule(schedule_file):
+    """This function compiles the partner schedule
+
+    return:
+        schedule (list): raw schedule rows, None for missing values
+        partners (OrderedDict): partner => programs, run_hours, partner_emails,
+            internal_emails, ignore_files and date_offsets
+        swap_rules (list): [partner, program, file, swapped file] of every swap
+    """
+    from datahub_daily_check.datahub_daily_check import (
+        SCHEDULE_COLUMNS,
+        get_date_offsets,
+        get_ignore_rules,
+        get_schedule_row,
+    )
+    from datahub_degree_validator.datahub_degree_validator import get_swap_rules
+
+    schedule = [
+        OrderedDict((col, row.get(col)) for col in SCHEDULE_COLUMNS)
+        for row in read_csv_rows(schedule_file)
+    ]
+    partners = OrderedDict()
+    swap_rules = []
+    for raw_row in schedule:
+        row = get_schedule_row(list(raw_row.values()))
+        swap_rules += get_swap_rules(row.partner, raw_row["swap_files"] or "nan")
+        partner = partners.get(row.partner)
+        if partner is None:
+            # the first schedule row of a partner holds its contacts
+            partner = partners[row.partner] = OrderedDict(
+                [
+                    ("programs", []),
+                    ("run_hours", []),
+                    ("partner_emails", raw_row["partner_emails"]),
+                    ("internal_emails", raw_row["internal_emails"]),
+                    ("ignore_files", {}),
+                    ("date_offsets", {}),
+                ]
+            )
+        partner["programs"] += [x for x in row.programs.split(",") if x != ""]
+        partner["run_hours"] += [x for x in row.run_hour.split(",") if x != ""]
+        if row.ignore_files != "nan":
+            for program, files in get_ignore_rules(
+                row.partner, row.ignore_files
+            ).items():
+                partner["ignore_files"].setdefault(program, files)
+        for program, offsets in get_date_offsets(row.partner, row.date_offsets).items():
+            partner["date_offsets"].setdefault(program, {}).update(offsets)
+    return schedule, partners, swap_rules
+
+
+def get_schedule_mismatches(schedule, copy_file):
+    """This function compares a copy of the partner schedule with the source of truth
+
+    return:
+        partners (list): partners whose rows differ in the copy
+    """
+    rows = {}
+    for copy, copy_rows in enumerate([schedule, build_schedule(copy_file)[0]]):
+        for row in copy_rows:
+            rows.setdefault(str(row["partner"]), ([], []))[copy].append(row)
+    return sorted(
+        partner for partner, (rows_a, rows_b) in rows.items() if rows_a != rows_b
+    )
+
+
+def build_jobs(jobs_file):
+    """This function compiles the MEGA job of every s3 key template
+
+    return:
+        jobs (OrderedDict): s3_key => [mega_job_id, script_url]
+    """
+    jobs = OrderedDict()
+    for row in read_csv_rows(jobs_file):
+        jobs[row["s3_key"]] = [row["mega_job_id"], row["script_url"]]
+    return jobs
+
+
+def build_artifact(schedule_file, jobs_file=None, schedule_copies=()):
+    """This function compiles the partner artifact from its source csv files
+
+    Attributes:
+        schedule_file (str): partner_schedule.csv, the source of truth
+        jobs_file (str): job runner s3_import_jobs.csv, optional
+        schedule_copies (list): other partner_schedule.csv copies which must not
+            differ from schedule_file
+    return:
+        artifact (OrderedDict): format, version, built_at, sources and SECTIONS
+    raises:
+        ScheduleMismatch: a copy of the partner schedule differs
+    """
+    schedule, partners, swap_rules = build_schedule(schedule_file)
+    for copy_file in schedule_copies:
+        partners_changed = get_schedule_mismatches(schedule, copy_file)
+        if partners_changed:
+            raise ScheduleMismatch(
+                copy_file
+                + " differs from "
+                + schedule_file
+                + " for partners: "
+                + ", ".join(partners_changed)
+            )
+    content = OrderedDict(
+        [
+            ("schedule", schedule),
+            ("partners", partners),
+            ("swap_rules", swap_rules),
+            ("jobs", build_jobs(jobs_file) if jobs_file else {}),
+        ]
+    )
+    sources = OrderedDict(
+        (
+            name,
+            OrderedDict(
+                [
+                    ("file", os.path.basename(file_name)),
+                    ("sha256", get_sha256(file_name)),
+                ]
+            ),
+        )
+        for name, file_name in [("schedule", schedule_file), ("jobs", jobs_file)]
+        if file_name
+    )
+
+    artifact = OrderedDict(
+        [
+            ("format", PARTNER_ARTIFACT_FORMAT),
+            ("version", get_version(content)),
+            ("built_at", datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")),
+            ("sources", sources),
+        ]
+    )
+    artifact.update(content)
+    return artifact
+
+
+def get_version(content):
+    """This function returns the content hash versioning an artifact"""
+    body = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode("utf8")).hexdigest()[:16]
+
+
+def check_artifact(artifact, schedule_file, jobs_file=None, schedule_copies=()):
+    """This function checks an artifact is consistent with its source csv files
+
+    return:
+        problems (list): description of every inconsistency, empty if consistent
+    """
+    problems = []
+    if artifact.get("format") != PARTNER_ARTIFACT_FORMAT:
+        return [
+            "format "
+            + str(artifact.get("format"))
+            + " is not "
+            + str(PARTNER_ARTIFACT_FORMAT)
+        ]
+
+    try:
+        expected = build_artifact(schedule_file, jobs_file, schedule_copies)
+    except ScheduleMismatch as e:
+        return [str(e)]
+    for name, source in expected["sources"].items():
+        if artifact["sources"].get(name, {}).get("sha256") != source["sha256"]:
+            problems.append(
+                "source " + name + ": " + source["file"] + " changed since the build"
+            )
+    for section in SECTIONS:
+        # compare the json forms, the artifact was read back from json
+        if json.loads(json.dumps(expected[section])) != artifact.get(section):
+            problems.append("section " + section + " is out of date")
+    if artifact.get("version") != get_version(
+        OrderedDict((s, artifact.get(s)) for s in SECTIONS)
+    ):
+        problems.append("version does not match the artifact content")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build or check the DataHub partner artifact"
+    )
+    parser.add_argument("command", choices=["build", "check"])
+    parser.add_argument("--schedule", required=True, help="partner_schedule.csv")
+    parser.add_argument(
+        "--schedule-copy",
+        action="append",
+        default=[],
+        help="copy of partner_schedule.csv which must not differ, repeatable",
+    )
+    parser.add_argument("--jobs", help="job runner s3_import_jobs.csv")
+    parser.add_argument(
+        "--output", default="partner_artifact.json", help="artifact to build"
+    )
+    parser.add_argument(
+        "--artifact", default="partner_artifact.json", help="artifact to check"
+    )
+    args = parser.parse_args(argv)
+    sources = (args.schedule, args.jobs, args.schedule_copy)
+
+    if args.command == "build":
+        try:
+            artifact = build_artifact(*sources)
+        except ScheduleMismatch as e:
+            print("partner artifact not built: " + str(e))
+            return 1
+        with open(args.output, "w") as output:
+            json.dump(artifact, output, separators=(",", ":"))
+        print("partner artifact " + artifact["version"] + ": " + args.output)
+        return 0
+
+    with open(args.artifact) as artifact_file:
+        artifact = json.load(artifact_file)
+    problems = check_artifact(artifact, *sources)
+    for problem in problems:
+        print("partner artifact " + str(artifact.get("version")) + ": " + problem)
+    if not problems:
+        print("partner artifact " + artifact["version"] + " is consistent")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,19 +23,87 @@
             5. zip the python file
             6. add the python.zip file to the lambda layer and select python 3.7 under compartible runtime.
             7. go to the datahub_daily_check and select layers and under select the layer you created.
-    To do:
-        1. Add backdating feature to remove static code for macquarie application file.
+    Range mode:
+        To find the files missed over several days (eg. after an outage) invoke the function with
+        {"time": ..., "start_date": "yyyymmdd", "end_date": "yyyymmdd"}, optionally "partners": [...].
+        Partner emails are not sent, a single report is written to the reports folder.
 '''
 
-import pandas as pd
+import csv
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
 import boto3
 import logging
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from datahub_common.partner_artifact import PARTNER_ARTIFACT_FORMAT
+
+# bound on concurrent s3 requests when checking for expected files
+MAX_WORKERS = 16
+
+# bound on concurrent ses requests, keep it under the account sending rate
+SES_MAX_WORKERS = 4
+# attempts of a throttled email and the first backoff delay in seconds
+SES_RETRIES = 5
+SES_RETRY_DELAY = 0.5
+SES_THROTTLING_CODES = ('Throttling', 'ThrottlingException', 'TooManyRequestsException')
+# recipients of the internal digest of all the partners with missing files
+DIGEST_EMAILS = os.environ.get("DIGEST_EMAILS", "data-engineering-team@coursera.org")
+
+# ses client shared by the deliveries of this Lambda container
+_ses_client = None
+_ses_client_lock = threading.Lock()
+
+# arrival index maintained from the s3 events of the partner bucket and the state of the
+# scheduled check, kept in a DynamoDB table whose partition key is the string state_key
+STATE_TABLE = os.environ.get("STATE_TABLE", "datahub_daily_check_state")
+ARRIVALS_PREFIX = "arrivals/"
+# an index not refreshed by an arrival event for this long is confirmed against the bucket
+ARRIVALS_MAX_AGE = timedelta(hours=2)
+# index object holding when the index was last refreshed
+INDEX_OBJECT = "index"
+# the refresh stamp is only rewritten when older than this, not by every arrival event
+ARRIVALS_REFRESH_INTERVAL = timedelta(minutes=5)
+# arrivals added by one update of a day item, bounded by the update expression size
+ARRIVALS_PER_UPDATE = 50
+# bucket of the range mode reports
+ARRIVALS_BUCKET = "coursera-data-engineering"
+
+# state of the scheduled check, eg. the watermark of the last run
+STATE_PREFIX = "state/"
+# missed triggers older than this are not caught up
+CATCHUP_MAX = timedelta(days=1)
+# consolidated reports of the range mode
+REPORTS_PREFIX = "datahub/datahub_daily_check/reports/"
+
+# schedule engines compiled by this Lambda container: metadata file => (mtime, engine)
+_schedule_engines = {}
+
+# partner schedule columns, missing values are read as 'nan'
+SCHEDULE_COLUMNS = ['partner', 'programs', 'partner_emails', 'internal_emails',
+                    'run_hour', 'ignore_files', 'swap_files', 'date_offsets']
+# values read as missing, like pandas.read_csv does
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+             '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None',
+             'n/a', 'nan', 'null'}
 
 
 def main(event, context):
     """ This method is the Lambda event handler triggered by
         DatahubFileScheduleCheck event rule in cloud watch
 
+        Only the partners whose run hour falls between the last run
+        (the watermark) and now are checked, so a delayed or missed
+        trigger is caught up on the next invocation.
+
         Parameters
         ----------
             event: dictionary:
@@ -44,28 +112,44 @@ def main(event, context):
                 Contains context payload for the event
     """
     bucket_name = "coursera-degrees-data"
-    s3 = boto3.resource('s3')
-    s3_bucket = s3.Bucket(name=bucket_name)
 
     error = "wrong Data"
-    metadata_file = "partner_schedule.csv"
+    # the compiled partner artifact when it is bundled, see datahub_common/partner_artifact.py
+    metadata_file = os.environ.get("PARTNER_ARTIFACT", "partner_schedule.csv")
 
-    date_placeholder = event["time"][:10].replace("-", "") + ".csv"
-    time_check = event["time"][11:16]
+    check_time = parse_event_time(event["time"])
+
+    if event.get("start_date"):
+        return main_range(event, bucket_name, metadata_file)
 
     try:
 
-        partner_schedule = get_partner_shedule(metadata_file)
+        schedule_engine = get_schedule_engine(metadata_file)
+
+        watermark = Watermark(DynamoArrivalStore(prefix=STATE_PREFIX))
+        last_run, etag = watermark.load()
+
+        due_triggers = schedule_engine.get_due_triggers(last_run, check_time)
+        if due_triggers:
+            s3 = boto3.resource('s3')
+            s3_bucket = s3.Bucket(name=bucket_name)
 
-        partner_files, time_schedule = get_partner_files(
-            partner_schedule, date_placeholder)
+            arrival_index = None
+            if os.environ.get("ARRIVAL_INDEX", "1") == "1":
+                arrival_index = ArrivalIndex(DynamoArrivalStore())
 
-        check_all_bucket_folders(
-            partner_files,
-            time_check,
-            time_schedule,
-            partner_schedule,
-            s3_bucket)
+            etag = run_due_checks(
+                schedule_engine,
+                due_triggers,
+                s3_bucket,
+                arrival_index=arrival_index,
+                check_time=check_time,
+                watermark=watermark,
+                etag=etag)
+
+        # a late event never moves the watermark back
+        if etag is not False and (last_run is None or check_time > last_run):
+            watermark.advance(check_time, etag)
 
         error = "Success"
     except BaseException as e:
@@ -77,6 +161,348 @@ def main(event, context):
     return(error)
 
 
+def main_range(event, bucket_name, metadata_file):
+    """ This method handles a range mode event, see the module documentation
+
+        return
+        ------
+            report: dict
+                consolidated report of the missing files, see check_date_range
+    """
+    s3 = boto3.resource('s3')
+    s3_bucket = s3.Bucket(name=bucket_name)
+
+    schedule_rows = load_schedule(metadata_file)
+    report = check_date_range(
+        schedule_rows,
+        event["start_date"],
+        event.get("end_date", event["start_date"]),
+        s3_bucket,
+        partners=event.get("partners"))
+
+    report_key = REPORTS_PREFIX + "range_" + report['start_date'] + "_" + report['end_date'] + ".json"
+    s3.Object(ARRIVALS_BUCKET, report_key).put(Body=json.dumps(report, indent=2))
+    print("Missing files: " + str(report['missing']) + " of " + str(report['expected'])
+          + ": report: s3://" + ARRIVALS_BUCKET + "/" + report_key)
+    return report
+
+
+def run_due_checks(schedule_engine, due_triggers, s3_bucket, arrival_index=None, check_time=None,
+                   watermark=None, etag=None):
+    """ This checks the files of the partners due at each trigger
+
+        Every trigger is claimed by advancing the watermark to it before it is
+        checked, so two overlapping checks never both alert for a trigger and a
+        failure later in a catch up does not check the earlier ones again. A
+        trigger whose check fails is released for the next invocation.
+
+        Parameters
+        ----------
+            schedule_engine: ScheduleEngine
+                compiled partner schedule
+            due_triggers: list
+                (trigger time, partners) from ScheduleEngine.get_due_triggers
+            s3_bucket:
+                S3 bucket where the folders and file are located
+            arrival_index: ArrivalIndex
+                optional index of arrived files, looked up before the bucket
+            check_time: datetime
+                time of the check, used to tell if the arrival index is stale
+            watermark: Watermark
+                optional watermark advanced to each checked trigger
+            etag:
+                version of the watermark when it was loaded
+        return
+        ------
+            etag:
+                version of the advanced watermark, False if a concurrent
+                check moved it and this one stopped
+    """
+    for trigger_time, partners in due_triggers:
+        # a caught up trigger checks the files of its own day
+        date_placeholder = trigger_time.strftime("%Y%m%d") + ".csv"
+        time_check = trigger_time.strftime("%H:%M")
+
+        schedule_rows = schedule_engine.get_schedule_rows(partners)
+        expected_files, run_hours = get_schedule_manifest(
+            schedule_rows, date_placeholder)
+
+        if watermark is not None:
+            etag = watermark.advance(trigger_time, etag)
+            if etag is False:
+                return False
+
+        try:
+            check_partner_index(
+                build_partner_index(expected_files, run_hours, schedule_rows),
+                time_check,
+                s3_bucket,
+                arrival_index=arrival_index,
+                check_time=check_time)
+        except BaseException:
+            if watermark is not None:
+                # moved back just before the trigger, the next invocation checks it again
+                watermark.advance(trigger_time - timedelta(minutes=1), etag)
+            raise
+    return etag
+
+
+def record_arrival(event, context=None):
+    """ This method is the Lambda event handler triggered for every file
+        landing in the partner bucket, it records the file in the arrival index
+
+        Parameters
+        ----------
+            event: dictionary:
+                Contains the s3 (CloudTrail) event payload
+            context:
+                Contains context payload for the event
+        return
+        ------
+            recorded: bool
+                True if the file was added to the index
+    """
+    try:
+        key = event['detail']['requestParameters']['key']
+        arrival_time = parse_event_time(event['time'])
+    except (KeyError, ValueError) as e:
+        logging.exception(e)
+        return False
+    return ArrivalIndex(DynamoArrivalStore()).record(key, arrival_time)
+
+
+def parse_event_time(event_time):
+    """ This returns the datetime of an event time: yyyy-mm-ddThh:mm:ssZ """
+    return datetime.strptime(event_time[:19], "%Y-%m-%dT%H:%M:%S")
+
+
+def get_schedule_engine(metadata_file):
+    """ This returns the compiled schedule of a metadata file
+
+        The schedule is compiled once per Lambda container and
+        recompiled only when the metadata file changes.
+    """
+    mtime = os.path.getmtime(metadata_file)
+    cached = _schedule_engines.get(metadata_file)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, ScheduleEngine(load_schedule(metadata_file)))
+        _schedule_engines[metadata_file] = cached
+    return cached[1]
+
+
+class ScheduleEngine:
+    """ This class compiles the partner schedule into a trigger table
+
+        The table maps every minute of the day holding a run hour
+        to the partners to check at that minute.
+
+        Attributes
+        ----------
+            schedule_rows: list
+                ScheduleRow of the partner schedule
+            triggers: dict
+                minute of the day => list of partners
+            minutes: list
+                sorted minutes of the day holding a trigger
+    """
+
+    def __init__(self, schedule_rows):
+        self.schedule_rows = schedule_rows
+        self.triggers = {}
+
+        for row in schedule_rows:
+            for run_hour in row.run_hour.split(","):
+                minute = get_minute_of_day(run_hour)
+                if minute is None:
+                    continue
+                partners = self.triggers.setdefault(minute, [])
+                if row.partner not in partners:
+                    partners.append(row.partner)
+
+        self.minutes = sorted(self.triggers)
+
+    def get_due_triggers(self, last_run, check_time, max_catchup=CATCHUP_MAX):
+        """ This returns the triggers due since the last run
+
+            Parameters
+            ----------
+                last_run: datetime
+                    time of the last run, None to check the current minute only
+                check_time: datetime
+                    time of the check
+                max_catchup: timedelta
+                    bound on how far back missed triggers are caught up
+            return
+            ------
+                due_triggers: list
+                    (trigger time, partners) of the minutes in (last_run, check_time]
+        """
+        end = check_time.replace(second=0, microsecond=0)
+        if last_run is None:
+            start = end - timedelta(minutes=1)
+        else:
+            start = max(last_run.replace(second=0, microsecond=0), end - max_catchup)
+
+        due_triggers = []
+        day = datetime(start.year, start.month, start.day)
+        while day <= end:
+            for minute in self.minutes:
+                trigger_time = day + timedelta(minutes=minute)
+                if start < trigger_time <= end:
+                    due_triggers.append((trigger_time, self.triggers[minute]))
+            day += timedelta(days=1)
+        return due_triggers
+
+    def get_schedule_rows(self, partners):
+        """ This returns the schedule rows of the given partners """
+        return [row for row in self.schedule_rows if row.partner in partners]
+
+
+def get_minute_of_day(run_hour):
+    """ This returns the minute of the day of a run hour: hh:mm, None if not valid """
+    try:
+        hour, minute = run_hour.strip().split(":")
+        hour, minute = int(hour), int(minute)
+    except ValueError:
+        return None
+    if 0 <= hour < 24 and 0 <= minute < 60:
+        return hour * 60 + minute
+    return None
+
+
+class Watermark:
+    """ This class persists the time of the last scheduled check
+
+        Attributes
+        ----------
+            store: DynamoArrivalStore or LocalArrivalStore
+                where the watermark object is kept
+            name: str
+                name of the watermark object
+    """
+
+    def __init__(self, store, name="watermark"):
+        self.store = store
+        self.name = name
+
+    def load(self):
+        """ This returns the (last run time, etag), (None, None) if never run """
+        data, etag = self.store.load(self.name)
+        if data is None:
+            return None, None
+        return parse_event_time(data['last_run']), etag
+
+    def advance(self, check_time, etag):
+        """ This moves the watermark to the time of a completed check
+
+            return
+            ------
+                etag:
+                    version of the moved watermark, False if a concurrent
+                    check moved the watermark first
+        """
+        data = {'last_run': check_time.strftime("%Y-%m-%dT%H:%M:%S")}
+        etag = self.store.save(self.name, data, etag)
+        if etag is False:
+            print("Watermark moved by a concurrent check, not advanced to " + data['last_run'])
+        return etag
+
+
+@dataclass
+class ScheduleRow:
+    """ This class is a row of the partner schedule, see SCHEDULE_COLUMNS """
+    __slots__ = SCHEDULE_COLUMNS
+    partner: str
+    programs: str
+    partner_emails: str
+    internal_emails: str
+    run_hour: str
+    ignore_files: str
+    swap_files: str
+    date_offsets: str
+
+
+@dataclass
+class ExpectedFile:
+    """ This class is a file expected from a partner """
+    __slots__ = ['partner', 'file']
+    partner: str
+    file: str
+
+
+@dataclass
+class RunHour:
+    """ This class is a time to check the files of a partner: hh:mm """
+    __slots__ = ['partner', 'run_hour']
+    partner: str
+    run_hour: str
+
+
+def load_partner_schedule(metadata_file):
+    """ This method gets the partners' schedules without pandas
+
+        The rows are formatted exactly like get_partner_shedule formats them.
+
+        Parameters
+        ----------
+            metadata_file: string
+                name of the csv metadata file
+        return
+        ------
+            schedule_rows: list
+                ScheduleRow of the partner schedule
+    """
+    schedule_rows = []
+    with open(metadata_file, encoding="utf-8-sig", newline="") as schedule_file:
+        for row in csv.DictReader(schedule_file):
+            values = [row.get(col) for col in SCHEDULE_COLUMNS]
+            values = [None if x is None or x in NA_VALUES else x for x in values]
+            # skip empty rows
+            if all(x is None for x in values):
+                continue
+            schedule_rows.append(get_schedule_row(values))
+    return schedule_rows
+
+
+def get_schedule_row(values):
+    """ This returns the ScheduleRow of raw schedule values, None for missing values """
+    return ScheduleRow(values[0], *[
+        'nan' if x is None else '' if x == ' ' else x for x in values[1:]])
+
+
+def load_partner_artifact(artifact_file):
+    """ This method gets the partners' schedules from the compiled partner artifact
+
+        Parameters
+        ----------
+            artifact_file: string
+                name of the json artifact file
+        return
+        ------
+            schedule_rows: list
+                ScheduleRow of the partner schedule
+    """
+    with open(artifact_file, encoding="utf8") as body:
+        artifact = json.load(body)
+    if artifact.get('format') != PARTNER_ARTIFACT_FORMAT:
+        raise ValueError("Unsupported partner artifact format: " + str(artifact.get('format')))
+    return [get_schedule_row([row.get(col) for col in SCHEDULE_COLUMNS])
+            for row in artifact['schedule']]
+
+
+def load_schedule(metadata_file):
+    """ This loads the schedule rows of a partner artifact (.json) or schedule (.csv) """
+    if metadata_file.endswith(".json"):
+        return load_partner_artifact(metadata_file)
+    return load_partner_schedule(metadata_file)
+
+
+def get_schedule_rows(partner_schedule):
+    """ This returns the ScheduleRow of a partner schedule dataframe """
+    return [ScheduleRow(*[row.get(col, 'nan') for col in SCHEDULE_COLUMNS])
+            for row in partner_schedule.to_dict('records')]
+
+
 def get_partner_shedule(metadata_file):
     """ This method gets the partners' schedules.
 
@@ -89,23 +515,19 @@ def get_partner_shedule(metadata_file):
             partner_schedule: dataframe
                 contains partner schedule info
     """
+    # pandas is only needed by this dataframe api, not by the scheduled check
+    import pandas as pd
+
     partner_schedule = pd.read_csv(metadata_file, encoding="utf8")
-    partner_schedule = partner_schedule.dropna(
-        axis=0, how='all', thresh=None, subset=None, inplace=False)
-
-    # format dataframe data to string removing any white spaces
-    partner_schedule['run_hour'] = partner_schedule['run_hour'].astype(
-        str).replace(" ", "")
-    partner_schedule['programs'] = partner_schedule['programs'].astype(
-        str).replace(" ", "")
-    partner_schedule['internal_emails'] = partner_schedule['internal_emails'].astype(
-        str).replace(" ", "")
-    partner_schedule['partner_emails'] = partner_schedule['partner_emails'].astype(
-        str).replace(" ", "")
-    partner_schedule['ignore_files'] = partner_schedule['ignore_files'].astype(
-        str).replace(" ", "")
-    partner_schedule['swap_files'] = partner_schedule['swap_files'].astype(
-        str).replace(" ", "")
+    partner_schedule = partner_schedule.dropna(axis=0, how='all')
+
+    # format dataframe data to string removing any white spaces,
+    # missing values become 'nan' on every pandas version
+    for col in SCHEDULE_COLUMNS[1:]:
+        if col not in partner_schedule:
+            partner_schedule[col] = 'nan'
+        partner_schedule[col] = partner_schedule[col].fillna(
+            'nan').astype(str).replace(" ", "")
 
     return partner_schedule
 
@@ -126,43 +548,124 @@ def get_partner_files(partner_schedule, date_placeholder):
             time_schedule: dataframe
                 contains times to run the partner programs
     """
-    time_schedule = pd.DataFrame(columns=['partner', 'run_hour'])
-    partner_files = pd.DataFrame(columns=['partner', 'files'])
+    import pandas as pd
 
-    for _, row in partner_schedule.iterrows():
-        row['programs'] = [str(row['partner']) + "/" + str(x)
-                           for x in row['programs'].split(",") if x != '']
+    expected_files, run_hours = get_schedule_manifest(
+        get_schedule_rows(partner_schedule), date_placeholder)
 
-        swap_files = [i.split(",") for i in row['swap_files'].split(
-            ":") if row['swap_files'] != 'nan']
+    partner_files = pd.DataFrame([(x.partner, x.file) for x in expected_files],
+                                 columns=['partner', 'files'])
+    time_schedule = pd.DataFrame([(x.partner, x.run_hour) for x in run_hours],
+                                 columns=['partner', 'run_hour'])
+    return (partner_files, time_schedule)
 
-        for program in row['programs']:
-            ignore_files = []
-            for ignore_program in row['ignore_files'].split('|'):
-                if program == str(row['partner']) + "/" + ignore_program.split(':')[0]:
-                    for j in ignore_program.split(':')[1].split(','):
-                        ignore_files.append(j)
-                    break
+
+def get_schedule_manifest(schedule_rows, date_placeholder):
+    """
+        Parameters
+        ----------
+            schedule_rows: list
+                ScheduleRow of the partner schedule
+            date_placeholder : str
+                The date place holder: yyyymmdd.csv
+
+        return
+        ------
+            expected_files: list
+                ExpectedFile of every partner program
+            run_hours: list
+                RunHour to check the partner programs
+    """
+    expected_files = []
+    run_hours = []
+
+    for row in schedule_rows:
+        programs = [str(row.partner) + "/" + str(x)
+                    for x in row.programs.split(",") if x != '']
+
+        swap_files = [i.split(",") for i in row.swap_files.split(
+            ":") if row.swap_files != 'nan']
+        ignore_rules = get_ignore_rules(row.partner, row.ignore_files)
+        date_offsets = get_date_offsets(row.partner, row.date_offsets)
+
+        for program in programs:
             files_to_check = get_files_to_check(
-                program, date_placeholder, ignore_files, swap_files)
+                program, date_placeholder, ignore_rules.get(program, []), swap_files)
+            program_offsets = date_offsets.get(program, {})
 
             for file in files_to_check:
 
-                # backdate macquarie application file to previous day
-                if "macquarie/mq-global-mba/applications/applications" in file:
-                    file = file.replace(
-                        file[-12:-4], str(int(file[-12:-4]) - 1))
+                # files sent with another date stamp, eg. the previous day
+                offset = program_offsets.get(
+                    file.rsplit("/", 1)[-1][:-len("_" + date_placeholder)])
+                if offset:
+                    file = file[:-len(date_placeholder)] + shift_date_placeholder(
+                        date_placeholder, offset)
 
-                partner_files = partner_files.append(
-                    {'partner': row['partner'], 'files': file}, ignore_index=True)
+                expected_files.append(ExpectedFile(row.partner, file))
 
-        row['run_hour'] = [
-            x for x in row['run_hour'].split(",") if x != '']
-        for x in row['run_hour']:
-            time_schedule = time_schedule.append(
-                {'partner': row['partner'], 'run_hour': x}, ignore_index=True)
+        for x in row.run_hour.split(","):
+            if x != '':
+                run_hours.append(RunHour(row.partner, x))
+
+    return (expected_files, run_hours)
+
+
+def get_ignore_rules(partner, ignore_files):
+    """ This returns the files to ignore for each program of a partner
+
+    Parameters
+    ----------
+        partner : str
+            The name of the partner
+        ignore_files : str
+            ignore_files schedule entry: program:file,file|program:file
+    return
+    ------
+        ignore_rules: dict
+            partner/program => list of files to ignore
+    """
+    ignore_rules = {}
+    for ignore_program in ignore_files.split('|'):
+        program, _, files = ignore_program.partition(':')
+        # the first entry of a program wins
+        ignore_rules.setdefault(str(partner) + "/" + program, files.split(','))
+    return ignore_rules
 
-    return (partner_files, time_schedule)
+
+def get_date_offsets(partner, date_offsets):
+    """ This returns the date offset of each offset file of a partner
+
+    Parameters
+    ----------
+        partner : str
+            The name of the partner
+        date_offsets : str
+            date_offsets schedule entry: program:file:days|program:file:days
+            eg. mq-global-mba:applications:-1 for a file stamped with the previous day
+    return
+    ------
+        date_offsets: dict
+            partner/program => file => days
+    """
+    offsets = {}
+    if date_offsets == 'nan':
+        return offsets
+    for date_offset in date_offsets.split('|'):
+        try:
+            program, file, days = date_offset.split(':')
+            days = int(days)
+        except ValueError:
+            print("Invalid date offset for " + str(partner) + ": " + date_offset)
+            continue
+        offsets.setdefault(str(partner) + "/" + program, {})[file] = days
+    return offsets
+
+
+def shift_date_placeholder(date_placeholder, days):
+    """ This shifts a date place holder: yyyymmdd.csv by a number of days """
+    date = datetime.strptime(date_placeholder[:8], "%Y%m%d") + timedelta(days=days)
+    return date.strftime("%Y%m%d") + date_placeholder[8:]
 
 
 def get_files_to_check(program, date_placeholder, ignore_files, swap_files):
@@ -214,7 +717,8 @@ def get_files_to_check(program, date_placeholder, ignore_files, swap_files):
     return(files)
 
 
-def check_all_bucket_folders(partner_files, time_check, time_schedule, partner_schedule, s3_bucket):
+def check_all_bucket_folders(partner_files, time_check, time_schedule, partner_schedule, s3_bucket,
+                             arrival_index=None, check_time=None):
     """This returns a list of files to check
 
         Parameters
@@ -229,51 +733,606 @@ def check_all_bucket_folders(partner_files, time_check, time_schedule, partner_s
                 list of files to swap
             s3_bucket:
                 S3 bucket where the folders and file are located
+            arrival_index: ArrivalIndex
+                optional index of arrived files, looked up before the bucket
+            check_time: datetime
+                time of the check, used to tell if the arrival index is stale
         return
         ----------
             files: list of files
     """
-    bucket_prefixes = partner_files['partner'].drop_duplicates(
-        keep='first', inplace=False)
-    bucket_prefixes = bucket_prefixes.dropna()
-    files = []
+    check_partner_index(
+        get_partner_index(partner_files, time_schedule, partner_schedule),
+        time_check,
+        s3_bucket,
+        arrival_index=arrival_index,
+        check_time=check_time)
+
+
+def check_partner_index(partner_index, time_check, s3_bucket, arrival_index=None, check_time=None):
+    """ This emails the partners due at a time check about their missing files
 
-    # loop through partner prefix folders
-    for prefix in bucket_prefixes.values.tolist():
-        df2 = partner_files
+        Parameters
+        ----------
+            partner_index: dict
+                partner lookup table, see build_partner_index
+            time_check: str
+                time of the check: hh:mm
+            s3_bucket:
+                S3 bucket where the folders and file are located
+            arrival_index: ArrivalIndex
+                optional index of arrived files, looked up before the bucket
+            check_time: datetime
+                time of the check, used to tell if the arrival index is stale
+    """
+    due_partners = []
+
+    # loop through partner prefix folders to collect the files due now
+    for prefix, partner in partner_index.items():
+        if time_check in partner['run_hours']:
+            due_partners.append((prefix, partner['files'],
+                                 partner['internal_emails'], partner['partner_emails']))
+
+    # check only today's expected files, not the partner's whole history
+    expected = set().union(*[x[1] for x in due_partners])
+    if arrival_index is not None:
+        files, unresolved = arrival_index.lookup(
+            expected, check_time or datetime.utcnow())
+        received = get_received_files(s3_bucket, unresolved)
+        arrival_index.reconcile(received, check_time or datetime.utcnow())
+        files |= received
+    else:
+        files = get_received_files(s3_bucket, expected)
+
+    # collect every message first, then deliver them together
+    emails = []
+    missing_partners = []
+    for prefix, lstfiles, internal_emails, external_emails in due_partners:
         log = ['Files not received for ' + prefix]
         log.append('Time Check: ' + time_check + ' (UTC): Reminder: ')
 
-        time_in_file_Schedule = set(time_schedule['run_hour'].where(
-            time_schedule['partner'] == prefix).dropna(axis='rows', how='all'))
+        inter = set(lstfiles & files)
+        not_sent = [x for x in lstfiles if x not in inter]
+
+        if len(not_sent) > 0:
+            msg = "".join(
+                ["\n\t\t" + x for x in lstfiles if x not in inter])
+            log.append(msg)
+
+            toEmails = [[], []]
+            if len(str(external_emails).strip()) > 3:
+                toEmails[0] = external_emails.split(';')
+            if len(str(internal_emails).strip()) > 3:
+                toEmails[1] = internal_emails.split(';')
+            emails.append((toEmails, log, ""))
+            missing_partners.append((prefix, not_sent))
+
+    digest = get_digest(missing_partners, time_check)
+    if digest is not None:
+        emails.append(digest)
+    deliver_emails(emails)
+
+
+def get_digest(missing_partners, time_check, digest_emails=None):
+    """ This builds the internal digest of all the partners with missing files
+
+        Parameters
+        ----------
+            missing_partners: list
+                (partner, missing files) of every partner with missing files
+            time_check: str
+                time of the check: hh:mm
+            digest_emails: str
+                ; separated recipients, DIGEST_EMAILS if None
+        return
+        ------
+            email: tuple
+                (toEmails, log, "digest") to deliver, None if nothing is missing
+    """
+    digest_emails = DIGEST_EMAILS if digest_emails is None else digest_emails
+    if not missing_partners or len(digest_emails.strip()) <= 3:
+        return None
+
+    log = ['Files not received for ' + str(len(missing_partners)) + ' partner(s)']
+    log.append('Time Check: ' + time_check + ' (UTC): ')
+    for partner, not_sent in missing_partners:
+        log.append("\n\t" + partner + ": " + str(len(not_sent)) + " file(s)"
+                   + "".join(["\n\t\t" + x for x in sorted(not_sent)]))
+    return ([digest_emails.split(';'), []], log, "digest")
+
+
+def deliver_emails(emails, max_workers=SES_MAX_WORKERS):
+    """ This sends emails concurrently on a bounded thread pool
+
+        A failed email is logged and does not stop the other deliveries.
+
+        Parameters
+        ----------
+            emails: list
+                (toEmails, log, email_type) of every email, see send_email
+            max_workers: int
+                maximum number of concurrent ses requests
+        return
+        ------
+            delivered: int
+                number of emails sent
+    """
+    def deliver(email):
+        try:
+            send_email_with_retry(*email)
+            return True
+        except BaseException as e:
+            logging.exception(e)
+            return False
+
+    if not emails:
+        return 0
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(emails))) as pool:
+        return sum(pool.map(deliver, emails))
+
+
+def send_email_with_retry(toEmails, log, email_type="", retries=SES_RETRIES, delay=SES_RETRY_DELAY):
+    """ This sends an email, backing off with jitter while ses throttles
+
+        Parameters
+        ----------
+            retries: int
+                number of attempts
+            delay: float
+                first backoff delay in seconds, doubled on every attempt
+    """
+    for attempt in range(retries):
+        try:
+            # send_email formats the log in place
+            return send_email(toEmails, list(log), email_type)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in SES_THROTTLING_CODES or attempt == retries - 1:
+                raise
+            time.sleep(delay * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def get_ses_client():
+    """ This returns the ses client shared by the deliveries """
+    global _ses_client
+    with _ses_client_lock:
+        if _ses_client is None:
+            _ses_client = boto3.client('ses', config=Config(
+                max_pool_connections=SES_MAX_WORKERS))
+        return _ses_client
+
+
+def check_date_range(schedule_rows, start_date, end_date, s3_bucket, partners=None):
+    """ This checks the files expected over a range of days
+
+        The manifest of every day is built first, then each partner program
+        folder is listed once for all the days.
+
+        Parameters
+        ----------
+            schedule_rows: list
+                ScheduleRow of the partner schedule
+            start_date: str
+                first day to check: yyyymmdd
+            end_date: str
+                last day to check: yyyymmdd
+            s3_bucket:
+                S3 bucket where the folders and file are located
+            partners: list
+                partners to check, all scheduled partners if None
+        return
+        ------
+            report: dict
+                totals and partner => day => missing files
+    """
+    if partners:
+        schedule_rows = [row for row in schedule_rows if row.partner in partners]
+
+    expected = []
+    day = datetime.strptime(start_date, "%Y%m%d")
+    while day <= datetime.strptime(end_date, "%Y%m%d"):
+        expected_files, _ = get_schedule_manifest(schedule_rows, day.strftime("%Y%m%d") + ".csv")
+        expected += [(x.partner, day.strftime("%Y%m%d"), x.file)
+                     for x in expected_files if not is_missing(x.partner)]
+        day += timedelta(days=1)
+
+    prefixes = set("/".join(file.split("/")[:2]) + "/" for _, _, file in expected)
+    files = list_received_files(s3_bucket, prefixes)
+
+    report = {'start_date': start_date, 'end_date': end_date,
+              'expected': len(expected), 'missing': 0, 'partners': {}}
+    for partner, day, file in expected:
+        if file not in files:
+            report['missing'] += 1
+            report['partners'].setdefault(partner, {}).setdefault(day, []).append(file)
+    return report
+
+
+def list_received_files(s3_bucket, prefixes, max_workers=MAX_WORKERS):
+    """ This returns the keys under some folders, listing each folder once
+
+        Parameters
+        ----------
+            s3_bucket:
+                S3 bucket where the folders and file are located
+            prefixes: iterable
+                folders to list
+            max_workers: int
+                maximum number of concurrent listings
+        return
+        ----------
+            received: set of the keys found in the folders
+    """
+    prefixes = list(prefixes)
+
+    def list_prefix(prefix):
+        return [x.key for x in s3_bucket.objects.filter(Prefix=prefix)]
+
+    if not prefixes:
+        return set()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(prefixes))) as pool:
+        return set(key for keys in pool.map(list_prefix, prefixes) for key in keys)
+
+
+def get_partner_index(partner_files, time_schedule, partner_schedule):
+    """ This builds the partner lookup table of a check from the schedule dataframes
+
+        Parameters
+        ----------
+            partner_files: dataframe
+                contains formatted partner files info
+            time_schedule: dataframe
+                contains times to run the partner programs
+            partner_schedule: dataframe
+                contains partner schedule info
+        return
+        ------
+            partner_index: dict
+                see build_partner_index
+    """
+    return build_partner_index(
+        [ExpectedFile(*x) for x in partner_files.itertuples(index=False)],
+        [RunHour(*x) for x in time_schedule.itertuples(index=False)],
+        get_schedule_rows(partner_schedule))
+
+
+def build_partner_index(expected_files, run_hours, schedule_rows):
+    """ This builds the partner lookup table of a check in one pass per list
+
+        Parameters
+        ----------
+            expected_files: list
+                ExpectedFile of every partner program
+            run_hours: list
+                RunHour to check the partner programs
+            schedule_rows: list
+                ScheduleRow of the partner schedule
+        return
+        ------
+            partner_index: dict
+                partner => run_hours (set), files (set),
+                internal_emails (str) and partner_emails (str)
+    """
+    partner_index = {}
+    for x in expected_files:
+        if is_missing(x.partner) or is_missing(x.file):
+            continue
+        partner = partner_index.get(x.partner)
+        if partner is None:
+            partner = partner_index[x.partner] = {
+                'run_hours': set(), 'files': set(),
+                'internal_emails': None, 'partner_emails': None}
+        partner['files'].add(x.file)
+
+    for x in run_hours:
+        if x.partner in partner_index and not is_missing(x.run_hour):
+            partner_index[x.partner]['run_hours'].add(x.run_hour)
+
+    for row in schedule_rows:
+        partner = partner_index.get(row.partner)
+        # the first schedule row of a partner holds its contacts
+        if partner is not None and partner['internal_emails'] is None:
+            partner['internal_emails'] = row.internal_emails
+            partner['partner_emails'] = row.partner_emails
+    return partner_index
+
+
+def is_missing(value):
+    """ This checks if a schedule value is missing: None or NaN """
+    return value is None or value != value
+
+
+def get_received_files(s3_bucket, keys, max_workers=MAX_WORKERS):
+    """ This returns the expected files which are in the bucket
+
+        One HEAD request per expected file, run concurrently on a bounded
+        thread pool, so the check cost depends on the expected files only.
+
+        Parameters
+        ----------
+            s3_bucket:
+                S3 bucket where the folders and file are located
+            keys: iterable
+                expected file keys
+            max_workers: int
+                maximum number of concurrent requests
+        return
+        ----------
+            received: set of the expected file keys found in the bucket
+    """
+    client = s3_bucket.meta.client
+    keys = list(keys)
+
+    def is_received(key):
+        try:
+            client.head_object(Bucket=s3_bucket.name, Key=key)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    if not keys:
+        return set()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as pool:
+        return set(key for key, received in zip(keys, pool.map(is_received, keys))
+                   if received)
+
+
+class ArrivalIndex:
+    """ This class indexes the files which arrived in the partner bucket
+
+        One compact object per file date holds the arrival time of every file
+        key stamped with that date. Keys are partner/program/folder/file_date.csv
+        so a key gives the (partner, program, file, date) of an arrival.
+
+        Attributes
+        ----------
+            store: DynamoArrivalStore or LocalArrivalStore
+                where the day objects are kept
+            max_age: timedelta
+                an index not refreshed by an arrival event for longer is stale
+            days: dict
+                day objects loaded so far
+    """
+
+    def __init__(self, store, max_age=ARRIVALS_MAX_AGE):
+        self.store = store
+        self.max_age = max_age
+        self.days = {}
+
+    def record(self, key, arrival_time):
+        """ This records the arrival of a file
+
+            The arrival is added to its day object by one atomic update, so
+            arrivals landing together never conflict.
+        """
+        day = get_file_date(key)
+        if day is None:
+            return False
+        self.add_arrivals(day, {key: arrival_time})
+        self.refresh()
+        return True
+
+    def add_arrivals(self, day, arrivals):
+        """ This adds arrivals: key => arrival time to a day object
+
+            The first arrival time of a key is kept.
+        """
+        self.store.add_arrivals(day, {key: arrival_time.strftime("%Y-%m-%dT%H:%M:%S")
+                                      for key, arrival_time in arrivals.items()})
+        self.days.pop(day, None)
+
+    def refresh(self):
+        """ This stamps the index as refreshed by an arrival event
+
+            The stamp is kept apart from the day objects: the event of any file
+            shows the index is kept up to date, for the quiet partners and days
+            too. It is only rewritten once older than ARRIVALS_REFRESH_INTERVAL,
+            a concurrent refresh is as recent, a lost write is not retried.
+        """
+        now = datetime.utcnow()
+        data, version = self.store.load(INDEX_OBJECT)
+        if data is None or now - parse_event_time(data['refreshed_at']) > ARRIVALS_REFRESH_INTERVAL:
+            self.store.save(INDEX_OBJECT, {'refreshed_at': now.strftime("%Y-%m-%dT%H:%M:%S")}, version)
+        self.days.pop(INDEX_OBJECT, None)
+
+    def reconcile(self, received, check_time):
+        """ This adds the files found in the bucket by a check to the index
+
+            The index missed their arrival events, they are not looked up in the
+            bucket again. Errors are logged, the check does not depend on it.
+        """
+        days = {}
+        for key in received:
+            day = get_file_date(key)
+            if day is not None:
+                days.setdefault(day, {})[key] = check_time
+        for day, arrivals in days.items():
+            try:
+                self.add_arrivals(day, arrivals)
+            except BaseException as e:
+                logging.exception(e)
+
+    def get_day(self, day):
+        """ This returns the day object for a file date, None if missing """
+        if day not in self.days:
+            self.days[day] = self.store.load(day)[0]
+        return self.days[day]
+
+    def is_stale(self, check_time):
+        """ This checks if the index may be missing recent arrivals
+
+            The index is stale when no arrival event refreshed it for longer
+            than max_age, whenever the last arrival of a day or partner was.
+        """
+        data = self.get_day(INDEX_OBJECT)
+        return data is None or check_time - parse_event_time(data['refreshed_at']) > self.max_age
+
+    def lookup(self, keys, check_time):
+        """ This looks up expected files in the index
+
+            Parameters
+            ----------
+                keys: iterable
+                    expected file keys
+                check_time: datetime
+                    time of the check
+            return
+            ------
+                received: set
+                    keys which arrived
+                unresolved: set
+                    keys not in a stale index, to check in the bucket
+        """
+        received, unresolved = set(), set()
+        for key in keys:
+            day = get_file_date(key)
+            data = self.get_day(day) if day else None
+            if data is not None and key in data['arrivals']:
+                received.add(key)
+            elif day is None or self.is_stale(check_time):
+                unresolved.add(key)
+        return received, unresolved
+
+
+class DynamoArrivalStore:
+    """ This class keeps the arrival index day objects in a DynamoDB table
+
+        An object is an item holding its json and a version number, a write is
+        conditional on the version it was loaded with, so two writers never
+        both succeed. The arrivals of a day are kept in a map attribute of the
+        day item instead, every arrival is added by an atomic update.
+
+        Attributes
+        ----------
+            client: boto3 dynamodb client
+            table: str
+                table holding the objects, partition key state_key (string)
+            prefix: str
+                prefix of the object keys
+    """
+
+    def __init__(self, client=None, table=STATE_TABLE, prefix=ARRIVALS_PREFIX):
+        self.client = client if client is not None else boto3.client('dynamodb')
+        self.table = table
+        self.prefix = prefix
+
+    def load(self, day):
+        """ This returns the (day object, version), (None, None) if missing """
+        res = self.client.get_item(
+            TableName=self.table, Key={'state_key': {'S': self.prefix + day}}, ConsistentRead=True)
+        if 'Item' not in res:
+            return None, None
+        item = res['Item']
+        data = json.loads(item['data']['S']) if 'data' in item else {}
+        if 'arrivals' in item:
+            data.setdefault('arrivals', {}).update(
+                (key, value['S']) for key, value in item['arrivals']['M'].items())
+            data['updated_at'] = item['updated_at']['S']
+        return data, int(item['version']['N']) if 'version' in item else None
+
+    def add_arrivals(self, day, arrivals):
+        """ This adds arrivals: key => arrival time to the arrivals map of a day item
+
+            The first arrival time of a key is kept. The update is atomic, no
+            version is checked, so concurrent arrivals all land.
+        """
+        keys = list(arrivals)
+        for start in range(0, len(keys), ARRIVALS_PER_UPDATE):
+            names, values = {}, {':updated_at': {'S': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")}}
+            sets = ['updated_at = :updated_at']
+            for i, key in enumerate(keys[start:start + ARRIVALS_PER_UPDATE]):
+                names['#k%d' % i] = key
+                values[':t%d' % i] = {'S': arrivals[key]}
+                sets.append('arrivals.#k{0} = if_not_exists(arrivals.#k{0}, :t{0})'.format(i))
+            update = {'TableName': self.table, 'Key': {'state_key': {'S': self.prefix + day}},
+                      'UpdateExpression': 'SET ' + ', '.join(sets),
+                      'ExpressionAttributeNames': names, 'ExpressionAttributeValues': values}
+            try:
+                self.client.update_item(**update)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ValidationException':
+                    raise
+                # the first arrivals of the day: the arrivals map does not exist yet
+                self.client.update_item(
+                    TableName=self.table, Key={'state_key': {'S': self.prefix + day}},
+                    UpdateExpression='SET arrivals = if_not_exists(arrivals, :empty)',
+                    ExpressionAttributeValues={':empty': {'M': {}}})
+                self.client.update_item(**update)
+
+    def save(self, day, data, version):
+        """ This writes a day object if nobody changed it since it was loaded
+
+            return
+            ------
+                version: int
+                    new version of the object, False if it was changed concurrently
+        """
+        if version is None:
+            condition = {'ConditionExpression': 'attribute_not_exists(state_key)'}
+        else:
+            condition = {'ConditionExpression': 'version = :version',
+                         'ExpressionAttributeValues': {':version': {'N': str(version)}}}
+        try:
+            self.client.put_item(TableName=self.table, Item={
+                'state_key': {'S': self.prefix + day},
+                'data': {'S': json.dumps(data, separators=(',', ':'))},
+                'version': {'N': str((version or 0) + 1)},
+            }, **condition)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return (version or 0) + 1
+
+
+class LocalArrivalStore:
+    """ This class is the local filesystem stand-in of DynamoArrivalStore
+
+        Attributes
+        ----------
+            root: str
+                folder holding one yyyymmdd.json file per day
+    """
 
-        if time_check in time_in_file_Schedule:
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
 
-            lstfiles = set(df2['files'].where(
-                df2['partner'] == prefix).dropna(axis='rows', how='all'))
+    def load(self, day):
+        try:
+            with open(os.path.join(self.root, day + ".json"), 'rb') as day_file:
+                body = day_file.read()
+        except FileNotFoundError:
+            return None, None
+        return json.loads(body), hashlib.md5(body).hexdigest()
 
-            internal_emails = partner_schedule['internal_emails'].where(
-                partner_schedule['partner'] == prefix).dropna(axis='rows', how='all').values.tolist()[0]
-            external_emails = partner_schedule['partner_emails'].where(
-                partner_schedule['partner'] == prefix).dropna(axis='rows', how='all').values.tolist()[0]
+    def save(self, day, data, etag):
+        with self.lock:
+            if self.load(day)[1] != etag:
+                return False
+            return self.write(day, data)
 
-            files = set(
-                y for y in [v.key for v in s3_bucket.objects.filter(Prefix=prefix)])
+    def add_arrivals(self, day, arrivals):
+        with self.lock:
+            data = self.load(day)[0] or {'arrivals': {}}
+            for key, arrival_time in arrivals.items():
+                data['arrivals'].setdefault(key, arrival_time)
+            data['updated_at'] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+            self.write(day, data)
 
-            inter = set(lstfiles & files)
-            not_sent = [x for x in lstfiles if x not in inter]
+    def write(self, day, data):
+        body = json.dumps(data, separators=(',', ':')).encode()
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, day + ".json"), 'wb') as day_file:
+            day_file.write(body)
+        return hashlib.md5(body).hexdigest()
 
-            if len(not_sent) > 0:
-                msg = "".join(
-                    ["\n\t\t" + x for x in lstfiles if x not in inter])
-                log.append(msg)
 
-                toEmails = [[], []]
-                if len(str(external_emails).strip()) > 3:
-                    toEmails[0] = external_emails.split(';')
-                if len(str(internal_emails).strip()) > 3:
-                    toEmails[1] = internal_emails.split(';')
-                send_email(toEmails, log)
+def get_file_date(key):
+    """ This returns the yyyymmdd date stamp of a partner file key, None if not stamped """
+    match = re.search(r'_(\d{8})\.csv$', key)
+    return match.group(1) if match else None
 
 
 def send_email(toEmails, log, email_type=""):
@@ -281,19 +1340,22 @@ def send_email(toEmails, log, email_type=""):
 
     Parameters
     ----------
-        sender_email : str
-            The name of the sender email
-        receiver_email : str or List
-            The name of the receipient email(s)
+        toEmails : list
+            [to, bcc] lists of receipient email(s)
         log: list
             This is contains the log information to send
+        email_type: str
+            "digest" for the internal digest, a partner reminder otherwise
     """
     fromEmail = "datahub@coursera.org"
     replyTo = "datahub@coursera.org"
     subject = "Coursera Data Exchange Automated Alert: " + log[0]
-    log[1] += log[0].replace("received", "sent")
-    message = get_email_message(log)
-    client = boto3.client('ses')
+    if email_type == "digest":
+        message = ''.join(log[1:])
+    else:
+        log[1] += log[0].replace("received", "sent")
+        message = get_email_message(log)
+    client = get_ses_client()
 
     response = client.send_email(
         Source=fromEmail,
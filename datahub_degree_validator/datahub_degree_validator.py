@@ -10,13 +10,70 @@
         2. Alerted back to the Partner
 """
 import csv
+import hashlib
+import json
+import mmap
+import os
 import re
+import threading
+import time
+from abc import ABC, abstractmethod
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from io import BytesIO, StringIO
 
 import boto3
+import numpy as np
 import pandas as pd
+from botocore.exceptions import ClientError
+
+from datahub_common.partner_artifact import PARTNER_ARTIFACT_FORMAT
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # row result export is optional
+    pa = None
+    pq = None
+
+
+# child file => (column, parent file, parent column) of the keys which must exist
+# in the parent file of the same drop, files are named before any partner swap
+REFERENCES = {
+    "degree_course_memberships": [
+        ("student_id", "students", "student_id"),
+        ("admit_term_id", "terms", "degree_term_id"),
+        ("course_id", "degree_courses", "course_id"),
+        ("academic_term_id", "terms", "degree_term_id"),
+    ],
+    "degree_term_memberships": [
+        ("student_id", "students", "student_id"),
+        ("admit_term_id", "terms", "degree_term_id"),
+        ("academic_term_id", "terms", "degree_term_id"),
+    ],
+    "degree_program_memberships": [
+        ("student_id", "students", "student_id"),
+        ("admit_term_id", "terms", "degree_term_id"),
+    ],
+    "degree_terms_courses": [
+        ("course_id", "degree_courses", "course_id"),
+        ("academic_term_id", "terms", "degree_term_id"),
+    ],
+}
+
+# parent file => columns of the parent file the child files reference
+PARENT_COLUMNS = {
+    "students": ["student_id"],
+    "degree_courses": ["course_id"],
+    "terms": ["degree_term_id"],
+}
+
+KEY_INDEXES_FOLDER = "datahub/datahub_validator/key_indexes/"
+
+# seconds after which the claim of a drop whose validation died is taken over,
+# the longest a lambda runs
+DROP_CLAIM_TIMEOUT = 900
 
 
 def lambda_handler(event, context=None):
@@ -24,6 +81,19 @@ def lambda_handler(event, context=None):
 
         settings = Settings()
 
+        if "drop" in event:
+            # a drop given by a scheduled event: validate the files it has
+            drop = event["drop"]
+            if "rule" in drop:
+                # the deadline of the drop, its one time rule is not needed anymore
+                delete_drop_rule(drop["rule"])
+            validate_drop = ValidateDrop(
+                settings, drop.get("bucket_name", "coursera-degrees-data")
+            )
+            return validate_drop.validate_drop(
+                drop["partner"], drop["program"], drop["date"]
+            )
+
         partner_bucket = event["detail"]["requestParameters"]["bucketName"]
 
         validate_file = ValidateFile(settings, partner_bucket)
@@ -32,33 +102,130 @@ def lambda_handler(event, context=None):
         file_path_list = validate_file.validate_lambda_event(event)
         if file_path_list:
 
-            # set Settings
+            if settings.drop_mode and re.match(
+                r"\d{8}\.csv$", file_path_list[3].split("_")[-1]
+            ):
+                validate_drop = ValidateDrop(settings, partner_bucket)
+                return validate_drop.validate_landed_file(file_path_list, context)
 
-            log = OrderedDict()
-            file = File(file_path_list)
+            if validate_file.is_sampled(file_path_list, event):
+                log = validate_file.validate_sample(file_path_list)
+                schedule_full_validation(event, context, log)
+            else:
+                log = validate_file.validate(file_path_list)
+                if log == "Success" and settings.dispatch_jobs:
+                    validate_file.dispatch_job(
+                        event["detail"]["requestParameters"]["key"]
+                    )
 
-            log = validate_file.validate_file_name(file_path_list)
+            email_log = None if log == "Success" else log[1]
+            if "provisional_error_code" in event:
+                # the full validation of a sampled file, emailed if the verdict changed
+                email_log = validate_file.get_final_verdict_log(
+                    log, event["provisional_error_code"]
+                )
+            if email_log is not None:
+                SendEmail(settings).send_email(email_log)
 
-            if log == "Success":
-                log = validate_file.validate_file_empty(file)
+            print(file_path_list, ": status: ", log, "\n")
+            return log
 
-            if log == "Success":
-                log = validate_file.validate_file_column_structure(file)
+    except KeyError:
+        raise KeyError(f"Wrong lambda event Key supplied {KeyError}")
 
-            if log == "Success":
-                log = validate_file.validate_field_datatypes(file)
 
-            if log == "Success":
-                log = validate_file.validate_file_pk_violation(file)
+def schedule_full_validation(event, context=None, provisional_log="Success"):
+    """This function schedules the full validation of a sampled file
 
-            if log != "Success":
-                SendEmail().send_email(log[1])
+    Within aws the lambda invokes itself asynchronously, elsewhere the full
+    validation runs in a background thread.
 
-            print(file_path_list, ": status: ", log, "\n")
-            return log
+    Attributes:
+        event (dict): lambda event of the sampled file
+        context (object): lambda context
+        provisional_log (str or tuple): provisional verdict of the sample, the full
+            validation gives the final verdict against it
+    return:
+        response (dict or Thread): invoke response or running thread
+    """
+    full_event = dict(
+        event,
+        validation_mode="full",
+        provisional_error_code=(
+            provisional_log[1]["error_code"]
+            if isinstance(provisional_log, tuple)
+            else None
+        ),
+    )
+    function_name = getattr(context, "function_name", None) or os.environ.get(
+        "AWS_LAMBDA_FUNCTION_NAME"
+    )
+    if not function_name:
+        thread = threading.Thread(target=lambda_handler, args=(full_event,))
+        thread.start()
+        return thread
+    return boto3.client("lambda").invoke(
+        FunctionName=function_name,
+        InvocationType="Event",
+        Payload=json.dumps(full_event, default=str),
+    )
+
+
+def schedule_drop_validation(drop, delay, context=None):
+    """This function schedules the validation of a drop at its deadline
+
+    Within aws a one time events rule invokes the lambda with the drop, the
+    invocation deletes the rule. Elsewhere the validation runs in a background
+    thread after the delay.
 
-    except KeyError:
-        raise KeyError(f"Wrong lambda event Key supplied {KeyError}")
+    Attributes:
+        drop (dict): partner, program, date and bucket_name of the drop
+        delay (int): seconds until the deadline
+        context (object): lambda context
+    return:
+        response (dict or Timer): put targets response or started timer
+    """
+    function_name = getattr(context, "function_name", None) or os.environ.get(
+        "AWS_LAMBDA_FUNCTION_NAME"
+    )
+    if not function_name:
+        timer = threading.Timer(delay, lambda_handler, args=({"drop": drop},))
+        timer.daemon = True
+        timer.start()
+        return timer
+    function_arn = getattr(context, "invoked_function_arn", None)
+    if not function_arn:
+        function = boto3.client("lambda").get_function(FunctionName=function_name)
+        function_arn = function["Configuration"]["FunctionArn"]
+    drop_id = "/".join([drop["partner"], drop["program"], drop["date"]])
+    rule = "datahub_drop_" + hashlib.md5(drop_id.encode("utf8")).hexdigest()
+    # cron rules fire on the minute, round the deadline up
+    at = datetime.utcfromtimestamp(time.time() + delay + 60)
+    events = boto3.client("events")
+    events.put_rule(
+        Name=rule,
+        ScheduleExpression=f"cron({at.minute} {at.hour} {at.day} {at.month} ? {at.year})",
+    )
+    return events.put_targets(
+        Rule=rule,
+        Targets=[
+            {
+                "Id": "drop",
+                "Arn": function_arn,
+                "Input": json.dumps({"drop": dict(drop, rule=rule)}),
+            }
+        ],
+    )
+
+
+def delete_drop_rule(rule):
+    """This function deletes the events rule which scheduled a drop validation"""
+    try:
+        events = boto3.client("events")
+        events.remove_targets(Rule=rule, Ids=["drop"])
+        events.delete_rule(Name=rule)
+    except Exception as e:
+        print("exception: function: delete_drop_rule: " + str(e))
 
 
 class ValidateFile:
@@ -73,9 +240,10 @@ class ValidateFile:
         self.file = None
         self.partner_bucket = partner_bucket
         self.settings = settings
-        self.settings.set_file_settings()
+        if settings.mt_data is None:
+            self.settings.set_file_settings()
         self.error_logs = ErrorLogging(settings)
-        self.bfd = BucketFileData()
+        self.bfd = BucketFileData(storage=settings.storage)
 
     def validate_lambda_event(self, event):
         """This method validates a lambda file event
@@ -104,7 +272,7 @@ class ValidateFile:
                     "finance_transactions",
                     "finance_metadata",
                 ]
-                mt_data = settings.get_metadata()
+                mt_data = settings.mt_data
 
                 valid_folder_paths = set(mt_data["folder_path"])
 
@@ -122,6 +290,308 @@ class ValidateFile:
                 + str(e)
             )
 
+    def validate(self, file_path_list):
+        """This method runs all the file validations in order
+
+        Attributes:
+            file_path_list (list): [parner, program_slug, enrollments_or_applications, filename.csv]
+
+        return:
+            if valid file: message (str): Success
+            else: message (tuple): (email_flag, log) of the first failed validation
+        """
+        file = File(file_path_list)
+        self.file = file
+
+        log = self.validate_file_name(file_path_list)
+
+        if log == "Success":
+            log = self.validate_file_empty(file)
+
+        if log == "Success":
+            log = self.validate_file_column_structure(file)
+
+        if log == "Success":
+            log = self.validate_field_datatypes(file)
+
+        if log == "Success":
+            log = self.validate_file_pk_violation(file)
+
+        if log == "Success":
+            log = self.validate_file_references(file)
+
+        if log == "Success":
+            self.add_key_indexes(file)
+        else:
+            self.remove_key_indexes(file)
+
+        self.export_row_results(file, log)
+        self.quarantine_file(file, log)
+        return log
+
+    def is_sampled(self, file_path_list, event):
+        """This method checks if a file gets a sampled provisional verdict first
+
+        return:
+            sampled (bool): True for files above the sample threshold, unless
+                the event is the scheduled full validation
+        """
+        threshold = self.settings.sample_threshold_bytes
+        if not threshold or event.get("validation_mode") == "full":
+            return False
+        try:
+            file_path = "/".join(file_path_list)
+            return self.bfd.storage.get_size(self.partner_bucket, file_path) > threshold
+        except Exception:
+            return False
+
+    def validate_sample(self, file_path_list):
+        """This method gives a provisional verdict from a sample of the file
+
+        The structure, datatypes and PK checks run on a few row aligned ranged
+        reads spread across the file. Logs are flagged as provisional. A failure
+        found in the sample is certain, the confidence of a pass is the fraction
+        of the file that was sampled.
+
+        Attributes:
+            file_path_list (list): [parner, program_slug, enrollments_or_applications, filename.csv]
+
+        return:
+            if valid sample: message (str): Success
+            else: message (tuple): (email_flag, log) of the first failed validation
+        """
+        settings = self.settings
+        file = File(file_path_list)
+        self.error_logs.verdict = "provisional"
+        try:
+            log = self.validate_file_name(file_path_list)
+            if log != "Success":
+                self.error_logs.verdict_confidence = 1.0
+                return log
+
+            file.file_data, sampled_bytes, size = self.bfd.read_csv_sample(
+                self.partner_bucket,
+                file.file_path,
+                settings.no_of_samples,
+                settings.sample_bytes,
+            )
+            if file.file_data is None:
+                # inconclusive sample, the full validation gives the verdict
+                self.error_logs.verdict_confidence = 0.0
+                return "Success"
+            file.row_results = RowResults(
+                file.file_data.columns, file.file_data.shape[0]
+            )
+            self.error_logs.verdict_confidence = 1.0
+
+            log = self.validate_file_column_structure(file)
+
+            if log == "Success":
+                log = self.validate_field_datatypes(file)
+
+            if log == "Success":
+                log = self.validate_file_pk_violation(file)
+
+            if log == "Success":
+                self.error_logs.verdict_confidence = round(sampled_bytes / size, 4)
+            print(
+                file.file_path,
+                ": provisional verdict confidence: ",
+                self.error_logs.verdict_confidence,
+            )
+            return log
+        finally:
+            self.error_logs.verdict = "final"
+
+    def get_final_verdict_log(self, log, provisional_error_code):
+        """This method records the final verdict of a file which got a provisional one
+
+        A failed full validation is logged as final by the validation itself, a
+        passing one retracts a failed provisional verdict with a final log.
+
+        Attributes:
+            log (str or tuple): result of the full validation
+            provisional_error_code (int): error code of the provisional verdict,
+                None if the sample passed
+
+        return:
+            log (OrderedDict): final log to email, None if the verdict did not change
+        """
+        if log != "Success":
+            if log[1]["error_code"] == provisional_error_code:
+                return
+            return log[1]
+        if provisional_error_code is None:
+            return
+        log = self.error_logs.log_info_verdict_retracted(
+            self.file, {"error_code": 0, "retracted_error_code": provisional_error_code}
+        )
+        self.error_logs.add_logs_to_bucket(self.settings.logs_bucket, log)
+        return log
+
+    def dispatch_job(self, event_key):
+        """This method executes the MEGA job of a file which passed the validation
+
+        In the pipeline mode the validator replaces the job runner trigger. The
+        MEGA client shared with the job runner (datahub_common/mega.py) is used
+        with the already parsed file: its number of rows replaces the runner's
+        read of the file, and the jobs come from the partner artifact or the
+        cached job index.
+
+        Attributes:
+            event_key (str): file key of the lambda event, the jobs are case sensitive
+
+        return:
+            job_id (str): MEGA job executed, None if no job or no data rows
+        """
+        # only the pipeline mode needs the MEGA client and its session
+        from datahub_common import mega
+
+        file = self.file
+        tags = ["file:" + file.file_name, "partner:" + file.partner_slug]
+        job_url = ""
+        try:
+            artifact = self.settings.get_partner_artifact()
+            if artifact is not None and artifact.get("jobs"):
+                job_keys = artifact["jobs"]
+            else:
+                job_keys = mega.get_job_keys()
+            job = job_keys.get(re.sub(r"\d{8}", "{DATE_PLACEHOLDER}", event_key))
+            if job is None:
+                return
+            job_id, job_url = job
+
+            # Need at least a row of data to proceed, the header is not counted
+            if not file.file_no_of_rows:
+                mega.log(metric_name="not_enough_records", tags=tags)
+                return
+            mega.MegaJob(job_id).execute_mega_job()
+            print("running job: " + job_url)
+            mega.log(
+                metric_name="run_mega_job",
+                tags=tags + ["job:" + job_id, "source:validator"],
+            )
+            return job_id
+        except Exception as e:
+            print("exception: class ValidateFile: Method: dispatch_job: " + str(e))
+            metric_name = "Datahub Runner Job Failure"
+            mega.log(metric_name=metric_name, tags=tags)
+            mega.send_email(metric_name, tags, job_url)
+
+    def read_file_data(self, file):
+        """This method reads the file data once and caches it on the file
+
+        Attributes:
+            file (File Object): stores file object
+
+        return:
+            file_data (dataframe): file data, None if the file cannot be read
+        """
+        if file.file_data is None:
+            file.file_data = self.bfd.read_csv(self.partner_bucket, file.file_path)
+            if file.file_data is not None:
+                file.row_results = RowResults(
+                    file.file_data.columns, file.file_data.shape[0]
+                )
+        return file.file_data
+
+    def export_row_results(self, file, log):
+        """This method writes the per row results next to the validation logs
+
+        Attributes:
+            file (File Object): stores file object
+            log (str or tuple): validation result
+
+        return:
+            response (dict): storage response, None when nothing is written
+        """
+        try:
+            settings = self.settings
+            if not (settings.export_row_results and settings.write_logs):
+                return
+            if file.row_results is None:
+                return
+            if pa is None:
+                print("row results not exported: pyarrow is not installed")
+                return
+            error_code = 0 if log == "Success" else log[1]["error_code"]
+            body = file.row_results.to_parquet(
+                {"file_path": file.file_path, "error_code": str(error_code)}
+            )
+            key = "/".join(
+                [
+                    "datahub/datahub_validator/row_results",
+                    file.partner_slug,
+                    file.program_slug,
+                    file.file_name.replace(".csv", ".parquet"),
+                ]
+            )
+            return self.bfd.storage.put_object(settings.logs_bucket, key, body)
+        except Exception as e:
+            print(
+                "exception: class ValidateFile: Method: export_row_results: " + str(e)
+            )
+
+    def quarantine_file(self, file, log):
+        """This method splits a file rejected for its content into valid and rejected rows
+
+        Only files rejected for wrong field datatypes (4) or PK violations (5)
+        are split, the already parsed data and row results are reused. Writes:
+            quarantine/valid/<file_path>: rows passing all validations
+            quarantine/rejected/<file_path>: failing rows with a rejection_reason
+
+        Attributes:
+            file (File Object): stores file object
+            log (str or tuple): validation result
+
+        return:
+            keys (dict): valid and rejected file keys, None when nothing is written
+        """
+        try:
+            settings = self.settings
+            if not (settings.quarantine and settings.write_logs):
+                return
+            if log == "Success" or log[1]["error_code"] not in (4, 5):
+                return
+
+            row_results = file.row_results
+            if not row_results.pk_checked:
+                row_results.set_pk_duplicates(file.file_data, self.get_pk_cols(file))
+            rejected = (row_results.failing_columns != 0) | row_results.pk_duplicate
+
+            reasons = {}
+            rejection_reason = []
+            for bitmask, pk_duplicate in zip(
+                row_results.failing_columns[rejected].tolist(),
+                row_results.pk_duplicate[rejected].tolist(),
+            ):
+                if bitmask not in reasons:
+                    columns = row_results.get_failing_column_names(bitmask)
+                    reasons[bitmask] = (
+                        ["wrong field datatypes: " + ", ".join(columns)]
+                        if columns
+                        else []
+                    )
+                reason = reasons[bitmask] + (["PK Violation"] if pk_duplicate else [])
+                rejection_reason.append("; ".join(reason))
+
+            folder = "datahub/datahub_validator/quarantine/"
+            keys = {
+                "valid": folder + "valid/" + file.file_path,
+                "rejected": folder + "rejected/" + file.file_path,
+            }
+            self.bfd.upload_csv(
+                settings.logs_bucket, file.file_data[~rejected], keys["valid"]
+            )
+            self.bfd.upload_csv(
+                settings.logs_bucket,
+                file.file_data[rejected].assign(rejection_reason=rejection_reason),
+                keys["rejected"],
+            )
+            return keys
+        except Exception as e:
+            print("exception: class ValidateFile: Method: quarantine_file: " + str(e))
+
     def validate_file_name(self, file_path_list):
         """This method validates the file name
 
@@ -194,12 +664,12 @@ class ValidateFile:
             else: message (dict)
         """
         try:
-            mt_data = self.settings.get_metadata()
+            mt_data = self.settings.mt_data
             file_structure_cols = list(
                 mt_data[mt_data["file_prefix"] == file.file_path_no_ext]["field"]
             )
 
-            file_data = self.bfd.read_csv(self.partner_bucket, file.file_path)
+            file_data = self.read_file_data(file)
 
             file.file_no_of_rows = file_data.shape[0]
 
@@ -237,8 +707,9 @@ class ValidateFile:
             fn_data = settings.fn_data
             mt_data = settings.mt_data
 
-            file_data = BucketFileData().read_csv(self.partner_bucket, file.file_path)
+            file_data = self.read_file_data(file)
             message = []
+            file.row_results.datatypes_checked = True
 
             for _, field in fn_data.iterrows():
                 if field["field"].lower() in file_data.columns:
@@ -250,12 +721,11 @@ class ValidateFile:
                     )
                     if not field_regex:
                         field_regex = field["field_regex"]
-                    lst = list(
-                        filter(
-                            re.compile(field_regex).match,
-                            [str(x) for x in list(file_data[field["field"]])],
-                        )
-                    )
+                    values = [str(x) for x in list(file_data[field["field"]])]
+                    match = re.compile(field_regex).match
+                    failed = [match(x) is not None for x in values]
+                    lst = [x for x, row_failed in zip(values, failed) if row_failed]
+                    file.row_results.add_failing_column(field["field"], failed)
                     exceptns = {
                         field["field"]: [i if i != "nan" else "null" for i in lst]
                     }
@@ -290,7 +760,7 @@ class ValidateFile:
         """
         try:
             message = "Success"
-            file_data = BucketFileData().read_csv(self.partner_bucket, file.file_path)
+            file_data = self.read_file_data(file)
             if file_data is None or file_data.empty:
                 error = {"error_code": 3}
                 log = self.error_logs.log_info_file_empty(file, error)
@@ -305,21 +775,36 @@ class ValidateFile:
                 "exception: class ValidateFile: Method: validate_file_empty: " + str(e)
             )
 
-    def validate_file_pk_violation(self, file):
-        try:
-            self.settings.set_file_settings(file.file_path_no_ext)
-            fn_data = self.settings.fn_data
+    def get_pk_cols(self, file):
+        """This method returns the primary key columns of a file
 
-            mt_data = self.settings.mt_data
+        Attributes:
+            file (File Object): stores file object
 
-            file_data = BucketFileData().read_csv(self.partner_bucket, file.file_path)
+        return:
+            pk_cols (list): partner specific primary key columns if any,
+                else the standard file primary key columns
+        """
+        # filtered here, the settings are shared by every file validated with them
+        mt_data = self.settings.mt_data
+        mt_data = mt_data[mt_data["file_prefix"] == file.file_path_no_ext]
+        fn_data = self.settings.fn_data
+        fn_data = fn_data[fn_data["file"] == file.file_path_no_ext.split("/")[3]]
 
-            pk_cols = mt_data[mt_data["unique_pk"] == 1]["field"].values.tolist()
-            if not pk_cols:
-                pk_cols = fn_data[fn_data["pk"] == 1]["field"].values.tolist()
+        pk_cols = mt_data[mt_data["unique_pk"] == 1]["field"].values.tolist()
+        if not pk_cols:
+            pk_cols = fn_data[fn_data["pk"] == 1]["field"].values.tolist()
+        return pk_cols
+
+    def validate_file_pk_violation(self, file):
+        try:
+            file_data = self.read_file_data(file)
+
+            pk_cols = self.get_pk_cols(file)
             pks_rows = file_data.pivot_table(
                 index=pk_cols, aggfunc="size"
             ).reset_index()
+            file.row_results.set_pk_duplicates(file_data, pk_cols)
 
             pks_rows.columns = [*pks_rows.columns[:-1], "No"]
             pks_rows = pks_rows[pks_rows["No"] > 1].reset_index()
@@ -341,31 +826,528 @@ class ValidateFile:
                 + str(e)
             )
 
+    def validate_file_references(self, file):
+        """This method checks the keys of a child file exist in its parent files
+
+        The keys are hashed and looked up in the key indexes of the parent files
+        of the same day in one vectorized pass. A parent file which did not land
+        is not checked against.
+
+        Attributes:
+            file (File Object): stores file object
+
+        return:
+            if all keys exist: message (str): Success
+            else: message (tuple): (email_flag, log)
+        """
+        try:
+            references = REFERENCES.get(file.file_no_date_stamp_ext.lower())
+            if not self.settings.check_references or not references:
+                return "Success"
+            file_data = self.read_file_data(file)
+
+            orphans = []
+            for column, parent, parent_column in references:
+                if column not in file_data.columns:
+                    continue
+                parent_path = "/".join(
+                    [
+                        file.partner_slug,
+                        file.program_slug,
+                        file.folder_name,
+                        parent + "_" + file.file_date_stamp,
+                    ]
+                )
+                index = self.settings.key_indexes.get(
+                    self.partner_bucket, parent_path, parent_column
+                )
+                if index is None:
+                    continue
+                values = get_key_values(file_data[column])
+                missing = ~np.isin(hash_keys(values), index)
+                if missing.any():
+                    orphans.append(
+                        {
+                            "column": column,
+                            "parent_file": parent_path.split("/")[-1],
+                            "parent_column": parent_column,
+                            "no_of_orphans": int(missing.sum()),
+                            "samples": values[missing].drop_duplicates().tolist()[:3],
+                        }
+                    )
+
+            if orphans:
+                error = {"error_code": 6, "orphans": orphans}
+                log = self.error_logs.log_info_referential_integrity(file, error)
+                email_flag = self.error_logs.add_logs_to_bucket(
+                    self.settings.logs_bucket, log
+                )
+                return (email_flag, log)
+            return "Success"
+        except Exception as e:
+            print(
+                "exception: class ValidateFile: Method: validate_file_references: "
+                + file.file_path
+                + str(e)
+            )
+
+    def add_key_indexes(self, file):
+        """This method indexes the keys of a parent file which passed
+
+        The child files of the same day are checked against the indexes.
+        """
+        try:
+            columns = PARENT_COLUMNS.get(file.file_no_date_stamp_ext.lower())
+            if not self.settings.check_references or not columns:
+                return
+            file_data = self.read_file_data(file)
+            for column in columns:
+                if column in file_data.columns:
+                    self.settings.key_indexes.add(
+                        file.file_path, column, file_data[column]
+                    )
+        except Exception as e:
+            print("exception: class ValidateFile: Method: add_key_indexes: " + str(e))
+
+    def remove_key_indexes(self, file):
+        """This method marks the key indexes of a parent file which failed
+
+        The child files are not checked against the file, nor against a version
+        of it which passed before.
+        """
+        try:
+            columns = PARENT_COLUMNS.get(file.file_no_date_stamp_ext.lower())
+            if not self.settings.check_references or not columns:
+                return
+            self.settings.key_indexes.fail(file.file_path, columns)
+        except Exception as e:
+            print(
+                "exception: class ValidateFile: Method: remove_key_indexes: " + str(e)
+            )
+
+
+class ValidateDrop:
+    """This class validates a partner's daily drop as one unit
+
+    A drop is the files of a partner program dated the same day. The settings
+    are loaded once and shared by the files, the files are read and validated
+    concurrently, and the drop gets one consolidated log and alert. A drop is
+    validated once, by the invocation which claims it (DropClaims).
+
+    Attributes:
+        settings (Settings): settings shared by the files of the drop
+        partner_bucket (str): bucket where the partner folders and files are located
+        max_workers (int): files validated at once
+        claims (DropClaims): claim records of the drops
+    """
+
+    def __init__(
+        self,
+        settings,
+        partner_bucket="coursera-degrees-data",
+        max_workers=8,
+        claims=None,
+    ):
+        self.settings = settings
+        if settings.mt_data is None:
+            settings.set_file_settings()
+        self.partner_bucket = partner_bucket
+        self.max_workers = max_workers
+        self.claims = claims if claims is not None else DropClaims(settings.drop_table)
+
+    def get_expected_prefixes(self, partner, program):
+        """This method returns the files a drop is made of
+
+        return:
+            prefixes (list): partner/program/folder/file of the metadata files which
+                are not ignored for the program in the partner schedule
+        """
+        mt_data = self.settings.mt_data
+        prefixes = mt_data[
+            (mt_data["partner"] == partner) & (mt_data["program"] == program)
+        ]["file_prefix"].drop_duplicates(keep="first")
+        ignored = set()
+        ps_data = self.settings.ps_data
+        for ignore_files in ps_data[ps_data["partner"] == partner]["ignore_files"]:
+            ignored.update(get_ignored_names(ignore_files, program))
+        return [
+            prefix
+            for prefix in prefixes.tolist()
+            if not ignored.intersection(prefix.split("/")[2:])
+        ]
+
+    def list_drop_keys(self, partner, program, date):
+        """This method lists the files of a drop which landed
+
+        Attributes:
+            date (str): file date stamp: yyyymmdd
+        return:
+            keys (list): partner file keys
+        """
+        keys = []
+        for folder in self.settings.partner_folders:
+            prefix = "/".join([partner, program, folder]) + "/"
+            for key in self.settings.storage.list_keys(self.partner_bucket, prefix):
+                if key.lower().endswith("_" + date + ".csv"):
+                    keys.append(key)
+        return keys
+
+    def get_missing_prefixes(self, partner, program, keys):
+        """This method returns the files of a drop which did not land yet"""
+        landed = set("_".join(key.lower().split("_")[:-1]) for key in keys)
+        return [
+            prefix
+            for prefix in self.get_expected_prefixes(partner, program)
+            if prefix not in landed
+        ]
+
+    def validate_landed_file(self, file_path_list, context=None):
+        """This method validates the drop of a file once all its files landed
+
+        The files which landed are validated at the deadline of the drop even if
+        files are missing. A file landing after its drop was validated, late or
+        uploaded again, is validated on its own.
+
+        Attributes:
+            context (object): lambda context, used to schedule the deadline
+        return:
+            drop_log (OrderedDict): consolidated drop log, or
+            message (str): pending while files of the drop are missing, claimed
+                while another invocation validates the drop, or
+            log (str or tuple): validation result of a file landing late
+        """
+        partner, program = file_path_list[:2]
+        date = file_path_list[3].split("_")[-1].split(".")[0]
+        record, version = self.start_drop(partner, program, date, context)
+        if record["status"] == "done":
+            return self.validate_late_file("/".join(file_path_list))
+        keys = self.list_drop_keys(partner, program, date)
+        missing = self.get_missing_prefixes(partner, program, keys)
+        if missing and time.time() < record["deadline"]:
+            print(
+                "/".join(file_path_list),
+                ": drop pending: ",
+                ", ".join(prefix.split("/")[-1] for prefix in missing),
+            )
+            return "pending"
+        return self.validate_claimed(partner, program, date, keys, record, version)
+
+    def validate_drop(self, partner, program, date):
+        """This method validates the files of a drop which landed
+
+        return:
+            drop_log (OrderedDict): consolidated drop log, or
+            message (str): done if the drop was validated, claimed while another
+                invocation validates it
+        """
+        record, version = self.claims.load(partner, program, date)
+        if record is None:
+            record = {"status": "pending"}
+        elif record["status"] == "done":
+            print(partner, program, date, ": drop already validated\n")
+            return "done"
+        keys = self.list_drop_keys(partner, program, date)
+        return self.validate_claimed(partner, program, date, keys, record, version)
+
+    def start_drop(self, partner, program, date, context=None):
+        """This method loads the claim record of a drop, created by its first file
+
+        The first file of a drop sets its deadline and schedules its validation
+        at the deadline.
+
+        return:
+            record (dict): status and deadline of the drop
+            version (int): version of the record
+        """
+        record, version = self.claims.load(partner, program, date)
+        if record is not None:
+            return record, version
+        deadline = self.settings.drop_deadline
+        record = {"status": "pending", "deadline": time.time() + deadline}
+        version = self.claims.save(partner, program, date, record, None)
+        if version is None:
+            # another file of the drop landed at the same time
+            return self.claims.load(partner, program, date)
+        drop = {
+            "partner": partner,
+            "program": program,
+            "date": date,
+            "bucket_name": self.partner_bucket,
+        }
+        schedule_drop_validation(drop, deadline, context)
+        return record, version
+
+    def validate_claimed(self, partner, program, date, keys, record, version):
+        """This method validates a drop if this invocation claims it
+
+        The drop is claimed by a conditional write of its record, a claim older
+        than DROP_CLAIM_TIMEOUT is taken over. The record is marked done with the
+        validated files once the drop log is written, the files which landed
+        while the drop was validated are then validated on their own.
+
+        Attributes:
+            record (dict): claim record of the drop as loaded
+            version (int): version of the record, None if it does not exist
+        return:
+            drop_log (OrderedDict): consolidated drop log, or
+            message (str): claimed while another invocation validates the drop
+        """
+        now = time.time()
+        if (
+            record["status"] == "validating"
+            and now < record["claimed_at"] + DROP_CLAIM_TIMEOUT
+        ):
+            return "claimed"
+        record = dict(record, status="validating", claimed_at=now)
+        version = self.claims.save(partner, program, date, record, version)
+        if version is None:
+            print(partner, program, date, ": drop claimed by another validation\n")
+            return "claimed"
+        drop_log = self.validate(partner, program, date, keys)
+        record = dict(record, status="done", files=keys)
+        self.claims.save(partner, program, date, record, version)
+        # their landing found the drop claimed, files landing from now on find it
+        # done and are validated on their own
+        for key in self.list_drop_keys(partner, program, date):
+            if key not in record["files"]:
+                self.validate_late_file(key)
+        return drop_log
+
+    def validate_late_file(self, key):
+        """This method validates a file which landed after its drop was validated
+
+        Only the file is validated and alerted, the drop is not validated again.
+
+        return:
+            log (str or tuple): validation result, None if not validated
+        """
+        key, log = self.validate_key(key)
+        if isinstance(log, tuple) and log[0]:
+            SendEmail(self.settings).send_email(log[1])
+        print(key, ": validated after its drop: ", log, "\n")
+        return log
+
+    def validate(self, partner, program, date, keys):
+        """This method validates the files of a drop concurrently
+
+        Every file is validated and logged as when it is validated on its own,
+        the failed files are sent in one alert for the drop. The parent files are
+        validated first, the child files reuse their key indexes.
+
+        return:
+            drop_log (OrderedDict): status of every file of the drop
+        """
+        parent_keys = [
+            key
+            for key in keys
+            if "_".join(key.lower().split("/")[-1].split("_")[:-1]) in PARENT_COLUMNS
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = dict(pool.map(self.validate_key, parent_keys))
+            results.update(
+                pool.map(self.validate_key, [x for x in keys if x not in results])
+            )
+        results = [(key, results[key]) for key in keys]
+
+        drop_log = self.get_drop_log(partner, program, date, results)
+        self.add_drop_log(drop_log)
+        logs = [log[1] for _, log in results if isinstance(log, tuple) and log[0]]
+        if logs:
+            SendEmail(self.settings).send_drop_email(logs)
+        print(partner, program, date, ": drop status: ", drop_log["status"], "\n")
+        return drop_log
+
+    def validate_key(self, key):
+        """This method validates a file of a drop with the shared settings
+
+        return:
+            key (str): file key
+            log (str or tuple): validation result, None if not validated
+        """
+        try:
+            validate_file = ValidateFile(self.settings, self.partner_bucket)
+            event = {
+                "detail": {
+                    "requestParameters": {"bucketName": self.partner_bucket, "key": key}
+                }
+            }
+            file_path_list = validate_file.validate_lambda_event(event)
+            if not file_path_list:
+                return key, None
+            log = validate_file.validate(file_path_list)
+            if log == "Success" and self.settings.dispatch_jobs:
+                validate_file.dispatch_job(key)
+            return key, log
+        except Exception as e:
+            print("exception: class ValidateDrop: Method: validate_key: " + str(e))
+            return key, None
+
+    def get_drop_log(self, partner, program, date, results):
+        """This method consolidates the results of the files of a drop
+
+        return:
+            drop_log (OrderedDict): partner, program, date, status, counts, files
+                and missing files
+        """
+        files = []
+        for key, log in results:
+            file = OrderedDict([("file_name", key.split("/")[-1])])
+            if log == "Success":
+                file["status"] = "passed"
+            elif isinstance(log, tuple):
+                file["status"] = "failed"
+                file["error_code"] = log[1]["error_code"]
+                file["error_type"] = log[1]["error_type"]
+            else:
+                file["status"] = "skipped"
+            files.append(file)
+        failed = [file for file in files if file["status"] == "failed"]
+        return OrderedDict(
+            [
+                ("partner", partner),
+                ("program", program),
+                ("date", date),
+                ("status", "failed" if failed else "passed"),
+                ("no_of_files", len(files)),
+                ("passed", len([x for x in files if x["status"] == "passed"])),
+                ("failed", len(failed)),
+                ("files", files),
+                (
+                    "missing_files",
+                    [
+                        prefix.split("/")[-1]
+                        for prefix in self.get_missing_prefixes(
+                            partner, program, [key for key, _ in results]
+                        )
+                    ],
+                ),
+                ("date_time", str(datetime.utcnow())),
+            ]
+        )
+
+    def add_drop_log(self, drop_log):
+        """This method writes the drop log next to the validation logs"""
+        try:
+            if not self.settings.write_logs:
+                return
+            key = "/".join(
+                [
+                    "datahub/datahub_validator/drops",
+                    drop_log["partner"],
+                    drop_log["program"],
+                    "_".join(
+                        [
+                            "datahub_drop",
+                            drop_log["partner"],
+                            drop_log["program"],
+                            drop_log["date"] + ".json",
+                        ]
+                    ),
+                ]
+            )
+            body = json.dumps(drop_log, indent=2).encode("utf8")
+            return self.settings.storage.put_object(
+                self.settings.logs_bucket, key, body
+            )
+        except Exception as e:
+            print("exception: class ValidateDrop: Method: add_drop_log: " + str(e))
+
+
+class DropClaims:
+    """This class keeps the claim records of the drops in DynamoDB
+
+    A record is an item holding its json and a version number, writes are
+    conditional on the version, so two files landing together never both
+    validate their drop.
+
+    Attributes:
+        table (str): table keyed by drop_id: partner/program/date
+        client (boto.client): dynamodb client
+    """
+
+    def __init__(self, table="datahub_validator_drops", client=None):
+        self.table = table
+        self.client = client if client is not None else boto3.client("dynamodb")
+
+    def get_key(self, partner, program, date):
+        return {"drop_id": {"S": "/".join([partner, program, date])}}
+
+    def load(self, partner, program, date):
+        """This method loads the claim record of a drop
+
+        return:
+            record (dict): claim record, None if missing
+            version (int): version of the record, None if missing
+        """
+        res = self.client.get_item(
+            TableName=self.table,
+            Key=self.get_key(partner, program, date),
+            ConsistentRead=True,
+        )
+        if "Item" not in res:
+            return None, None
+        return json.loads(res["Item"]["record"]["S"]), int(res["Item"]["version"]["N"])
+
+    def save(self, partner, program, date, record, version):
+        """This method writes a claim record if nobody changed it since it was loaded
+
+        return:
+            version (int): version of the new record, None if it was changed
+                concurrently
+        """
+        item = dict(
+            self.get_key(partner, program, date),
+            record={"S": json.dumps(record)},
+            version={"N": str((version or 0) + 1)},
+        )
+        if version is None:
+            condition = {"ConditionExpression": "attribute_not_exists(drop_id)"}
+        else:
+            condition = {
+                "ConditionExpression": "version = :version",
+                "ExpressionAttributeValues": {":version": {"N": str(version)}},
+            }
+        try:
+            self.client.put_item(TableName=self.table, Item=item, **condition)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return None
+            raise
+        return (version or 0) + 1
+
 
 class ErrorLogging:
     """This class logs information
 
     Attributes:
-        partner_schedule (str): bucket where the partner folders and files are located
+        settings (Settings): settings holding the partner contacts index
         error_types (dict): different error types
         date_time = date timestamp
         date = date for adding to log file
         cols (tuple): columns for the object in order
+        verdict (str): final, or provisional for verdicts on a sample of the file
+        verdict_confidence (float): confidence of the verdict
 
     """
 
     def __init__(self, settings):
-        self.partner_schedule = settings.ps_data
+        self.settings = settings
         self.error_types = {
+            0: {"priority": "INFO", "description": "provisional verdict retracted"},
             1: {"priority": "CRITICAL", "description": "wrong file name"},
             2: {"priority": "CRITICAL", "description": "wrong file structure"},
             3: {"priority": "CRITICAL", "description": "empty file"},
             4: {"priority": "CRITICAL", "description": "wrong field data types"},
             5: {"priority": "URGENT", "description": "PK Violation"},
+            6: {"priority": "URGENT", "description": "referential integrity"},
         }
         self.date_time = datetime.utcnow()
         self.date = str(self.date_time.strftime("%Y%m%d"))
         self.cols = self.get_error_cols()
+        self.write_logs = settings.write_logs
+        self.verdict = "final"
+        self.verdict_confidence = 1.0
+        self.bfd = BucketFileData(storage=settings.storage)
 
     def log_info_wrong_file_name(self, file, error_log):
         """This method creates the log structure for wrong file name
@@ -455,6 +1437,35 @@ class ErrorLogging:
                 "exception: class ErrorLogging: Method: log_info_file_empty: " + str(e)
             )
 
+    def log_info_verdict_retracted(self, file, error_log):
+        """This method creates the log structure for a retracted provisional verdict
+
+        Attributes:
+            file (File Object): stores file object
+            error_log (dict): error data for formating
+
+        return:
+            log (dict): formatted final log
+        """
+        try:
+            log = {}
+            log["error_code"] = error_log["error_code"]
+            log["error_type"] = self.error_types[error_log["error_code"]]["description"]
+            log["description"] = (
+                "\n\tThe full validation of the file passed: the provisional "
+                + self.error_types[error_log["retracted_error_code"]]["description"]
+                + " alert is retracted"
+            )
+            log["priority"] = self.error_types[error_log["error_code"]]["priority"]
+            log = self.add_common_fields_to_log(log, file)
+            log = self.reorder_log(log)
+            return log
+        except Exception as e:
+            print(
+                "exception: class ErrorLogging: Method: log_info_verdict_retracted: "
+                + str(e)
+            )
+
     def log_info_wrong_file_structure(self, file, error_log):
         """This method creates the log structure for wrong file structure
 
@@ -477,9 +1488,10 @@ class ErrorLogging:
             log["expected_fields"] = error_log["expected_fields"]
             log["no_supplied_fields"] = str(len(error_log["supplied_fields"]))
             log["no_expected_fields"] = str(len(error_log["expected_fields"]))
-            log[
-                "description"
-            ] = f"\n\t{ file.file_name}: Number of Rows:  {file.file_no_of_rows}"
+            no_of_rows = self.get_no_of_rows(file)
+            log["description"] = "\n\t{}: Number of Rows:  {}".format(
+                file.file_name, "unknown" if no_of_rows is None else no_of_rows
+            )
             log["description"] += self.add_log_desc_file_structure(log)
             log["priority"] = self.error_types[error_log["error_code"]]["priority"]
             log = self.add_common_fields_to_log(log, file)
@@ -489,12 +1501,42 @@ class ErrorLogging:
             return self.reorder_log(log)
         except Exception as e:
             print(
-                "exception: class ErrorLogging: Method: log_info_wrong_file_structure: "
+                "exception: class ErrorLogging: Method: log_info_wrong_file_structure: "
+                + str(e)
+            )
+
+    def log_info_file_pk_violation(self, file, error_log):
+        """This method creates the log structure for wrong field datatypes
+
+        Attributes:
+            file (File Object): stores file object
+            error_log (dict): error data for formating
+
+        return:
+            log (dict): formatted error log
+        """
+        try:
+            log = {}
+            log["error_code"] = error_log["error_code"]
+            log["error_type"] = (
+                self.error_types[error_log["error_code"]]["description"]
+                if error_log["error_code"] in self.error_types
+                else "N/A"
+            )
+            log["description"] = error_log["pks_rows"]
+            log["priority"] = self.error_types[error_log["error_code"]]["priority"]
+            log = self.add_common_fields_to_log(log, file)
+            log["description"] = self.add_log_desc_pk_violation(log)
+            log = self.reorder_log(log)
+            return log
+        except Exception as e:
+            print(
+                "exception: class ErrorLogging: Method: log_info_file_pk_violation: "
                 + str(e)
             )
 
-    def log_info_file_pk_violation(self, file, error_log):
-        """This method creates the log structure for wrong field datatypes
+    def log_info_referential_integrity(self, file, error_log):
+        """This method creates the log structure for keys missing in parent files
 
         Attributes:
             file (File Object): stores file object
@@ -511,18 +1553,25 @@ class ErrorLogging:
                 if error_log["error_code"] in self.error_types
                 else "N/A"
             )
-            log["description"] = error_log["pks_rows"]
+            log["description"] = error_log["orphans"]
             log["priority"] = self.error_types[error_log["error_code"]]["priority"]
             log = self.add_common_fields_to_log(log, file)
-            log["description"] = self.add_log_desc_pk_violation(log)
+            log["description"] = self.add_log_desc_referential_integrity(log)
             log = self.reorder_log(log)
             return log
         except Exception as e:
             print(
-                "exception: class ErrorLogging: Method: log_info_file_pk_violation: "
+                "exception: class ErrorLogging: Method: log_info_referential_integrity: "
                 + str(e)
             )
 
+    def get_no_of_rows(self, file):
+        """This method returns the number of rows of a file, None if unknown
+
+        A provisional verdict only read a sample of the rows of the file.
+        """
+        return file.file_no_of_rows if self.verdict == "final" else None
+
     def add_common_fields_to_log(self, log, file):
 
         try:
@@ -531,7 +1580,7 @@ class ErrorLogging:
             log["program"] = file.program_slug
             log["file_name"] = file.file_name
             log["file_path"] = file.file_path
-            log["file_no_of_rows"] = file.file_no_of_rows
+            log["file_no_of_rows"] = self.get_no_of_rows(file)
 
             log["log_file_name"] = "_".join(
                 [
@@ -552,20 +1601,14 @@ class ErrorLogging:
                 ]
             )
             log["date_time"] = self.date_time
+            log["verdict"] = self.verdict
+            log["verdict_confidence"] = self.verdict_confidence
 
-            self.partner_schedule = self.partner_schedule[
-                self.partner_schedule["partner"] == file.partner_slug
-            ]
-            log["partner_emails"] = (
-                str(self.partner_schedule["partner_emails"].values.tolist()[0])
-                .replace("nan", "")
-                .strip()
-            )
-            log["internal_emails"] = (
-                str(self.partner_schedule["internal_emails"].values.tolist()[0])
-                .replace("nan", "")
-                .strip()
+            contacts = self.settings.get_partner_contacts().get(
+                file.partner_slug, parse_partner_contacts(None, None)
             )
+            log["partner_emails"] = contacts["partner_emails"]
+            log["internal_emails"] = contacts["internal_emails"]
             return log
         except Exception as e:
             print(
@@ -700,27 +1743,57 @@ class ErrorLogging:
                 + str(e)
             )
 
+    def add_log_desc_referential_integrity(self, log):
+        try:
+            desc = "\n\tKeys missing in the parent files:"
+            for orphans in log["description"]:
+                desc += ": ".join(
+                    [
+                        "\n\t\t" + orphans["column"],
+                        "not in " + orphans["parent_file"],
+                        orphans["parent_column"],
+                        "Orphans",
+                        str(orphans["no_of_orphans"]),
+                    ]
+                )
+                desc += "\n\t\tFor: " + ", ".join(map(str, orphans["samples"]))
+            desc += "\n\t\t..........."
+            return desc
+        except Exception as e:
+            print(
+                "exception: class ErrorLogging: Method: add_log_desc_referential_integrity: "
+                + str(e)
+            )
+
     def add_logs_to_bucket(self, logs_bucket, log):
         try:
             # datahub_error_logs_partner_program_file_date.csv
+            if not self.write_logs:
+                return False
 
-            bfd = BucketFileData()
+            bfd = self.bfd
             file_path = log["log_file_path"]
 
             df = pd.DataFrame(log, index=[0])
-            file_logs_df = bfd.read_csv(logs_bucket, file_path)
             df["send_email"] = True
-            if file_logs_df is not None:
-                # check if email already sent
-                if list(df["description"])[0] in list(file_logs_df["description"]):
-                    df["send_email"] = False
-                # concatenate logs
-                file_logs_df = pd.concat([file_logs_df[self.cols], df[self.cols]])[
-                    self.cols
-                ]
-            else:
-                file_logs_df = df[self.cols]
-            bfd.upload_csv(logs_bucket, file_logs_df, file_path)
+            # the files of a drop are logged concurrently to the same log file
+            with self.settings.get_log_lock(file_path):
+                file_logs_df = bfd.read_csv(logs_bucket, file_path)
+                if file_logs_df is not None:
+                    # check if email already sent
+                    if list(df["description"])[0] in list(file_logs_df["description"]):
+                        df["send_email"] = False
+                    # concatenate logs, logs written before a column was added get
+                    # it empty
+                    file_logs_df = pd.concat(
+                        [file_logs_df.reindex(columns=self.cols), df[self.cols]]
+                    )[self.cols]
+                else:
+                    file_logs_df = df[self.cols]
+                bfd.upload_csv(logs_bucket, file_logs_df, file_path)
+            history_store = self.settings.get_history_store()
+            if history_store is not None:
+                history_store.add_logs([log])
             return df["send_email"].values[0]
         except Exception as e:
             print(
@@ -770,6 +1843,8 @@ class ErrorLogging:
             "internal_emails",
             "send_email",
             "date_time",
+            "verdict",
+            "verdict_confidence",
         ]
         return cols
 
@@ -780,6 +1855,32 @@ class Settings:
     Attributes:
         logs_bucket (str): bucket where the logs folders and files are located
         settings_bucket (str): bucket where the settings folders and files are located
+        write_logs (bool): whether error logs are written to the logs bucket
+        export_row_results (bool): whether per row results are written next to the logs
+        quarantine (bool): whether rejected files are split into valid and rejected rows
+        sample_threshold_bytes (int): files above this size get a provisional verdict
+            from a sample before the full validation, 0 disables sampling
+        no_of_samples (int): number of ranged reads in a sample
+        sample_bytes (int): size of each ranged read
+        history_db (str): validation history database every log is also added to,
+            see history.py, no history is kept if not set
+        history_store (HistoryStore): history database opened once per settings
+        log_locks (dict): log file path => lock held while the log file is
+            read, appended to and written
+        drop_mode (bool): whether a landed file waits for the other files of its
+            partner's daily drop, which are then validated together (ValidateDrop)
+        drop_table (str): DynamoDB table of the claim records of the drops
+        drop_deadline (int): seconds after the first file of a drop landed when
+            its landed files are validated even if files are missing
+        dispatch_jobs (bool): whether a file which passed the full validation
+            executes its MEGA job, replacing the datahub_job_runner trigger
+        check_references (bool): whether the keys of the child files are checked
+            against their parent files of the same day, see REFERENCES, off until
+            the partners are told about the referential integrity error
+        key_indexes (KeyIndexes): key indexes of the parent files, shared by
+            every file validated with the settings
+        settings_folder (str): settings folder, point it to a copy of the
+            settings to validate with another settings version
         metadata_file (str): file location for metadata file with partner/program level file settings
         fieldnames_file (str): file location for file field names settings
         partner_schedule_file (str): file location for partner level settings
@@ -787,13 +1888,42 @@ class Settings:
         mt_data (dataframe): metadata data
         ps_data (dataframe): partner schedule data
         fn_data (dataframe): file names data
+        storage (StorageBackend): backend used to read and write bucket files
         cls_read_file (class obj): BucketFileData object for reading file data
+        partner_artifact_file (str): key of the compiled partner artifact in the
+            settings bucket, the partner schedule csv is read if not set
+        partner_artifact (dict): loaded partner artifact
+        partner_contacts (dict): partner => contacts, built once per settings
     """
 
-    def __init__(self,):
-        self.settings_bucket = "coursera-data-engineering"
-        self.logs_bucket = "coursera-data-engineering"
-        folder = "datahub/datahub_validator/settings/"
+    def __init__(self, storage=None, folder="datahub/datahub_validator/settings/"):
+        self.settings_bucket = os.environ.get(
+            "DATAHUB_SETTINGS_BUCKET", "coursera-data-engineering"
+        )
+        self.logs_bucket = os.environ.get(
+            "DATAHUB_LOGS_BUCKET", "coursera-data-engineering"
+        )
+        self.write_logs = True
+        self.export_row_results = os.environ.get("DATAHUB_ROW_RESULTS", "1") == "1"
+        self.quarantine = os.environ.get("DATAHUB_QUARANTINE", "0") == "1"
+        self.sample_threshold_bytes = int(
+            os.environ.get("DATAHUB_SAMPLE_THRESHOLD_BYTES", "0")
+        )
+        self.no_of_samples = int(os.environ.get("DATAHUB_NO_OF_SAMPLES", "4"))
+        self.sample_bytes = int(os.environ.get("DATAHUB_SAMPLE_BYTES", "262144"))
+        self.dispatch_jobs = os.environ.get("DATAHUB_DISPATCH_JOBS", "0") == "1"
+        self.history_db = os.environ.get("DATAHUB_HISTORY_DB")
+        self.history_store = None
+        self.history_lock = threading.Lock()
+        self.log_locks = {}
+        self.log_locks_lock = threading.Lock()
+        self.drop_mode = os.environ.get("DATAHUB_DROP_MODE", "0") == "1"
+        self.drop_table = os.environ.get(
+            "DATAHUB_DROP_TABLE", "datahub_validator_drops"
+        )
+        self.drop_deadline = int(os.environ.get("DATAHUB_DROP_DEADLINE", "21600"))
+        self.check_references = os.environ.get("DATAHUB_CHECK_REFERENCES", "0") == "1"
+        self.settings_folder = folder
         self.metadata_file = folder + "metadata.csv"
         self.fieldnames_file = folder + "fieldnames.csv"
         self.partner_schedule_file = folder + "partner_schedule.csv"
@@ -801,7 +1931,12 @@ class Settings:
         self.mt_data = None
         self.ps_data = None
         self.fn_data = None
-        self.cls_read_file = BucketFileData()
+        self.storage = storage if storage is not None else get_storage_backend()
+        self.cls_read_file = BucketFileData(storage=self.storage)
+        self.partner_artifact_file = os.environ.get("DATAHUB_PARTNER_ARTIFACT")
+        self.partner_artifact = None
+        self.partner_contacts = None
+        self.key_indexes = KeyIndexes(self)
 
     def get_metadata(self):
         """This method extracts metadata from the metadata file
@@ -828,6 +1963,10 @@ class Settings:
             ps_data (dataframe): partner schedule data
         """
         try:
+            artifact = self.get_partner_artifact()
+            if artifact is not None:
+                ps_data = pd.DataFrame(artifact["schedule"])
+                return ps_data.where(ps_data.notna(), np.nan)
             ps_data = self.cls_read_file.read_csv(
                 self.settings_bucket, self.partner_schedule_file
             )
@@ -835,6 +1974,106 @@ class Settings:
         except Exception as e:
             print("exception: class Settings: Method: get_partner_schedule: " + str(e))
 
+    def get_partner_artifact(self):
+        """This method loads the compiled partner artifact once
+
+        return:
+            partner_artifact (dict): the artifact, None if not configured or not readable
+        """
+        if self.partner_artifact is None and self.partner_artifact_file:
+            try:
+                with self.storage.open(
+                    self.settings_bucket, self.partner_artifact_file
+                ) as body:
+                    artifact = json.loads(body.read())
+                if artifact.get("format") != PARTNER_ARTIFACT_FORMAT:
+                    raise ValueError(
+                        "unsupported artifact format: " + str(artifact.get("format"))
+                    )
+                self.partner_artifact = artifact
+            except Exception as e:
+                print(
+                    "exception: class Settings: Method: get_partner_artifact: " + str(e)
+                )
+                # fall back to the settings csv files
+                self.partner_artifact_file = None
+        return self.partner_artifact
+
+    def get_log_lock(self, log_file_path):
+        """This method returns the lock of a log file, created on first use"""
+        with self.log_locks_lock:
+            return self.log_locks.setdefault(log_file_path, threading.Lock())
+
+    def get_history_store(self):
+        """This method opens the validation history database once
+
+        return:
+            history_store (HistoryStore): store the logs are added to, None if no
+                history is kept
+        """
+        if not self.history_db:
+            return None
+        with self.history_lock:
+            if self.history_store is None:
+                # only needed when the history is kept next to the logs
+                from datahub_degree_validator.history import HistoryStore
+
+                self.history_store = HistoryStore(self.history_db)
+        return self.history_store
+
+    def get_partner_contacts(self):
+        """This method indexes the contacts of every partner once
+
+        The contacts of a partner are on its first partner schedule row.
+
+        return:
+            partner_contacts (dict): partner => partner_emails, internal_emails,
+                partner_recipients and internal_recipients, empty if not readable
+        """
+        if self.partner_contacts is not None:
+            return self.partner_contacts
+        try:
+            partner_contacts = {}
+            artifact = self.get_partner_artifact()
+            if artifact is not None:
+                for partner, row in artifact["partners"].items():
+                    partner_contacts[partner] = parse_partner_contacts(
+                        row["partner_emails"], row["internal_emails"]
+                    )
+            else:
+                ps_data = self.ps_data
+                if ps_data is None:
+                    ps_data = self.get_partner_schedule()
+                for partner, partner_emails, internal_emails in zip(
+                    ps_data["partner"].tolist(),
+                    ps_data["partner_emails"].tolist(),
+                    ps_data["internal_emails"].tolist(),
+                ):
+                    if partner not in partner_contacts:
+                        partner_contacts[partner] = parse_partner_contacts(
+                            partner_emails, internal_emails
+                        )
+            self.partner_contacts = partner_contacts
+            return partner_contacts
+        except Exception as e:
+            print("exception: class Settings: Method: get_partner_contacts: " + str(e))
+            # not kept, the next call reads the partner schedule again
+            return {}
+
+    def get_swap_rules(self):
+        """This method returns the file name swaps of the partner schedule
+
+        return:
+            swap_rules (list): [partner, program, file, swapped file] of every swap
+        """
+        artifact = self.get_partner_artifact()
+        if artifact is not None:
+            return artifact["swap_rules"]
+        swap_rules = []
+        for _, row in self.get_partner_schedule().iterrows():
+            swap_rules += get_swap_rules(row["partner"], row["swap_files"])
+        return swap_rules
+
     def get_fieldnames(self,):
         """This method extracts file names data from the file_names file
         return:
@@ -857,22 +2096,13 @@ class Settings:
 
     def swap_mt_data_file_names(self, mt_data):
         try:
-            ps_data = self.get_partner_schedule()
-
-            for _, row in ps_data.iterrows():
-                if str(row["swap_files"]) != "nan":
-                    programs = str(row["swap_files"]).split("|")
-                    for program in programs:
-                        program, files = program.split(":")
-                        files = files.split(";")
-                        for file in files:
-                            file = file.replace("\\", "").split(",")
-                            mt_data.loc[
-                                (mt_data["partner"] == row["partner"])
-                                & (mt_data["program"] == program)
-                                & (mt_data["file"] == file[0]),
-                                "file",
-                            ] = file[1]
+            for partner, program, file, swapped_file in self.get_swap_rules():
+                mt_data.loc[
+                    (mt_data["partner"] == partner)
+                    & (mt_data["program"] == program)
+                    & (mt_data["file"] == file),
+                    "file",
+                ] = swapped_file
             return mt_data
         except Exception as e:
             print(
@@ -881,17 +2111,8 @@ class Settings:
 
     def swap_fn_data_file_names(self, fn_data):
         try:
-            ps_data = self.get_partner_schedule()
-
-            for _, row in ps_data.iterrows():
-                if str(row["swap_files"]) != "nan":
-                    programs = str(row["swap_files"]).split("|")
-                    for program in programs:
-                        program, files = program.split(":")
-                        files = files.replace("\\", "").split(";")
-                        for file in files:
-                            file = file.split(",")
-                            fn_data.loc[(fn_data["file"] == file[0]), "file"] = file[1]
+            for _, _, file, swapped_file in self.get_swap_rules():
+                fn_data.loc[(fn_data["file"] == file), "file"] = swapped_file
             return fn_data
         except Exception as e:
             print(
@@ -958,15 +2179,286 @@ class Settings:
             print("exception: class Settings: Method: get_field_regex: " + str(e))
 
 
+def get_swap_rules(partner, swap_files):
+    """This function parses the swap_files entry of a partner schedule row
+
+    Attributes:
+        partner (str): partner slug
+        swap_files (str): program:file,swapped file;file,swapped file|program:...
+    return:
+        swap_rules (list): [partner, program, file, swapped file] of every swap
+    """
+    swap_rules = []
+    if str(swap_files) == "nan":
+        return swap_rules
+    for program in str(swap_files).split("|"):
+        program, files = program.split(":")
+        for file in files.replace("\\", "").split(";"):
+            file = file.split(",")
+            swap_rules.append([partner, program, file[0], file[1]])
+    return swap_rules
+
+
+def get_ignored_names(ignore_files, program):
+    """This function returns the folders and files a program does not send
+
+    Attributes:
+        ignore_files (str): partner schedule rules: program:folder_or_file,...|...
+        program (str): program slug
+    return:
+        names (list): ignored folders and files of the program
+    """
+    if ignore_files is None or pd.isna(ignore_files):
+        return []
+    names = []
+    for rule in str(ignore_files).split("|"):
+        rule_program, _, rule_names = rule.partition(":")
+        if rule_program.strip() == program:
+            names += [name.strip() for name in rule_names.split(",") if name.strip()]
+    return names
+
+
+def parse_partner_contacts(partner_emails, internal_emails):
+    """This function parses the contacts of a partner schedule row
+
+    Attributes:
+        partner_emails (str): ; separated partner emails, None or NaN if missing
+        internal_emails (str): ; separated internal emails, None or NaN if missing
+    return:
+        contacts (dict): emails as logged and the recipient lists they are sent to
+    """
+    contacts = {}
+    for name, emails in [
+        ("partner", partner_emails),
+        ("internal", internal_emails),
+    ]:
+        emails = "" if emails is None or pd.isna(emails) else str(emails).strip()
+        contacts[name + "_emails"] = emails
+        contacts[name + "_recipients"] = get_recipients(emails)
+    return contacts
+
+
+def get_recipients(emails):
+    """This function splits ; separated emails, shorter values hold no email"""
+    if len(emails) <= 3:
+        return []
+    return [email.strip() for email in emails.split(";") if email.strip()]
+
+
+def get_key_values(values):
+    """This function returns the non null key values of a column as strings
+
+    An integer column with a null is read as floats, its values are turned back
+    into integers so the same key is equal in every file.
+    """
+    values = values.dropna()
+    if values.dtype.kind == "f" and (values % 1 == 0).all():
+        values = values.astype("int64")
+    return values.astype(str).str.strip()
+
+
+def hash_keys(values):
+    """This function hashes key values to 64 bit integers
+
+    The hash does not change between runs, so persisted indexes stay valid.
+    """
+    return pd.util.hash_array(values.to_numpy(dtype=object))
+
+
+def get_storage_backend():
+    """This function returns the storage backend selected by configuration
+
+    Environment:
+        DATAHUB_STORAGE_BACKEND (str): "s3" (default) or "local"
+        DATAHUB_STORAGE_ROOT (str): root folder of the local backend,
+            each bucket is a sub folder of the root
+    return:
+        storage (StorageBackend): configured storage backend
+    """
+    backend = os.environ.get("DATAHUB_STORAGE_BACKEND", "s3").lower()
+    if backend == "local":
+        return LocalStorage(os.environ.get("DATAHUB_STORAGE_ROOT", "."))
+    if backend == "s3":
+        return S3Storage()
+    raise ValueError(f"Unknown DATAHUB_STORAGE_BACKEND: {backend}")
+
+
+class StorageBackend(ABC):
+    """This class defines the interface used to read/write bucket objects
+
+    Implementations address objects by (bucket, key) the same way s3 does,
+    so the validator code does not depend on where the files live. A backend
+    which misses a method cannot be created.
+    """
+
+    @abstractmethod
+    def open(self, bucket, key):
+        """This method opens an object for binary reading
+
+        return:
+            body (file like object): readable and closable object data
+        """
+
+    @abstractmethod
+    def put_object(self, bucket, key, body):
+        """This method writes an object
+
+        Attributes:
+            body (str or bytes): object data
+        """
+
+    @abstractmethod
+    def delete_object(self, bucket, key):
+        """This method deletes an object, a missing object is not an error"""
+
+    @abstractmethod
+    def list_keys(self, bucket, prefix="", details=False):
+        """This method lists the object keys starting with prefix
+
+        Attributes:
+            details (bool): whether the size and etag of every object are listed
+        return:
+            keys (list): sorted object keys, (key, size, etag) if details
+        """
+
+    @abstractmethod
+    def get_size(self, bucket, key):
+        """This method returns the object size in bytes"""
+
+    @abstractmethod
+    def get_range(self, bucket, key, start, length):
+        """This method reads length bytes of an object from offset start
+
+        return:
+            data (bytes): object bytes, shorter at the end of the object
+        """
+
+
+class S3Storage(StorageBackend):
+    """This class reads/writes objects from s3
+
+    Attributes:
+        s3 (boto.client):  used to declare s3 bucket client methods
+    """
+
+    def __init__(self, s3=None):
+        self.s3 = s3 if s3 is not None else boto3.client("s3")
+
+    def open(self, bucket, key):
+        res = self.s3.get_object(Bucket=bucket, Key=key)["Body"]
+        return BytesIO(res.read())
+
+    def put_object(self, bucket, key, body):
+        return self.s3.put_object(Body=body, Bucket=bucket, Key=key)
+
+    def delete_object(self, bucket, key):
+        return self.s3.delete_object(Bucket=bucket, Key=key)
+
+    def list_keys(self, bucket, prefix="", details=False):
+        keys = []
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if details:
+                    keys.append((obj["Key"], obj["Size"], obj["ETag"]))
+                else:
+                    keys.append(obj["Key"])
+        return sorted(keys)
+
+    def get_size(self, bucket, key):
+        return self.s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+
+    def get_range(self, bucket, key, start, length):
+        byte_range = f"bytes={start}-{start + length - 1}"
+        res = self.s3.get_object(Bucket=bucket, Key=key, Range=byte_range)
+        return res["Body"].read()
+
+
+class LocalStorage(StorageBackend):
+    """This class reads/writes objects from the local filesystem
+
+    Attributes:
+        root (str): folder containing one sub folder per bucket
+        bucket_dirs (dict): optional bucket => folder overrides
+    """
+
+    def __init__(self, root=".", bucket_dirs=None):
+        self.root = root
+        self.bucket_dirs = bucket_dirs or {}
+
+    def get_path(self, bucket, key):
+        """This method maps a bucket key to a local file path"""
+        folder = self.bucket_dirs.get(bucket, os.path.join(self.root, bucket))
+        return os.path.join(folder, *key.split("/"))
+
+    def open(self, bucket, key):
+        file = open(self.get_path(bucket, key), "rb")
+        try:
+            # mmap avoids copying the file into the process before parsing
+            body = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be memory mapped
+            return file
+        file.close()
+        return body
+
+    def put_object(self, bucket, key, body):
+        path = self.get_path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(body, str):
+            body = body.encode("utf8")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(body)
+        os.replace(tmp_path, path)
+        return {"Key": key}
+
+    def delete_object(self, bucket, key):
+        try:
+            os.remove(self.get_path(bucket, key))
+        except FileNotFoundError:
+            pass
+        return {"Key": key}
+
+    def list_keys(self, bucket, prefix="", details=False):
+        folder = self.bucket_dirs.get(bucket, os.path.join(self.root, bucket))
+        keys = []
+        for dir_path, _, file_names in os.walk(folder):
+            rel_dir = os.path.relpath(dir_path, folder).replace(os.sep, "/")
+            for file_name in file_names:
+                key = file_name if rel_dir == "." else rel_dir + "/" + file_name
+                if not key.startswith(prefix):
+                    continue
+                if details:
+                    # the modification time stands in for the s3 etag
+                    stat = os.stat(os.path.join(dir_path, file_name))
+                    keys.append((key, stat.st_size, str(stat.st_mtime_ns)))
+                else:
+                    keys.append(key)
+        return sorted(keys)
+
+    def get_size(self, bucket, key):
+        return os.path.getsize(self.get_path(bucket, key))
+
+    def get_range(self, bucket, key, start, length):
+        with open(self.get_path(bucket, key), "rb") as file:
+            file.seek(start)
+            return file.read(length)
+
+
 class BucketFileData:
     """This class used read/upload buket file data BucketFileData
 
     Attributes:
         s3 (boto.client):  used to declare s3 bucket client methods
+        storage (StorageBackend): backend to read/write through, the configured
+            backend is used when neither s3 nor storage is supplied
     """
 
-    def __init__(self, s3=None):
-        self.s3 = boto3.client("s3")
+    def __init__(self, s3=None, storage=None):
+        if storage is None:
+            storage = S3Storage(s3) if s3 is not None else get_storage_backend()
+        self.storage = storage
 
     def read_csv(self, bucket, file_path):
         """Function reads csv file and returns a pandas data frame
@@ -978,19 +2470,95 @@ class BucketFileData:
         """
         try:
 
-            res = self.s3.get_object(Bucket=bucket, Key=file_path)["Body"]
-            data_frame = pd.read_csv(
-                BytesIO(res.read()),
-                encoding="ISO-8859-1",
-                keep_default_na=False,
-                na_values=["NULL", ""],
-            )
-            data_frame.columns = map(str.lower, data_frame.columns)
-
-            return data_frame
+            with self.storage.open(bucket, file_path) as body:
+                return self.parse_csv(body)
         except Exception:
             return
 
+    def parse_csv(self, body):
+        """Function parses csv data the way partner files are read
+
+        Attributes:
+            body (file like object): csv data
+        return:
+            data_frame (dataframe): dataframe with data from csv
+        """
+        data_frame = pd.read_csv(
+            body, encoding="ISO-8859-1", keep_default_na=False, na_values=["NULL", ""],
+        )
+        data_frame.columns = map(str.lower, data_frame.columns)
+        return data_frame
+
+    def read_csv_sample(self, bucket, file_path, no_of_samples, sample_bytes):
+        """Function reads a row aligned sample of a csv file
+
+        The file is read with no_of_samples ranged reads evenly spread over the
+        file. The partial rows at both ends of each range are dropped, so every
+        sampled row is a complete row of the file and no row is sampled twice.
+        Ranges are aligned on raw newlines, a range starting in a quoted field
+        holding a newline is misaligned: a sample whose rows do not tokenize to
+        the columns of the header is inconclusive.
+
+        Attributes:
+            bucket (str):  name of the bucket string
+            file_path (str):  path to the file string
+            no_of_samples (int): number of ranged reads
+            sample_bytes (int): size of each ranged read
+        return:
+            data_frame (dataframe): sampled rows, None if the file cannot be read
+                or the sample is inconclusive
+            sampled_bytes (int): number of bytes the rows were parsed from
+            size (int): file size
+        """
+        try:
+            size = self.storage.get_size(bucket, file_path)
+            sample_bytes = min(sample_bytes, max(size // no_of_samples, 1))
+            if size <= no_of_samples * sample_bytes:
+                return self.read_csv(bucket, file_path), size, size
+
+            chunks = []
+            for i in range(no_of_samples):
+                start = i * size // no_of_samples
+                data = self.storage.get_range(bucket, file_path, start, sample_bytes)
+                if start + len(data) < size:
+                    # drop the partial row at the end of the range
+                    data = data[: data.rfind(b"\n") + 1]
+                elif not data.endswith(b"\n"):
+                    data += b"\n"
+                if i == 0:
+                    header, _, data = data.partition(b"\n")
+                else:
+                    # drop the partial row at the start of the range
+                    data = data[data.find(b"\n") + 1 :] if b"\n" in data else b""
+                chunks.append(data)
+
+            if not self.is_row_aligned(header, chunks):
+                print(file_path, ": sample not row aligned, inconclusive")
+                return None, 0, size
+            body = BytesIO(header + b"\n" + b"".join(chunks))
+            sampled_bytes = sum(len(chunk) for chunk in chunks)
+            return self.parse_csv(body), sampled_bytes, size
+        except Exception as e:
+            print("exception: class BucketFileData: Method: read_csv_sample: " + str(e))
+            return None, 0, 0
+
+    def is_row_aligned(self, header, chunks):
+        """Function checks every row of the sampled chunks has the header columns
+
+        return:
+            aligned (bool): False on a tokenizer error or a column count mismatch
+        """
+        try:
+            no_of_columns = len(next(csv.reader([header.decode("ISO-8859-1")])))
+            for chunk in chunks:
+                rows = csv.reader(StringIO(chunk.decode("ISO-8859-1")), strict=True)
+                for row in rows:
+                    if row and len(row) != no_of_columns:
+                        return False
+            return True
+        except csv.Error:
+            return False
+
     def upload_csv(self, bucket, file_df, s3_file_path):
         """Function upload csv file into bucket and returns a pandas data frame
         Attributes:
@@ -1005,9 +2573,7 @@ class BucketFileData:
             buffer = StringIO()
             file_df.to_csv(buffer, header=True, index=False, quoting=csv.QUOTE_ALL)
             buffer.seek(0)
-            response = self.s3.put_object(
-                Body=buffer.getvalue(), Bucket=bucket, Key=s3_file_path
-            )
+            response = self.storage.put_object(bucket, s3_file_path, buffer.getvalue())
             return response
         except Exception as e:
             print(
@@ -1015,6 +2581,221 @@ class BucketFileData:
             )
 
 
+class RowResults:
+    """This class collects per row validation results while a file is validated
+
+    The results are kept in the same pass as the validations, so exporting them
+    never reads the file again. Column i of the file is bit i of the
+    failing_columns bitmask, columns from the 64th on share the last bit.
+
+    Attributes:
+        columns (list): file columns in file order
+        failing_columns (array): per row bitmask of columns with wrong datatypes
+        pk_duplicate (array): per row flag for rows sharing a primary key
+        datatypes_checked (bool): whether the datatype validation ran
+        pk_checked (bool): whether the primary key validation ran
+    """
+
+    def __init__(self, columns, no_of_rows):
+        self.columns = list(columns)
+        self.failing_columns = np.zeros(no_of_rows, dtype=np.uint64)
+        self.pk_duplicate = np.zeros(no_of_rows, dtype=bool)
+        self.datatypes_checked = False
+        self.pk_checked = False
+
+    def get_column_bit(self, column):
+        """This method returns the bitmask bit of a column"""
+        return np.uint64(1) << np.uint64(min(self.columns.index(column), 63))
+
+    def add_failing_column(self, column, failed):
+        """This method flags the rows where a column has a wrong datatype
+
+        Attributes:
+            column (str): file column
+            failed (list): per row flag, True where the value is wrong
+        """
+        bit = self.get_column_bit(column)
+        self.failing_columns[np.asarray(failed, dtype=bool)] |= bit
+
+    def set_pk_duplicates(self, file_data, pk_cols):
+        """This method flags the rows sharing a primary key with another row
+
+        Rows with a null primary key column are not flagged, in line with
+        the primary key validation which does not count them.
+        """
+        duplicated = file_data.duplicated(subset=pk_cols, keep=False)
+        duplicated &= file_data[pk_cols].notna().all(axis=1)
+        self.pk_duplicate = duplicated.to_numpy(dtype=bool)
+        self.pk_checked = True
+
+    def get_failing_column_names(self, bitmask):
+        """This method decodes a failing_columns bitmask into column names"""
+        return [
+            column
+            for i, column in enumerate(self.columns[:64])
+            if int(bitmask) & (1 << min(i, 63))
+        ]
+
+    def to_parquet(self, metadata=None):
+        """This method serializes the results to zstd compressed parquet
+
+        Attributes:
+            metadata (dict): extra schema metadata eg. file path
+
+        return:
+            body (bytes): parquet file data
+        """
+        table = pa.table(
+            {
+                "row_number": pa.array(
+                    np.arange(1, len(self.pk_duplicate) + 1), pa.int64()
+                ),
+                "failing_columns": pa.array(self.failing_columns, pa.uint64()),
+                "pk_duplicate": pa.array(self.pk_duplicate, pa.bool_()),
+            }
+        )
+        schema_metadata = {
+            "columns": json.dumps(self.columns),
+            "datatypes_checked": str(self.datatypes_checked),
+            "pk_checked": str(self.pk_checked),
+        }
+        schema_metadata.update(metadata or {})
+        table = table.replace_schema_metadata(schema_metadata)
+        buffer = BytesIO()
+        pq.write_table(table, buffer, compression="zstd")
+        return buffer.getvalue()
+
+
+class KeyIndexes:
+    """This class keeps the key indexes of the parent files
+
+    A key index is the sorted unique hashes of the keys of a parent file column,
+    8 bytes a key whatever the key length. An index is built once and reused by
+    every child file validated with the same settings. The index of a parent
+    file which passed is persisted per partner program and day next to the
+    logs, so a child file landing later does not read its parent file again.
+    A parent file which failed is marked failed instead, its child files are
+    not checked. Parent files are matched whatever the case of their key.
+
+    Attributes:
+        settings (Settings): settings whose storage and logs bucket are used
+        indexes (dict): (lowercase parent file path, column) => index
+        failed (set): lowercase paths of the parent files which failed
+        lock (Lock): guards indexes and failed, the storage is read and written
+            outside it
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.indexes = {}
+        self.failed = set()
+        self.lock = threading.Lock()
+
+    def get_index_path(self, file_path, column):
+        """This method returns the logs bucket key of a persisted index"""
+        file_path = file_path.lower()
+        return KEY_INDEXES_FOLDER + file_path[: -len(".csv")] + "/" + column + ".npy"
+
+    def get_failed_path(self, file_path):
+        """This method returns the logs bucket key of the failed marker of a file"""
+        file_path = file_path.lower()
+        return KEY_INDEXES_FOLDER + file_path[: -len(".csv")] + "/failed"
+
+    def add(self, file_path, column, values):
+        """This method indexes and persists the keys of a parent file which passed
+
+        Attributes:
+            file_path (str): parent file path
+            column (str): parent file column
+            values (series): column values
+
+        return:
+            index (array): sorted unique key hashes
+        """
+        index = np.unique(hash_keys(get_key_values(values)))
+        with self.lock:
+            self.indexes[(file_path.lower(), column)] = index
+            self.failed.discard(file_path.lower())
+        if self.settings.write_logs:
+            body = BytesIO()
+            np.save(body, index)
+            self.settings.storage.put_object(
+                self.settings.logs_bucket,
+                self.get_index_path(file_path, column),
+                body.getvalue(),
+            )
+            self.settings.storage.delete_object(
+                self.settings.logs_bucket, self.get_failed_path(file_path)
+            )
+        return index
+
+    def fail(self, file_path, columns):
+        """This method drops the indexes of a parent file which failed and marks it
+
+        Attributes:
+            file_path (str): parent file path
+            columns (list): parent file columns
+        """
+        with self.lock:
+            for column in columns:
+                self.indexes.pop((file_path.lower(), column), None)
+            self.failed.add(file_path.lower())
+        if self.settings.write_logs:
+            self.settings.storage.put_object(
+                self.settings.logs_bucket, self.get_failed_path(file_path), b""
+            )
+            for column in columns:
+                self.settings.storage.delete_object(
+                    self.settings.logs_bucket, self.get_index_path(file_path, column)
+                )
+
+    def is_failed(self, file_path):
+        """This method returns whether a parent file is marked failed"""
+        with self.lock:
+            if file_path.lower() in self.failed:
+                return True
+        try:
+            with self.settings.storage.open(
+                self.settings.logs_bucket, self.get_failed_path(file_path)
+            ):
+                return True
+        except Exception:
+            return False
+
+    def get(self, partner_bucket, file_path, column):
+        """This method returns the index of a parent file column
+
+        The index is looked up in memory, then in the persisted indexes, else it
+        is built from the parent file, in memory only as the parent file did not
+        pass a validation.
+
+        return:
+            index (array): sorted unique key hashes, None if the parent file or
+                column does not exist, or the parent file failed
+        """
+        with self.lock:
+            if file_path.lower() in self.failed:
+                return
+            index = self.indexes.get((file_path.lower(), column))
+        if index is not None:
+            return index
+        try:
+            with self.settings.storage.open(
+                self.settings.logs_bucket, self.get_index_path(file_path, column)
+            ) as body:
+                index = np.load(BytesIO(body.read()))
+        except Exception:
+            if self.is_failed(file_path):
+                return
+            file_data = self.settings.cls_read_file.read_csv(partner_bucket, file_path)
+            if file_data is None or column not in file_data.columns:
+                return
+            index = np.unique(hash_keys(get_key_values(file_data[column])))
+        with self.lock:
+            # an index added meanwhile by the parent file validation wins
+            return self.indexes.setdefault((file_path.lower(), column), index)
+
+
 class File:
     """This class used model File object
 
@@ -1030,6 +2811,8 @@ class File:
         file_no_date_stamp_ext (str): file path with not date extension
         file_path_no_ext =  file path no extension
         self.file_no_of_rows = None
+        file_data (dataframe): parsed file data, read once and shared by all validations
+        row_results (RowResults): per row validation results
     """
 
     def __init__(self, file_path_list=None):
@@ -1050,6 +2833,8 @@ class File:
             file_path_list[:3] + [self.file_no_date_stamp_ext]
         )
         self.file_no_of_rows = None
+        self.file_data = None
+        self.row_results = None
 
     def set_file_regex(self, file_no_date_stamp_ext):
         regex = [
@@ -1074,8 +2859,18 @@ class SendEmail:
     -------
     send_email
         This method sends an email
+    send_drop_email
+        This method sends one email for the failed files of a drop
+
+    Parameters
+    ----------
+    settings: Settings
+        settings holding the partner contacts index, the log emails are parsed if None
     """
 
+    def __init__(self, settings=None):
+        self.settings = settings
+
     def send_email(self, log):
         """
         This method sends an email
@@ -1089,23 +2884,59 @@ class SendEmail:
         log: list
             This is contains the log information to send
         """
-        from_email = "datahub@coursera.org"
-        reply_to = "datahub@coursera.org"
-        email = [[], []]
         subject = (
-            log["priority"]
+            ("PROVISIONAL " if log.get("verdict") == "provisional" else "")
+            + log["priority"]
             + ": LAMBDA TEST: Coursera Data Exchange Automated Alert: "
             + "Please review file: "
             + log["file_name"]
             + " for Degree Program: "
             + log["program"]
         )
-        if len(log["internal_emails"]) > 3:
-            email[0] = log["internal_emails"].split(";")
-        if len(log["partner_emails"]) > 3:
-            email[1] = log["partner_emails"].split(";")
+        return self.send_message(log, subject, self.get_email_message(log))
+
+    def send_drop_email(self, logs):
+        """
+        This method sends one email for the failed files of a drop
+
+        Parameters
+        ----------
+        logs: list
+            The logs of the failed files of a partner program drop
+        """
+        priorities = [log["priority"] for log in logs]
+        subject = (
+            ("CRITICAL" if "CRITICAL" in priorities else priorities[0])
+            + ": LAMBDA TEST: Coursera Data Exchange Automated Alert: "
+            + "Please review "
+            + str(len(logs))
+            + " file(s): "
+            + ", ".join(log["file_name"] for log in logs)
+            + " for Degree Program: "
+            + logs[0]["program"]
+        )
+        message = self.get_email_header()
+        message += "\n\n".join(self.get_log_message(log) for log in logs)
+        message += self.get_email_footer()
+        return self.send_message(logs[0], subject, message)
+
+    def send_message(self, log, subject, message):
+        """
+        This method sends a message to the contacts of the partner of a log
+        """
+        from_email = "datahub@coursera.org"
+        reply_to = "datahub@coursera.org"
+        contacts = None
+        if self.settings is not None:
+            contacts = self.settings.get_partner_contacts().get(log["partner"])
+        if contacts is not None:
+            email = [contacts["internal_recipients"], contacts["partner_recipients"]]
+        else:
+            email = [
+                get_recipients(log["internal_emails"]),
+                get_recipients(log["partner_emails"]),
+            ]
 
-        message = self.get_email_message(log)
         client = boto3.client("ses", region_name="us-east-1")
         response = client.send_email(
             Source=from_email,
@@ -1125,11 +2956,20 @@ class SendEmail:
         return:
             message (str): formatted email message
         """
+        message = self.get_email_header()
+        message += self.get_log_message(log)
+        message += self.get_email_footer()
+        return message
+
+    def get_email_header(self):
         message = "\n\nThank you for your partnership in data exchange with Coursera."
         message += "\nPlease review the below issue(s) "
         message += "to ensure our platform can achieve our target "
         message += "reliability goals for this program:" + "\n\n"
-        message += ": ".join(
+        return message
+
+    def get_log_message(self, log):
+        message = ": ".join(
             [
                 "Logs for Partner",
                 log["partner"],
@@ -1141,7 +2981,10 @@ class SendEmail:
         if log["file_no_of_rows"]:
             message += ": Number of Rows: " + str(log["file_no_of_rows"])
         message += log["description"]
-        message += (
+        return message
+
+    def get_email_footer(self):
+        message = (
             "\n\nThis email is not monitored. For any questions relating to Datahub,"
         )
         message += " please email your Coursera Partner Product Specialist."
@@ -1149,5 +2992,4 @@ class SendEmail:
         message += (
             "partner-support@coursera.org to find your Partner Product Specialist."
         )
-
         return message
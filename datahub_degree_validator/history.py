@@ -0,0 +1,299 @@
+"""
+    This script is the DataHub Validation History:
+    Keeps every validation log in one indexed SQLite database, so aggregate
+    questions over the history are answered without reading the csv logs, eg.
+    PK violations per partner over the last 90 days.
+
+    The history:
+        1. Ingests every ErrorLogging log when DATAHUB_HISTORY_DB is set
+        2. Syncs incrementally from the csv logs under datahub/datahub_validator/logs/,
+           only the log files which changed since the last sync are read
+        3. Answers counts grouped by partner, program, file, date, error code or type
+
+    Usage:
+        python -m datahub_degree_validator.history sync --db history.sqlite
+        python -m datahub_degree_validator.history query --db history.sqlite \\
+            --group-by partner --error-code 5 --days 90
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from datahub_degree_validator.datahub_degree_validator import (
+    BucketFileData,
+    get_storage_backend,
+)
+
+LOGS_PREFIX = "datahub/datahub_validator/logs/"
+
+# columns a query groups and filters by, the other columns are kept for reference
+GROUP_COLUMNS = (
+    "partner",
+    "program",
+    "file_name",
+    "date",
+    "error_code",
+    "error_type",
+    "verdict",
+)
+
+SCHEMA = """
+create table if not exists validations (
+    partner text not null,
+    program text not null,
+    file_name text not null,
+    file_path text not null,
+    date text not null,
+    date_time text not null,
+    error_code integer not null,
+    error_type text,
+    priority text,
+    verdict text,
+    verdict_confidence real,
+    file_no_of_rows integer,
+    description text,
+    unique (file_path, date_time, error_code, verdict)
+);
+create index if not exists validations_partner
+    on validations (partner, date, error_code);
+create index if not exists validations_program
+    on validations (program, date, error_code);
+create index if not exists validations_error_code
+    on validations (error_code, date);
+create table if not exists synced_logs (
+    log_file_path text primary key,
+    size integer not null,
+    synced_at text not null,
+    etag text
+);
+"""
+
+
+def get_value(log, col):
+    """This function returns a log value, None for missing values"""
+    value = log.get(col)
+    if value is None or value == "":
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
+class HistoryStore:
+    """This class stores the validation logs in a SQLite database
+
+    Attributes:
+        path (str): database file, ":memory:" for a database of the process only
+        connection (Connection): database connection, shared by the threads
+    """
+
+    def __init__(self, path="validation_history.sqlite"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        columns = [
+            row[1] for row in self.connection.execute("pragma table_info(synced_logs)")
+        ]
+        if "etag" not in columns:
+            # databases synced before the etags were kept
+            self.connection.execute("alter table synced_logs add column etag text")
+
+    def close(self):
+        self.connection.close()
+
+    def get_row(self, log):
+        """This method maps a log to a validations row
+
+        return:
+            row (tuple): validations values, None if the log is not a validation log
+        """
+        date_time = get_value(log, "date_time")
+        error_code = get_value(log, "error_code")
+        if date_time is None or error_code is None or get_value(log, "partner") is None:
+            return
+        date_time = str(date_time)
+        no_of_rows = get_value(log, "file_no_of_rows")
+        confidence = get_value(log, "verdict_confidence")
+        return (
+            str(log["partner"]),
+            str(get_value(log, "program") or ""),
+            str(get_value(log, "file_name") or ""),
+            str(get_value(log, "file_path") or ""),
+            date_time[:10].replace("-", ""),
+            date_time,
+            int(error_code),
+            get_value(log, "error_type"),
+            get_value(log, "priority"),
+            get_value(log, "verdict") or "final",
+            None if confidence is None else float(confidence),
+            None if no_of_rows is None else int(no_of_rows),
+            get_value(log, "description"),
+        )
+
+    def add_logs(self, logs):
+        """This method stores logs, logs already stored are skipped
+
+        Attributes:
+            logs (list): ErrorLogging logs or rows of the csv logs
+
+        return:
+            added (int): number of logs stored
+        """
+        rows = [row for row in map(self.get_row, logs) if row is not None]
+        with self.lock, self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                "insert or ignore into validations values "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            return self.connection.total_changes - before
+
+    def sync(self, storage=None, logs_bucket="coursera-data-engineering", prefix=None):
+        """This method ingests the csv logs which changed since the last sync
+
+        A log file is appended to by every validation of its partner and program
+        on a day, a log file whose size and etag did not change is not read again.
+        Sizes and etags come from the listing, no request is made per log file.
+
+        return:
+            summary (dict): log files listed, read and logs added
+        """
+        storage = storage if storage is not None else get_storage_backend()
+        bfd = BucketFileData(storage=storage)
+        synced = {
+            path: (size, etag)
+            for path, size, etag in self.connection.execute(
+                "select log_file_path, size, etag from synced_logs"
+            )
+        }
+        summary = {"listed": 0, "read": 0, "added": 0}
+        for key, size, etag in storage.list_keys(
+            logs_bucket, prefix or LOGS_PREFIX, details=True
+        ):
+            if not key.endswith(".csv"):
+                continue
+            summary["listed"] += 1
+            if synced.get(key) == (size, etag):
+                continue
+            file_logs_df = bfd.read_csv(logs_bucket, key)
+            summary["read"] += 1
+            if file_logs_df is not None:
+                summary["added"] += self.add_logs(file_logs_df.to_dict("records"))
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "insert or replace into synced_logs "
+                    "(log_file_path, size, synced_at, etag) values (?, ?, ?, ?)",
+                    (key, size, datetime.utcnow().isoformat(), etag),
+                )
+        return summary
+
+    def count(
+        self,
+        group_by=("partner",),
+        partner=None,
+        program=None,
+        error_code=None,
+        error_type=None,
+        verdict=None,
+        start_date=None,
+        end_date=None,
+        days=None,
+    ):
+        """This method counts the logs matching filters, grouped by columns
+
+        Attributes:
+            group_by (list): GROUP_COLUMNS to group by
+            start_date (str): first log date: yyyymmdd
+            end_date (str): last log date: yyyymmdd
+            days (int): logs of the last days, instead of a start_date
+        return:
+            counts (list): dict of the group values and count, largest first
+        """
+        group_by = list(group_by or [])
+        for col in group_by:
+            if col not in GROUP_COLUMNS:
+                raise ValueError("cannot group by " + col)
+        if days is not None:
+            start_date = (datetime.utcnow() - timedelta(days=days)).strftime("%Y%m%d")
+
+        filters, params = [], []
+        for col, value, operator in [
+            ("partner", partner, "="),
+            ("program", program, "="),
+            ("error_code", error_code, "="),
+            ("error_type", error_type, "="),
+            ("verdict", verdict, "="),
+            ("date", start_date, ">="),
+            ("date", end_date, "<="),
+        ]:
+            if value is not None:
+                filters.append(col + " " + operator + " ?")
+                params.append(value)
+
+        columns = ", ".join(group_by)
+        query = "select " + (columns + ", " if group_by else "") + "count(*) as count"
+        query += " from validations"
+        if filters:
+            query += " where " + " and ".join(filters)
+        if group_by:
+            query += " group by " + columns + " order by count desc, " + columns
+        with self.lock:
+            cursor = self.connection.execute(query, params)
+            names = [col[0] for col in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DataHub validation history")
+    parser.add_argument("command", choices=["sync", "query"])
+    parser.add_argument("--db", default="validation_history.sqlite")
+    parser.add_argument("--logs-bucket", default="coursera-data-engineering")
+    parser.add_argument("--prefix", default=LOGS_PREFIX, help="logs folder to sync")
+    parser.add_argument("--group-by", action="append", choices=GROUP_COLUMNS)
+    parser.add_argument("--partner")
+    parser.add_argument("--program")
+    parser.add_argument("--error-code", type=int)
+    parser.add_argument("--error-type")
+    parser.add_argument("--verdict", choices=["final", "provisional"])
+    parser.add_argument("--start", help="first log date: yyyymmdd")
+    parser.add_argument("--end", help="last log date: yyyymmdd")
+    parser.add_argument("--days", type=int, help="logs of the last days")
+    args = parser.parse_args(argv)
+
+    store = HistoryStore(args.db)
+    try:
+        if args.command == "sync":
+            result = store.sync(logs_bucket=args.logs_bucket, prefix=args.prefix)
+            print(json.dumps(result))
+            return result
+
+        result = store.count(
+            group_by=args.group_by or ["partner"],
+            partner=args.partner,
+            program=args.program,
+            error_code=args.error_code,
+            error_type=args.error_type,
+            verdict=args.verdict,
+            start_date=args.start,
+            end_date=args.end,
+            days=args.days,
+        )
+        for row in result:
+            print(json.dumps(row))
+        return result
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
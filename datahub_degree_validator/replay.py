@@ -0,0 +1,339 @@
+"""
+    This script is the DataHub Validation Replay:
+    Re-validates historical partner files under the current (or a given) settings
+    version, eg. to find out how many past drops a metadata.csv change would reject.
+
+    A replay:
+        1. Walks the partner/program folders for files dated within a range
+        2. Validates every file on a worker pool, without emails or bucket logs
+        3. Checkpoints every result so a killed run resumes where it stopped, results
+           of another settings version are validated again
+        4. Writes an aggregate pass/fail report
+
+    Usage:
+        python -m datahub_degree_validator.replay --start 20200101 --end 20201231 \\
+            --partner test --checkpoint replay.jsonl --report replay_report.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+
+from datahub_degree_validator.datahub_degree_validator import (
+    Settings,
+    StorageBackend,
+    ValidateFile,
+    get_storage_backend,
+)
+
+
+class SnapshotStorage(StorageBackend):
+    """This class caches the settings files read through a storage backend
+
+    Settings are re-read several times for every validated file, caching them
+    keeps a replay at file read speed and pins one settings version for the run.
+
+    Attributes:
+        storage (StorageBackend): backend to read through
+        bucket (str): bucket where the settings are located
+        prefix (str): settings folder to cache
+    """
+
+    def __init__(self, storage, bucket, prefix):
+        self.storage = storage
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def open(self, bucket, key):
+        if bucket != self.bucket or not key.startswith(self.prefix):
+            return self.storage.open(bucket, key)
+        with self.lock:
+            if key not in self.cache:
+                with self.storage.open(bucket, key) as body:
+                    self.cache[key] = body.read()
+        return BytesIO(self.cache[key])
+
+    def put_object(self, bucket, key, body):
+        return self.storage.put_object(bucket, key, body)
+
+    def delete_object(self, bucket, key):
+        return self.storage.delete_object(bucket, key)
+
+    def list_keys(self, bucket, prefix="", details=False):
+        return self.storage.list_keys(bucket, prefix, details)
+
+    def get_size(self, bucket, key):
+        return self.storage.get_size(bucket, key)
+
+    def get_range(self, bucket, key, start, length):
+        return self.storage.get_range(bucket, key, start, length)
+
+
+class ReplayEngine:
+    """This class replays the validation over historical partner files
+
+    Attributes:
+        settings_folder (str): settings version to validate with
+        partner_bucket (str): bucket where the partner folders and files are located
+        checkpoint_path (str): json lines file holding one result per validated file
+        max_workers (int): size of the validation worker pool
+        storage (SnapshotStorage): backend the files and settings are read from
+        settings_version (str): hash of the settings folder and files the results
+            of the checkpoint are keyed by
+    """
+
+    def __init__(
+        self,
+        settings_folder="datahub/datahub_validator/settings/",
+        partner_bucket="coursera-degrees-data",
+        checkpoint_path="replay_checkpoint.jsonl",
+        max_workers=8,
+        storage=None,
+    ):
+        storage = storage if storage is not None else get_storage_backend()
+        settings = Settings(storage, settings_folder)
+        self.settings_folder = settings_folder
+        self.partner_bucket = partner_bucket
+        self.checkpoint_path = checkpoint_path
+        self.max_workers = max_workers
+        self.storage = SnapshotStorage(
+            storage, settings.settings_bucket, settings_folder
+        )
+        self.settings_version = self.get_settings_version(settings)
+
+    def get_settings_version(self, settings):
+        """This method returns the version of the settings the files are validated with
+
+        return:
+            settings_version (str): hash of the settings folder, of the content of
+                the settings files and the partner artifact, a missing file is hashed
+                as empty, and of the environment flags which change the verdicts
+        """
+        version = hashlib.sha256(self.settings_folder.encode("utf8"))
+        flags = {
+            "check_references": settings.check_references,
+            "partner_artifact_file": settings.partner_artifact_file,
+            "sample_threshold_bytes": settings.sample_threshold_bytes,
+            "no_of_samples": settings.no_of_samples,
+            "sample_bytes": settings.sample_bytes,
+        }
+        version.update(json.dumps(flags, sort_keys=True).encode("utf8"))
+        file_names = [
+            settings.metadata_file,
+            settings.fieldnames_file,
+            settings.partner_schedule_file,
+        ]
+        if settings.partner_artifact_file:
+            file_names.append(settings.partner_artifact_file)
+        for file_name in file_names:
+            try:
+                with self.storage.open(settings.settings_bucket, file_name) as body:
+                    version.update(hashlib.sha256(body.read()).digest())
+            except Exception:
+                version.update(hashlib.sha256(b"").digest())
+        return version.hexdigest()[:16]
+
+    def get_settings(self):
+        """This method returns settings which never email or write bucket logs"""
+        settings = Settings(self.storage, self.settings_folder)
+        settings.write_logs = False
+        return settings
+
+    def get_program_prefixes(self, partners=None, programs=None):
+        """This method returns the partner/program folders to replay
+
+        Attributes:
+            partners (list): partners to replay, all scheduled partners if None
+            programs (list): programs to replay, all partner programs if None
+        return:
+            prefixes (list): partner/program/ folder prefixes
+        """
+        ps_data = self.get_settings().get_partner_schedule()
+        prefixes = []
+        for _, row in ps_data.iterrows():
+            if partners and row["partner"] not in partners:
+                continue
+            for program in str(row["programs"]).split(","):
+                program = program.strip()
+                if program and (not programs or program in programs):
+                    prefixes.append(row["partner"] + "/" + program + "/")
+        return prefixes
+
+    def list_files(self, start_date, end_date, partners=None, programs=None):
+        """This method lists the partner files dated within a date range
+
+        Attributes:
+            start_date (str): first file date stamp: yyyymmdd
+            end_date (str): last file date stamp: yyyymmdd
+        return:
+            keys (list): partner file keys
+        """
+        keys = []
+        for prefix in self.get_program_prefixes(partners, programs):
+            for key in self.storage.list_keys(self.partner_bucket, prefix):
+                match = re.search(r"_(\d{8})\.csv$", key.lower())
+                if match and start_date <= match.group(1) <= end_date:
+                    keys.append(key)
+        return keys
+
+    def validate_key(self, key):
+        """This method validates a single partner file
+
+        return:
+            result (dict): key, status (passed, failed, skipped or error) and error
+        """
+        result = OrderedDict([("key", key), ("status", "passed")])
+        try:
+            validate_file = ValidateFile(self.get_settings(), self.partner_bucket)
+            event = {
+                "detail": {
+                    "requestParameters": {"bucketName": self.partner_bucket, "key": key}
+                }
+            }
+            file_path_list = validate_file.validate_lambda_event(event)
+            if not file_path_list:
+                result["status"] = "skipped"
+                return result
+
+            log = validate_file.validate(file_path_list)
+            if log is None:
+                result["status"] = "error"
+            elif log != "Success":
+                result["status"] = "failed"
+                result["error_code"] = log[1]["error_code"]
+                result["error_type"] = log[1]["error_type"]
+                result["description"] = log[1]["description"]
+            return result
+        except Exception as e:
+            print("exception: class ReplayEngine: Method: validate_key: " + str(e))
+            result["status"] = "error"
+            result["description"] = str(e)
+            return result
+
+    def load_checkpoint(self):
+        """This method loads the results of a previous run
+
+        Results are keyed by settings version and file key, only the results of
+        the current settings version are resumed, so a report never mixes the
+        verdicts of two settings versions.
+
+        return:
+            results (dict): key => result of the current settings version
+        """
+        results = {}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as checkpoint:
+                for line in checkpoint:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        # a line cut short when the previous run was killed
+                        continue
+                    results[(result.get("settings_version"), result["key"])] = result
+        return {
+            key: result
+            for (settings_version, key), result in results.items()
+            if settings_version == self.settings_version
+        }
+
+    def run(self, start_date, end_date, partners=None, programs=None):
+        """This method replays the validation, resuming from the checkpoint
+
+        return:
+            report (OrderedDict): aggregate pass/fail report
+        """
+        keys = self.list_files(start_date, end_date, partners, programs)
+        results = self.load_checkpoint()
+        pending = [key for key in keys if key not in results]
+        print(f"replay: {len(keys)} files, {len(keys) - len(pending)} checkpointed")
+
+        with open(self.checkpoint_path, "a") as checkpoint, ThreadPoolExecutor(
+            max_workers=self.max_workers
+        ) as pool:
+            futures = [pool.submit(self.validate_key, key) for key in pending]
+            for future in as_completed(futures):
+                result = future.result()
+                result["settings_version"] = self.settings_version
+                checkpoint.write(json.dumps(result, default=str) + "\n")
+                checkpoint.flush()
+                results[result["key"]] = result
+
+        return self.build_report([results[key] for key in keys])
+
+    def build_report(self, results):
+        """This method aggregates replay results
+
+        return:
+            report (OrderedDict): totals, errors per type and per program
+        """
+        statuses = Counter(result["status"] for result in results)
+        by_program = OrderedDict()
+        for result in results:
+            program = "/".join(result["key"].split("/")[:2])
+            by_program.setdefault(program, Counter())[result["status"]] += 1
+
+        return OrderedDict(
+            [
+                ("settings_folder", self.settings_folder),
+                ("settings_version", self.settings_version),
+                ("total", len(results)),
+                ("passed", statuses["passed"]),
+                ("failed", statuses["failed"]),
+                ("skipped", statuses["skipped"]),
+                ("errors", statuses["error"]),
+                (
+                    "by_error_type",
+                    dict(
+                        Counter(
+                            result["error_type"]
+                            for result in results
+                            if result["status"] == "failed"
+                        )
+                    ),
+                ),
+                ("by_program", {k: dict(v) for k, v in by_program.items()}),
+                (
+                    "failed_files",
+                    [r["key"] for r in results if r["status"] == "failed"],
+                ),
+            ]
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay DataHub file validation")
+    parser.add_argument("--start", required=True, help="first file date: yyyymmdd")
+    parser.add_argument("--end", required=True, help="last file date: yyyymmdd")
+    parser.add_argument("--partner", action="append", help="partner(s) to replay")
+    parser.add_argument("--program", action="append", help="program(s) to replay")
+    parser.add_argument(
+        "--settings-folder", default="datahub/datahub_validator/settings/"
+    )
+    parser.add_argument("--partner-bucket", default="coursera-degrees-data")
+    parser.add_argument("--checkpoint", default="replay_checkpoint.jsonl")
+    parser.add_argument("--report", default="replay_report.json")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    engine = ReplayEngine(
+        settings_folder=args.settings_folder,
+        partner_bucket=args.partner_bucket,
+        checkpoint_path=args.checkpoint,
+        max_workers=args.workers,
+    )
+    report = engine.run(args.start, args.end, args.partner, args.program)
+    with open(args.report, "w") as report_file:
+        json.dump(report, report_file, indent=2, default=str)
+    print(json.dumps({k: v for k, v in report.items() if k != "failed_files"}))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@
     This Lambda function is triggered when a file lands in s3 bucket coursera-degrees-data (DataHub)
     via a CloudWatch trigger
     Once the event is parsed, it is looked up with an s3 file and the MEGA API is called to trigger a Job
+    In the validation-gated pipeline mode (DATAHUB_DISPATCH_JOBS=1 on datahub_degree_validator)
+    the validator triggers the Job of every file which passed, and this function's trigger is removed
     Full Documentation:
         https://docs.google.com/document/d/1cuI2KNlzr6mOwjjjrJ5txtNFfyOHgP_ET-QWl4F9tWY/edit#
     deployed to:
@@ -21,81 +23,96 @@
             5. zip the python file
             6. add the python.zip file to the lambda layer and select python 3.7 under compartible runtime.
             7. go to the datahub_job_runner and select layers and under select the layer you created.
+        - The MEGA client is shared with datahub_degree_validator: package the datahub_common
+          folder with the function, see datahub_common/__init__.py
 '''
 
+import asyncio
 import json
+import os
 import re
+import threading
+import time
 import boto3
-import csv
-import requests
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from datetime import datetime, timezone
+# the MEGA client shared with datahub_degree_validator, packaged with this function
+from datahub_common.mega import MEGA_POOL_SIZE, MegaJob, get_job_keys, is_execute_sent, log, send_email
 
 # from datadog import datadog_lambda_wrapper, lambda_metric
 
 s3 = boto3.client('s3')
 
+# triggers of a job whose events fall in the same window are dispatched once
+DEBOUNCE_SECONDS = int(os.environ.get('DEBOUNCE_SECONDS', '300'))
+# idempotency records of the dispatched jobs: one per job and debounce window, kept in
+# a DynamoDB table whose partition key is the string dispatch_id
+DISPATCH_TABLE = os.environ.get('DISPATCH_TABLE', 'datahub_job_runner_dispatches')
+# DynamoDB client of this Lambda container, created on first use
+_dynamodb_client = None
+_dynamodb_lock = threading.Lock()
+PARTNER_BUCKET = 'coursera-degrees-data'
+# blocking s3 and MEGA calls a batch runs at once, at most the MEGA keep-alive pool
+DISPATCH_CONCURRENCY = int(os.environ.get('DISPATCH_CONCURRENCY', str(MEGA_POOL_SIZE)))
 
-class MegaJob:
-    def __init__(self, jobId, user='datahub@coursera.org'):
-        self.base_url = 'http://envoy-gateway.prod.dkandu.me:30003'
-        MEGA_JOB_LATEST_TEMPLATE = self.base_url + \
-            '/api/megaJobManager.v1?action=getLatest&id={job_id}'
-        self.http_headers = {
-            'X-Coursera-Source': 'Internal',
-            'X-Coursera-Destination-Service': 'mega'
-        }
-        self.jobId = jobId
-        self.user = user
-        self.latest_id = requests.post(MEGA_JOB_LATEST_TEMPLATE.format(job_id=self.jobId),
-                                       headers=self.http_headers,
-                                       json={}).json()['id']
-        # print(self.latest_id)
-
-    def execute_mega_job(self):
-        MEGA_JOB_EXECUTE_TEMPLATE = self.base_url + \
-            '/api/megaJobManager.v1?action=execute&id={versioned_job_id}&requesterEmailOverride={user}'
-
-        requests.post(MEGA_JOB_EXECUTE_TEMPLATE.format(
-            versioned_job_id=self.latest_id, user=self.user),
-            headers=self.http_headers, json={}
-        )
-
-
-def number_of_records_in_s3_file(bucket, key):
-    i = 0
-    try:
-        for _ in s3.get_object(Bucket=bucket, Key=key)['Body'].read().splitlines(True):
-            if i == 2:
-                return i
-            i += 1
-        return i
-    except BaseException:
-        # This is important in case a file cannot be read e.g. when its held up by other resources
-        return 2
+# first ranged read when counting the records of a file, in bytes
+RECORD_PROBE_BYTES = 4096
 
 
-def log(metric_name, metric_type='count', metric_value=1, tags=[]):
+def number_of_records_in_s3_file(bucket, key, probe_bytes=RECORD_PROBE_BYTES):
     '''
-    DataDog log format for future integration:
-    https://docs.datadoghq.com/integrations/amazon_lambda/
-    MONITORING|unix_epoch_timestamp|metric_value|metric_type|my.metric.name|#tag1:value,tag2
-    print("MONITORING|{}|{}|{}|{}|#{}".format(
-        int(time.time()), metric_value, metric_type, 'hasher.lambda.' + metric_name, ','.join(tags)
-    ))
+    Returns the number of records of a csv file, counting at most 2 (header plus a data row)
+    Only the start of the file is read: ranged reads of probe_bytes, doubled on every
+    read, until the second record ends or the file does. A quoted field may hold new
+    lines, eg. a multi-line header, and blank lines are not records.
+    Errors are raised, an unreadable file must not dispatch a job.
     '''
-    # Print JSON for Insights to parse and query
-    log_dict = {}
-    log_dict['metric'] = metric_name
-    for tag in tags:
-        k = tag.split(':')[0]
-        v = tag.split(':')[1]
-        log_dict[k] = v
-    print(json.dumps(log_dict))
+    records = 0
+    in_quotes = False
+    pending = False
+    start = 0
+    size = None
+    while size is None or start < size:
+        try:
+            res = s3.get_object(Bucket=bucket, Key=key,
+                                Range='bytes={}-{}'.format(start, start + probe_bytes - 1))
+        except ClientError as e:
+            # an empty file has no range to read
+            if e.response['Error']['Code'] == 'InvalidRange':
+                break
+            raise
+        size = int(res['ContentRange'].split('/')[-1]) if 'ContentRange' in res else res['ContentLength']
+        chunk = res['Body'].read()
+        if not chunk:
+            break
+        for byte in chunk:
+            if byte == 0x22:  # "
+                in_quotes = not in_quotes
+                pending = True
+            elif byte == 0x0A and not in_quotes:  # \n
+                if pending:
+                    records += 1
+                    if records == 2:
+                        return records
+                pending = False
+            elif byte not in (0x0D, 0x20, 0x09) or in_quotes:  # \r, space, tab
+                pending = True
+        start += len(chunk)
+        probe_bytes *= 2
+    # the last record may not end with a new line
+    return records + 1 if pending else records
+
 
 # @datadog_lambda_wrapper
 
 
 def lambda_handler(event, context):
+    if is_batch_event(event):
+        return batch_handler(event, context)
+
     filename = '(none)'
     partner = '(none)'
     jobId = ""
@@ -109,14 +126,7 @@ def lambda_handler(event, context):
         log(metric_name='event_failure')
 
     try:
-        # export of s3 jobs to s3: https://tools.coursera.org/mega/s3Export/SUy04I2YEemSJm-AiuSdSA~S3_EXPORT_JOB
-        # query to get s3 jobs: https://tools.coursera.org/mega/latestquery/0ZjJII2XEemSJm-AiuSdSA
-        res = s3.get_object(Bucket='oaljadda', Key='jobs/s3_import_jobs.csv')
-        lines = res['Body'].read().decode('utf-8').splitlines(True)
-        reader = csv.DictReader(lines)
-        keys = {}
-        for line in reader:
-            keys[line['s3_key']] = [line['mega_job_id'], line['script_url']]
+        keys = get_job_keys()
         # key from the event has the date, eg 20190613, need to use placeholder
         event_key_template = re.sub(r'\d{8}', '{DATE_PLACEHOLDER}', event_key)
 
@@ -145,45 +155,275 @@ def lambda_handler(event, context):
         send_email(metric_name, tags, jobUrl)
     return None
 
-# Send Alert Email
 
+def is_batch_event(event):
+    '''
+    Tells if an event is a batch: an SQS batch or a list of EventBridge events
+    '''
+    return isinstance(event, list) or (isinstance(event, dict) and 'Records' in event)
+
+
+def get_batch_triggers(event):
+    '''
+    Returns the (message id, s3 key, event time) of every event of a batch
+    An SQS record body holds an EventBridge event, a message id is None outside SQS
+    '''
+    if isinstance(event, list):
+        messages = [(None, x) for x in event]
+    else:
+        messages = [(record.get('messageId'), json.loads(record['body']))
+                    for record in event['Records']]
+
+    triggers = []
+    for message_id, message in messages:
+        try:
+            key = message['detail']['requestParameters']['key']
+        except (KeyError, TypeError):
+            # the key cannot be parsed from the event object
+            log(metric_name='event_failure')
+            continue
+        try:
+            event_time = datetime.strptime(message['time'][:19], '%Y-%m-%dT%H:%M:%S')
+            event_time = event_time.replace(tzinfo=timezone.utc)
+        except (KeyError, ValueError):
+            event_time = datetime.now(timezone.utc)
+        triggers.append((message_id, key, event_time))
+    return triggers
 
-def send_email(metric_name, tags, jobId):
+
+def batch_handler(event, context=None, store=None):
+    '''
+    Handles a batch of file events, dispatching every distinct job once
+    The triggers of a job are coalesced per debounce window, an idempotency record
+    per job and window makes retried events never execute the job again
+    Returns the SQS partial batch response: the messages of the jobs which failed
     '''
-    This method sends an email
+    received_at = time.time()
+    store = store or DispatchStore()
+    keys = get_job_keys()
+
+    jobs = OrderedDict()
+    for message_id, event_key, event_time in get_batch_triggers(event):
+        filename = event_key.split('/')[-1]
+        partner = event_key.split('/')[0]
+        event_key_template = re.sub(r'\d{8}', '{DATE_PLACEHOLDER}', event_key)
+        if event_key_template not in keys:
+            continue
+        jobId, jobUrl = keys[event_key_template]
+        window = int(event_time.timestamp()) // DEBOUNCE_SECONDS * DEBOUNCE_SECONDS
+        job = jobs.setdefault((jobId, window), {
+            'url': jobUrl, 'files': [], 'messages': [], 'event_time': event_time})
+        job['files'].append((event_key, filename, partner))
+        job['messages'].append(message_id)
+        job['event_time'] = min(job['event_time'], event_time)
+
+    failed_messages = DispatchPipeline(store).run(jobs, received_at)
+    return {'batchItemFailures': [{'itemIdentifier': x} for x in OrderedDict.fromkeys(failed_messages)]}
 
+
+class DispatchPipeline:
     '''
-    fromEmail = "datahub@coursera.org"
-    replyTo = "datahub@coursera.org"
-
-    subject = metric_name
-    client = boto3.client('ses')
-    toEmail = ["data-engineering-team@coursera.org",
-               "sam@coursera.org", "mfitzmaurice@coursera.org"]
-    message = "\n\n" + metric_name + ": For " + \
-        tags[1] + " " + tags[0] + " " + jobId
-    response = client.send_email(
-        Source=fromEmail,
-        Destination={
-            'ToAddresses': toEmail,
-        },
-        Message={
-            'Subject': {
-                'Data': subject,
-                'Charset': 'utf8'
-            },
-            'Body': {
-                'Text': {
-                    'Data': message,
-                    'Charset': 'utf8'
-                }
-            }
-        },
-        ReplyToAddresses=[
-            replyTo
-        ]
-    )
-    # Print Message in Cloud watch.
-    print(response)
-    print(message)
-    return None
+    Dispatches the jobs of a batch concurrently on an asyncio event loop
+    The blocking calls (record count probes, idempotency records, getLatest and
+    execute) run on a thread pool, at most DISPATCH_CONCURRENCY at once. The windows
+    of a job are dispatched one after the other, in window order.
+    '''
+
+    def __init__(self, store, concurrency=None):
+        self.store = store
+        self.concurrency = concurrency or DISPATCH_CONCURRENCY
+
+    def run(self, jobs, received_at=None):
+        '''
+        Dispatches jobs: (jobId, window) => url, files, messages and event_time
+        Returns the message ids of the jobs which failed
+        '''
+        if not jobs:
+            return []
+        self.received_at = received_at or time.time()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            self.executor = executor
+            return asyncio.run(self.dispatch_all(jobs))
+
+    async def dispatch_all(self, jobs):
+        # created on the loop of this run
+        self.limit = asyncio.Semaphore(self.concurrency)
+        job_locks = {jobId: asyncio.Lock() for jobId, _ in jobs}
+        # tasks take a job lock in the order they are created
+        results = await asyncio.gather(*[
+            self.dispatch(jobId, window, job, job_locks[jobId])
+            for (jobId, window), job in sorted(jobs.items(), key=lambda x: x[0][1])])
+        return [x for messages in results for x in messages]
+
+    async def call(self, func, *args):
+        '''
+        Runs a blocking call on the thread pool, within the concurrency limit
+        '''
+        async with self.limit:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def dispatch(self, jobId, window, job, job_lock):
+        '''
+        Returns the message ids of a job if it failed, else an empty list
+        '''
+        async with job_lock:
+            try:
+                if await self.dispatch_job(jobId, window, job['url'], job['files']):
+                    now = time.time()
+                    log(metric_name='dispatch_latency', tags=[
+                        'job:{}'.format(jobId), 'files:{}'.format(len(job['files'])),
+                        'latency_ms:{:.1f}'.format((now - self.received_at) * 1000),
+                        'event_age_ms:{:.1f}'.format((now - job['event_time'].timestamp()) * 1000)])
+                return []
+            except BaseException as e:
+                logging.exception(e)
+                metric_name = 'Datahub Runner Job Failure'
+                tags = ['file:{}'.format(job['files'][0][1]), 'partner:{}'.format(job['files'][0][2])]
+                log(metric_name=metric_name, tags=tags)
+                await self.call(send_email, metric_name, tags, job['url'])
+                return [x for x in job['messages'] if x is not None]
+
+    async def dispatch_job(self, jobId, window, jobUrl, files):
+        '''
+        Executes a job once for the files of a debounce window
+        Files already covered by the idempotency record of the window (retries) are
+        skipped, the job runs again only for files which landed after it was dispatched
+        Returns True if the job was executed
+        '''
+        record, version = await self.call(self.store.load, jobId, window)
+        covered = set(record['keys']) if record else set()
+        files = [x for x in files if x[0] not in covered]
+        if not files:
+            log(metric_name='coalesced_trigger', tags=['job:{}'.format(jobId)])
+            return False
+
+        # Need at least 2 rows of data to proceed(header, plus data)
+        records = await asyncio.gather(*[
+            self.call(number_of_records_in_s3_file, PARTNER_BUCKET, x[0]) for x in files])
+        ready = []
+        for (event_key, filename, partner), no_of_records in zip(files, records):
+            if no_of_records < 2:
+                log(metric_name='not_enough_records', tags=[
+                    'file:{}'.format(filename), 'partner:{}'.format(partner)])
+            else:
+                ready.append((event_key, filename, partner))
+        if not ready:
+            return False
+
+        # claim the window before executing, a concurrent batch loses the claim
+        new_record = {
+            'job_id': jobId,
+            'window': window,
+            'keys': sorted(covered | set(x[0] for x in ready)),
+            'dispatched_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }
+        new_version = await self.call(self.store.save, jobId, window, new_record, version)
+        if new_version is None:
+            log(metric_name='coalesced_trigger', tags=['job:{}'.format(jobId)])
+            return False
+
+        try:
+            mega_job = await self.call(MegaJob, jobId)
+        except BaseException:
+            await self.release(jobId, window, record, new_version)
+            raise
+        try:
+            await self.call(mega_job.execute_mega_job)
+        except BaseException as e:
+            if not is_execute_sent(e):
+                await self.release(jobId, window, record, new_version)
+                raise
+            # the job may have run: a retry must not execute it again, the claim is
+            # kept and marked for a check of the job in MEGA
+            new_record['status'] = 'unknown'
+            await self.call(self.store.save, jobId, window, new_record, new_version)
+            log(metric_name='dispatch_unknown', tags=[
+                'job:{}'.format(jobId), 'window:{}'.format(window)])
+            raise
+
+        print('running job: {}'.format(jobUrl))
+        for _, filename, partner in ready:
+            log(metric_name='run_mega_job', tags=['file:{}'.format(
+                filename), 'partner:{}'.format(partner), 'job:{}'.format(jobId)])
+        if len(ready) > 1:
+            log(metric_name='coalesced_trigger', tags=[
+                'job:{}'.format(jobId), 'files:{}'.format(len(ready))])
+        return True
+
+    async def release(self, jobId, window, record, version):
+        '''
+        Releases the claim of a window when the job was not executed, so that a
+        retry executes it
+        '''
+        if record:
+            await self.call(self.store.save, jobId, window, record, version)
+        else:
+            await self.call(self.store.delete, jobId, window, version)
+
+
+def get_dynamodb_client():
+    '''
+    Returns the DynamoDB client shared by the batches of this Lambda container
+    '''
+    global _dynamodb_client
+    with _dynamodb_lock:
+        if _dynamodb_client is None:
+            _dynamodb_client = boto3.client('dynamodb')
+        return _dynamodb_client
+
+
+class DispatchStore:
+    '''
+    Keeps the idempotency records of the dispatched jobs in DynamoDB
+    A record is an item holding its json and a version number, writes are conditional
+    on the version, so two batches never both claim a window
+    '''
+
+    def __init__(self, client=None, table=DISPATCH_TABLE):
+        self.client = client if client is not None else get_dynamodb_client()
+        self.table = table
+
+    def get_key(self, jobId, window):
+        return {'dispatch_id': {'S': '{}/{}'.format(jobId, window)}}
+
+    def load(self, jobId, window):
+        '''
+        Returns the (record, version) of a job and window, (None, None) if missing
+        '''
+        res = self.client.get_item(TableName=self.table, Key=self.get_key(jobId, window), ConsistentRead=True)
+        if 'Item' not in res:
+            return None, None
+        return json.loads(res['Item']['record']['S']), int(res['Item']['version']['N'])
+
+    def save(self, jobId, window, record, version):
+        '''
+        Writes a record if nobody changed it since it was loaded
+        Returns the version of the new record, None if it was changed concurrently
+        '''
+        item = dict(self.get_key(jobId, window), record={'S': json.dumps(record)},
+                    version={'N': str((version or 0) + 1)})
+        try:
+            self.client.put_item(TableName=self.table, Item=item, **self.get_condition(version))
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return None
+            raise
+        return (version or 0) + 1
+
+    def delete(self, jobId, window, version):
+        '''
+        Deletes a record if nobody changed it since it was written
+        '''
+        try:
+            self.client.delete_item(TableName=self.table, Key=self.get_key(jobId, window),
+                                    **self.get_condition(version))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    def get_condition(self, version):
+        if version is None:
+            return {'ConditionExpression': 'attribute_not_exists(dispatch_id)'}
+        return {'ConditionExpression': 'version = :version',
+                'ExpressionAttributeValues': {':version': {'N': str(version)}}}
+
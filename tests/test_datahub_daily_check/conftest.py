@@ -0,0 +1,67 @@
+import os
+
+import boto3
+import pytest
+from moto import mock_s3
+
+try:
+    from moto import mock_dynamodb
+except ImportError:  # moto < 3
+    from moto import mock_dynamodb2 as mock_dynamodb
+
+ScheduleFile = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "..",
+    "datahub_daily_check",
+    "partner_schedule.csv",
+)
+
+
+@pytest.fixture()
+def schedule_file():
+    return ScheduleFile
+
+
+@pytest.fixture()
+def s3_bucket():
+    with mock_s3():
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="coursera-degrees-data")
+        yield s3.Bucket(name="coursera-degrees-data")
+
+
+@pytest.fixture()
+def dynamodb_client():
+    with mock_dynamodb():
+        client = boto3.client("dynamodb", region_name="us-east-1")
+        client.create_table(
+            TableName="datahub_daily_check_state",
+            KeySchema=[{"AttributeName": "state_key", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "state_key", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield client
+
+
+@pytest.fixture()
+def outbox(monkeypatch):
+    from datahub_daily_check import datahub_daily_check
+
+    outbox = {"": [], "digest": []}
+    monkeypatch.setattr(
+        datahub_daily_check,
+        "send_email",
+        lambda toEmails, log, email_type="": outbox[email_type].append((toEmails, log)),
+    )
+    return outbox
+
+
+@pytest.fixture()
+def sent_emails(outbox):
+    return outbox[""]
+
+
+@pytest.fixture()
+def sent_digests(outbox):
+    return outbox["digest"]
@@ -0,0 +1,623 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from botocore.exceptions import ClientError
+
+from datahub_daily_check import datahub_daily_check
+
+from datahub_daily_check.datahub_daily_check import (
+    INDEX_OBJECT,
+    ArrivalIndex,
+    ScheduleRow,
+    DynamoArrivalStore,
+    LocalArrivalStore,
+    ScheduleEngine,
+    Watermark,
+    build_partner_index,
+    check_all_bucket_folders,
+    check_date_range,
+    deliver_emails,
+    get_date_offsets,
+    get_digest,
+    get_ignore_rules,
+    get_partner_files,
+    get_partner_index,
+    get_partner_shedule,
+    get_received_files,
+    get_schedule_manifest,
+    load_partner_artifact,
+    load_partner_schedule,
+    run_due_checks,
+    send_email_with_retry,
+)
+
+
+class TestGetPartnerFiles:
+    def test_get_partner_files_WHEN_schedule_THEN_expected_manifest(
+        self, schedule_file
+    ):
+        partner_schedule = get_partner_shedule(schedule_file)
+        partner_files, time_schedule = get_partner_files(
+            partner_schedule, "20200902.csv"
+        )
+        files = set(partner_files["files"])
+
+        assert len(partner_files) == 117
+        assert list(time_schedule["run_hour"].unique()) == ["23:59"]
+        assert len(time_schedule) == len(partner_schedule)
+        assert "umich/mph-umich/applications/applications_20200902.csv" not in files
+        assert "penn/mcit/enrollments/degree_terms_20200902.csv" in files
+        assert "penn/mcit/enrollments/terms_20200902.csv" not in files
+        assert "macquarie/mq-global-mba/applications/applications_20200901.csv" in files
+        assert set(partner_files[partner_files["partner"] == "asu"]["files"]) == {
+            "asu/mcs/applications/applications_20200902.csv",
+            "asu/mcs/enrollments/degree_program_memberships_20200902.csv",
+        } | {
+            f"asu/big-data-asu/{file}_20200902.csv"
+            for file in [
+                "applications/applications",
+                "enrollments/terms",
+                "enrollments/students",
+                "enrollments/degree_terms_courses",
+                "enrollments/degree_term_memberships",
+                "enrollments/degree_program_memberships",
+                "enrollments/degree_courses",
+                "enrollments/degree_course_memberships",
+            ]
+        }
+
+    def test_get_ignore_rules_WHEN_ignore_files_THEN_program_rules(self):
+        assert get_ignore_rules("asu", "mcs:students,terms|") == {
+            "asu/mcs": ["students", "terms"],
+            "asu/": [""],
+        }
+
+    def test_get_ignore_rules_WHEN_nan_THEN_no_program_rules(self):
+        assert "asu/mcs" not in get_ignore_rules("asu", "nan")
+
+    def test_get_partner_index_WHEN_schedule_THEN_files_hours_and_contacts(
+        self, schedule_file
+    ):
+        partner_schedule = get_partner_shedule(schedule_file)
+        partner_files, time_schedule = get_partner_files(
+            partner_schedule, "20200902.csv"
+        )
+        partner_index = get_partner_index(
+            partner_files, time_schedule, partner_schedule
+        )
+
+        assert set(partner_index) == set(partner_files["partner"])
+        assert sum(len(p["files"]) for p in partner_index.values()) == 117
+        asu = partner_index["asu"]
+        assert asu["run_hours"] == {"23:59"}
+        assert asu["files"] == set(
+            partner_files[partner_files["partner"] == "asu"]["files"]
+        )
+        first_row = partner_schedule[partner_schedule["partner"] == "asu"].iloc[0]
+        assert asu["internal_emails"] == first_row["internal_emails"]
+        assert asu["partner_emails"] == first_row["partner_emails"]
+
+    def test_get_partner_files_WHEN_first_of_month_THEN_offset_previous_month(
+        self, schedule_file
+    ):
+        partner_schedule = get_partner_shedule(schedule_file)
+        partner_files, _ = get_partner_files(partner_schedule, "20200901.csv")
+        files = set(partner_files["files"])
+
+        assert "macquarie/mq-global-mba/applications/applications_20200831.csv" in files
+        assert "macquarie/mq-global-mba/enrollments/students_20200901.csv" in files
+
+    def test_get_date_offsets_WHEN_rules_THEN_program_file_days(self):
+        assert get_date_offsets(
+            "macquarie", "mq-global-mba:applications:-1|mq-global-mba:terms:x"
+        ) == {"macquarie/mq-global-mba": {"applications": -1}}
+        assert get_date_offsets("macquarie", "nan") == {}
+
+
+class TestLoadPartnerSchedule:
+    def test_load_partner_schedule_WHEN_schedule_THEN_same_rows_as_dataframe(
+        self, schedule_file
+    ):
+        schedule_rows = load_partner_schedule(schedule_file)
+        partner_schedule = get_partner_shedule(schedule_file)
+
+        assert all(isinstance(row, ScheduleRow) for row in schedule_rows)
+        assert [
+            [getattr(row, col) for col in partner_schedule.columns]
+            for row in schedule_rows
+        ] == partner_schedule.values.tolist()
+
+    def test_load_partner_schedule_WHEN_missing_values_THEN_nan(self, tmp_path):
+        schedule_file = tmp_path / "partner_schedule.csv"
+        schedule_file.write_text(
+            "partner,programs,partner_emails,internal_emails,run_hour,ignore_files,swap_files\n"
+            "hse,a, ,NA,23:59,,\n"
+            ",,,,,,\n"
+        )
+
+        assert load_partner_schedule(str(schedule_file)) == [
+            ScheduleRow("hse", "a", "", "nan", "23:59", "nan", "nan", "nan")
+        ]
+
+    def test_load_partner_artifact_WHEN_built_from_schedule_THEN_same_rows(
+        self, schedule_file, tmp_path
+    ):
+        from datahub_common.partner_artifact import build_artifact
+
+        artifact_file = tmp_path / "partner_artifact.json"
+        artifact_file.write_text(json.dumps(build_artifact(schedule_file)))
+
+        assert load_partner_artifact(str(artifact_file)) == load_partner_schedule(
+            schedule_file
+        )
+
+    def test_get_schedule_manifest_WHEN_schedule_THEN_same_index_as_dataframes(
+        self, schedule_file
+    ):
+        schedule_rows = load_partner_schedule(schedule_file)
+        partner_schedule = get_partner_shedule(schedule_file)
+
+        for date_placeholder in ["20200901.csv", "20200902.csv", "20210101.csv"]:
+            expected_files, run_hours = get_schedule_manifest(
+                schedule_rows, date_placeholder
+            )
+            partner_files, time_schedule = get_partner_files(
+                partner_schedule, date_placeholder
+            )
+
+            assert [(x.partner, x.file) for x in expected_files] == list(
+                partner_files.itertuples(index=False, name=None)
+            )
+            assert build_partner_index(
+                expected_files, run_hours, schedule_rows
+            ) == get_partner_index(partner_files, time_schedule, partner_schedule)
+
+
+class TestCheckAllBucketFolders:
+    def test_get_received_files_WHEN_some_files_sent_THEN_only_sent_files(
+        self, s3_bucket
+    ):
+        s3_bucket.put_object(Key="hse/a/enrollments/terms_20200902.csv", Body=b"x")
+        s3_bucket.put_object(Key="hse/a/enrollments/terms_20200901.csv", Body=b"x")
+
+        assert get_received_files(
+            s3_bucket,
+            [
+                "hse/a/enrollments/terms_20200902.csv",
+                "hse/a/enrollments/students_20200902.csv",
+            ],
+        ) == {"hse/a/enrollments/terms_20200902.csv"}
+
+    def test_check_all_bucket_folders_WHEN_files_missing_THEN_email_per_partner(
+        self, schedule_file, s3_bucket, sent_emails
+    ):
+        partner_schedule = get_partner_shedule(schedule_file)
+        partner_files, time_schedule = get_partner_files(
+            partner_schedule, "20200902.csv"
+        )
+        for key in partner_files[partner_files["partner"] != "hse"]["files"]:
+            s3_bucket.put_object(Key=key, Body=b"x")
+        s3_bucket.put_object(
+            Key="hse/master-of-data-science-hse/enrollments/terms_20200902.csv",
+            Body=b"x",
+        )
+
+        check_all_bucket_folders(
+            partner_files, "23:59", time_schedule, partner_schedule, s3_bucket
+        )
+
+        assert len(sent_emails) == 1
+        to_emails, log = sent_emails[0]
+        assert log[0] == "Files not received for hse"
+        assert log[2].count("\n\t\t") == 7
+        assert "terms_20200902" not in log[2]
+
+    def test_check_all_bucket_folders_WHEN_not_run_hour_THEN_no_email(
+        self, schedule_file, s3_bucket, sent_emails
+    ):
+        partner_schedule = get_partner_shedule(schedule_file)
+        partner_files, time_schedule = get_partner_files(
+            partner_schedule, "20200902.csv"
+        )
+
+        check_all_bucket_folders(
+            partner_files, "12:00", time_schedule, partner_schedule, s3_bucket
+        )
+
+        assert sent_emails == []
+
+    def test_check_date_range_WHEN_files_missing_THEN_report_per_day(
+        self, schedule_file, s3_bucket
+    ):
+        partner_schedule = get_partner_shedule(schedule_file)
+        for day in ["20200901", "20200902"]:
+            partner_files, _ = get_partner_files(partner_schedule, day + ".csv")
+            for key in partner_files[partner_files["partner"] != "hse"]["files"]:
+                s3_bucket.put_object(Key=key, Body=b"x")
+        s3_bucket.put_object(
+            Key="hse/master-of-data-science-hse/enrollments/terms_20200902.csv",
+            Body=b"x",
+        )
+
+        report = check_date_range(
+            load_partner_schedule(schedule_file), "20200901", "20200902", s3_bucket
+        )
+
+        assert report["expected"] == 2 * 117
+        assert report["missing"] == 8 + 7
+        assert list(report["partners"]) == ["hse"]
+        assert len(report["partners"]["hse"]["20200901"]) == 8
+        assert len(report["partners"]["hse"]["20200902"]) == 7
+
+    def test_check_date_range_WHEN_partners_THEN_only_partners(
+        self, schedule_file, s3_bucket
+    ):
+        report = check_date_range(
+            load_partner_schedule(schedule_file),
+            "20200902",
+            "20200902",
+            s3_bucket,
+            partners=["hse"],
+        )
+
+        assert report["expected"] == report["missing"] == 8
+        assert list(report["partners"]) == ["hse"]
+
+
+class TestArrivalIndex:
+    key = "hse/master-of-data-science-hse/enrollments/terms_20200902.csv"
+
+    def test_lookup_WHEN_recorded_THEN_received(self, tmp_path):
+        arrival_index = ArrivalIndex(LocalArrivalStore(str(tmp_path)))
+        assert arrival_index.record(self.key, datetime(2020, 9, 2, 10))
+
+        received, unresolved = arrival_index.lookup(
+            [self.key, self.key.replace("terms", "students")], datetime.utcnow()
+        )
+        assert received == {self.key}
+        assert unresolved == set()
+
+    def test_lookup_WHEN_no_day_object_THEN_unresolved(self, tmp_path):
+        arrival_index = ArrivalIndex(LocalArrivalStore(str(tmp_path)))
+        assert arrival_index.lookup([self.key], datetime.utcnow()) == (
+            set(),
+            {self.key},
+        )
+
+    def test_lookup_WHEN_day_object_stale_THEN_misses_unresolved(self, tmp_path):
+        arrival_index = ArrivalIndex(LocalArrivalStore(str(tmp_path)))
+        arrival_index.record(self.key, datetime(2020, 9, 2, 10))
+        missing = self.key.replace("terms", "students")
+
+        received, unresolved = arrival_index.lookup(
+            [self.key, missing], datetime.utcnow() + timedelta(hours=3)
+        )
+        assert received == {self.key}
+        assert unresolved == {missing}
+
+    def test_record_WHEN_key_not_date_stamped_THEN_False(self, tmp_path):
+        arrival_index = ArrivalIndex(LocalArrivalStore(str(tmp_path)))
+        assert not arrival_index.record("hse/readme.txt", datetime(2020, 9, 2))
+
+    def test_check_all_bucket_folders_WHEN_arrival_index_THEN_bucket_not_checked(
+        self, tmp_path, schedule_file, s3_bucket, sent_emails
+    ):
+        arrival_index = ArrivalIndex(LocalArrivalStore(str(tmp_path)))
+        partner_schedule = get_partner_shedule(schedule_file)
+        partner_files, time_schedule = get_partner_files(
+            partner_schedule, "20200902.csv"
+        )
+        for key in partner_files[partner_files["partner"] != "hse"]["files"]:
+            arrival_index.record(key, datetime(2020, 9, 2, 10))
+        # in the bucket but not in the fresh index: not looked up
+        s3_bucket.put_object(Key=self.key, Body=b"x")
+
+        check_all_bucket_folders(
+            partner_files,
+            "23:59",
+            time_schedule,
+            partner_schedule,
+            s3_bucket,
+            arrival_index=arrival_index,
+            check_time=datetime.utcnow(),
+        )
+
+        assert [log[0] for _, log in sent_emails] == ["Files not received for hse"]
+        assert sent_emails[0][1][2].count("\n\t\t") == 8
+
+    def test_lookup_WHEN_partner_quiet_THEN_misses_not_unresolved(self, tmp_path):
+        arrival_index = ArrivalIndex(LocalArrivalStore(str(tmp_path)))
+        arrival_index.record(self.key, datetime(2020, 9, 2, 10))
+        # another partner refreshes the index long after the last hse arrival
+        arrival_index.record(
+            "upenn/mcit/enrollments/terms_20200903.csv", datetime.utcnow()
+        )
+        missing = self.key.replace("terms", "students")
+
+        received, unresolved = arrival_index.lookup(
+            [self.key, missing, missing.replace("20200902", "20200904")],
+            datetime.utcnow(),
+        )
+        assert received == {self.key}
+        assert unresolved == set()
+
+    def test_check_all_bucket_folders_WHEN_stale_index_THEN_received_reconciled(
+        self, tmp_path, schedule_file, s3_bucket, sent_emails
+    ):
+        arrival_index = ArrivalIndex(LocalArrivalStore(str(tmp_path)))
+        partner_schedule = get_partner_shedule(schedule_file)
+        partner_files, time_schedule = get_partner_files(
+            partner_schedule, "20200902.csv"
+        )
+        s3_bucket.put_object(Key=self.key, Body=b"x")
+
+        check_all_bucket_folders(
+            partner_files,
+            "23:59",
+            time_schedule,
+            partner_schedule,
+            s3_bucket,
+            arrival_index=arrival_index,
+            check_time=datetime.utcnow(),
+        )
+
+        assert list(arrival_index.get_day("20200902")["arrivals"]) == [self.key]
+
+    def test_record_WHEN_dynamo_store_THEN_day_object(self, dynamodb_client):
+        arrival_index = ArrivalIndex(DynamoArrivalStore(dynamodb_client))
+
+        assert arrival_index.record(self.key, datetime(2020, 9, 2, 10))
+        assert arrival_index.record(
+            self.key.replace("terms", "students"), datetime(2020, 9, 2, 11)
+        )
+        assert len(arrival_index.get_day("20200902")["arrivals"]) == 2
+        assert not arrival_index.is_stale(datetime.utcnow())
+
+    def test_record_WHEN_burst_of_arrivals_THEN_none_dropped(self, dynamodb_client):
+        arrival_index = ArrivalIndex(DynamoArrivalStore(dynamodb_client))
+        keys = [self.key.replace("terms", "terms%d" % i) for i in range(20)]
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            assert all(
+                pool.map(
+                    lambda key: arrival_index.record(key, datetime(2020, 9, 2, 10)),
+                    keys,
+                )
+            )
+
+        assert sorted(arrival_index.get_day("20200902")["arrivals"]) == sorted(keys)
+        # a later arrival of a key keeps its first arrival time
+        arrival_index.record(keys[0], datetime(2020, 9, 2, 12))
+        assert arrival_index.get_day("20200902")["arrivals"][keys[0]] == (
+            "2020-09-02T10:00:00"
+        )
+
+    def test_refresh_WHEN_recently_refreshed_THEN_not_rewritten(self, tmp_path):
+        store = LocalArrivalStore(str(tmp_path))
+        arrival_index = ArrivalIndex(store)
+        arrival_index.record(self.key, datetime(2020, 9, 2, 10))
+        version = store.load(INDEX_OBJECT)[1]
+
+        arrival_index.record(self.key.replace("terms", "students"), datetime.utcnow())
+
+        assert store.load(INDEX_OBJECT)[1] == version
+
+    def test_save_WHEN_dynamo_store_changed_concurrently_THEN_False(
+        self, dynamodb_client
+    ):
+        store = DynamoArrivalStore(dynamodb_client)
+        assert store.save("20200902", {"arrivals": {}}, None)
+        assert not store.save("20200902", {"arrivals": {}}, None)
+
+        data, version = store.load("20200902")
+        assert store.save("20200902", data, version)
+        assert not store.save("20200902", data, version)
+
+
+class TestScheduleEngine:
+    def test_schedule_engine_WHEN_schedule_THEN_trigger_table(self, schedule_file):
+        partner_schedule = get_partner_shedule(schedule_file)
+        schedule_engine = ScheduleEngine(load_partner_schedule(schedule_file))
+
+        assert schedule_engine.minutes == [23 * 60 + 59]
+        assert set(schedule_engine.triggers[23 * 60 + 59]) == set(
+            partner_schedule["partner"]
+        )
+
+    def test_get_due_triggers_WHEN_no_watermark_THEN_current_minute_only(
+        self, schedule_file
+    ):
+        schedule_engine = ScheduleEngine(load_partner_schedule(schedule_file))
+
+        due = schedule_engine.get_due_triggers(None, datetime(2020, 9, 2, 23, 59, 30))
+        assert [trigger_time for trigger_time, _ in due] == [
+            datetime(2020, 9, 2, 23, 59)
+        ]
+        assert schedule_engine.get_due_triggers(None, datetime(2020, 9, 2, 12)) == []
+
+    def test_get_due_triggers_WHEN_trigger_delayed_THEN_caught_up(self, schedule_file):
+        schedule_engine = ScheduleEngine(load_partner_schedule(schedule_file))
+
+        due = schedule_engine.get_due_triggers(
+            datetime(2020, 9, 2, 23, 0), datetime(2020, 9, 3, 0, 0)
+        )
+        assert [trigger_time for trigger_time, _ in due] == [
+            datetime(2020, 9, 2, 23, 59)
+        ]
+        # already checked at 23:59
+        assert (
+            schedule_engine.get_due_triggers(
+                datetime(2020, 9, 2, 23, 59), datetime(2020, 9, 3, 0, 0)
+            )
+            == []
+        )
+
+    def test_get_due_triggers_WHEN_watermark_old_THEN_catch_up_bounded(
+        self, schedule_file
+    ):
+        schedule_engine = ScheduleEngine(load_partner_schedule(schedule_file))
+
+        due = schedule_engine.get_due_triggers(
+            datetime(2020, 8, 1), datetime(2020, 9, 3, 0, 0)
+        )
+        assert [trigger_time for trigger_time, _ in due] == [
+            datetime(2020, 9, 2, 23, 59)
+        ]
+
+    def test_watermark_WHEN_advanced_THEN_loaded(self, tmp_path):
+        watermark = Watermark(LocalArrivalStore(str(tmp_path)))
+        assert watermark.load() == (None, None)
+
+        assert watermark.advance(datetime(2020, 9, 3, 0, 0, 12), None)
+        last_run, etag = watermark.load()
+        assert last_run == datetime(2020, 9, 3, 0, 0, 12)
+        # a concurrent check already moved the watermark
+        assert not watermark.advance(datetime(2020, 9, 3, 0, 1), None)
+        assert watermark.advance(datetime(2020, 9, 3, 0, 1), etag)
+
+    def test_run_due_checks_WHEN_caught_up_THEN_trigger_day_files(
+        self, schedule_file, s3_bucket, sent_emails
+    ):
+        schedule_engine = ScheduleEngine(load_partner_schedule(schedule_file))
+        partner_files, _ = get_partner_files(
+            get_partner_shedule(schedule_file), "20200902.csv"
+        )
+        for key in partner_files[partner_files["partner"] != "hse"]["files"]:
+            s3_bucket.put_object(Key=key, Body=b"x")
+
+        due = schedule_engine.get_due_triggers(
+            datetime(2020, 9, 2, 23, 0), datetime(2020, 9, 3, 0, 0)
+        )
+        run_due_checks(schedule_engine, due, s3_bucket)
+
+        assert [log[0] for _, log in sent_emails] == ["Files not received for hse"]
+        assert "23:59" in sent_emails[0][1][1]
+        assert "_20200902.csv" in sent_emails[0][1][2]
+
+
+    def test_run_due_checks_WHEN_later_trigger_fails_THEN_watermark_kept(
+        self, tmp_path, schedule_file, s3_bucket, sent_emails, monkeypatch
+    ):
+        schedule_engine = ScheduleEngine(load_partner_schedule(schedule_file))
+        partners = schedule_engine.triggers[23 * 60 + 59]
+        due = [
+            (datetime(2020, 9, 1, 23, 59), partners),
+            (datetime(2020, 9, 2, 23, 59), partners),
+        ]
+        watermark = Watermark(LocalArrivalStore(str(tmp_path)))
+        check_partner_index = datahub_daily_check.check_partner_index
+        checks = []
+
+        def failing_check(partner_index, time_check, s3_bucket, **kwargs):
+            checks.append(time_check)
+            if len(checks) == 2:
+                raise RuntimeError("throttled")
+            check_partner_index(partner_index, time_check, s3_bucket, **kwargs)
+
+        monkeypatch.setattr(datahub_daily_check, "check_partner_index", failing_check)
+
+        with pytest.raises(RuntimeError):
+            run_due_checks(
+                schedule_engine, due, s3_bucket, watermark=watermark, etag=None
+            )
+
+        # the next run only checks the failed trigger
+        assert sent_emails
+        assert all("_20200902.csv" not in log[2] for _, log in sent_emails)
+        last_run, etag = watermark.load()
+        assert last_run == datetime(2020, 9, 2, 23, 58)
+        assert schedule_engine.get_due_triggers(
+            last_run, datetime(2020, 9, 3, 0, 0)
+        ) == due[1:]
+
+    def test_run_due_checks_WHEN_trigger_claimed_concurrently_THEN_no_alerts(
+        self, tmp_path, schedule_file, s3_bucket, sent_emails
+    ):
+        schedule_engine = ScheduleEngine(load_partner_schedule(schedule_file))
+        due = [(datetime(2020, 9, 1, 23, 59), schedule_engine.triggers[23 * 60 + 59])]
+        watermark = Watermark(LocalArrivalStore(str(tmp_path)))
+        # both checks loaded the watermark before either claimed the trigger
+        assert run_due_checks(
+            schedule_engine, due, s3_bucket, watermark=watermark, etag=None
+        )
+        alerts = len(sent_emails)
+
+        assert run_due_checks(
+            schedule_engine, due, s3_bucket, watermark=watermark, etag=None
+        ) is False
+        assert alerts and len(sent_emails) == alerts
+
+class FakeSES:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+
+    def send_email(self, **kwargs):
+        if self.errors:
+            raise ClientError({"Error": {"Code": self.errors.pop(0)}}, "SendEmail")
+        self.sent.append(kwargs)
+        return {"MessageId": str(len(self.sent))}
+
+
+class TestDeliverEmails:
+    def test_check_all_bucket_folders_WHEN_files_missing_THEN_internal_digest(
+        self, schedule_file, s3_bucket, sent_emails, sent_digests
+    ):
+        partner_schedule = get_partner_shedule(schedule_file)
+        partner_files, time_schedule = get_partner_files(
+            partner_schedule, "20200902.csv"
+        )
+        for key in partner_files[~partner_files["partner"].isin(["hse", "penn"])][
+            "files"
+        ]:
+            s3_bucket.put_object(Key=key, Body=b"x")
+
+        check_all_bucket_folders(
+            partner_files, "23:59", time_schedule, partner_schedule, s3_bucket
+        )
+
+        assert sorted(log[0] for _, log in sent_emails) == [
+            "Files not received for hse",
+            "Files not received for penn",
+        ]
+        assert len(sent_digests) == 1
+        to_emails, log = sent_digests[0]
+        assert to_emails == [["data-engineering-team@coursera.org"], []]
+        assert log[0] == "Files not received for 2 partner(s)"
+        assert "\n\thse: 8 file(s)" in "".join(log)
+
+    def test_get_digest_WHEN_nothing_missing_or_no_recipients_THEN_None(self):
+        assert get_digest([], "23:59") is None
+        assert get_digest([("hse", ["a"])], "23:59", digest_emails="") is None
+
+    def test_send_email_with_retry_WHEN_throttled_THEN_retried(self, monkeypatch):
+        ses = FakeSES(errors=["Throttling", "Throttling"])
+        monkeypatch.setattr(datahub_daily_check, "get_ses_client", lambda: ses)
+        log = ["Files not received for hse", "Time Check: 23:59 (UTC): ", "\n\t\ta"]
+
+        send_email_with_retry([["a@x.org"], []], log, delay=0)
+
+        assert len(ses.sent) == 1
+        assert (
+            ses.sent[0]["Message"]["Body"]["Text"]["Data"].count(
+                "Files not sent for hse"
+            )
+            == 1
+        )
+
+    def test_send_email_with_retry_WHEN_other_error_THEN_raised(self, monkeypatch):
+        ses = FakeSES(errors=["MessageRejected"])
+        monkeypatch.setattr(datahub_daily_check, "get_ses_client", lambda: ses)
+
+        with pytest.raises(ClientError):
+            send_email_with_retry([["a@x.org"], []], ["a", "b"], delay=0)
+
+    def test_deliver_emails_WHEN_one_fails_THEN_others_sent(self, monkeypatch):
+        ses = FakeSES(errors=["MessageRejected"])
+        monkeypatch.setattr(datahub_daily_check, "get_ses_client", lambda: ses)
+        emails = [([["a@x.org"], []], ["a", "b"], "") for _ in range(5)]
+
+        assert deliver_emails(emails) == 4
+        assert len(ses.sent) == 4
@@ -1,10 +1,18 @@
 import boto3
 import pytest
 from moto import mock_s3, mock_ses
+
+try:
+    from moto import mock_dynamodb
+except ImportError:  # moto < 3
+    from moto import mock_dynamodb2 as mock_dynamodb
 import datetime
+import os
+import shutil
 from collections import OrderedDict
 
 PartnerBucket = "coursera-degrees-data"
+TestDataFolder = os.path.dirname(os.path.abspath(__file__))
 
 
 def get_files(file_types):
@@ -126,6 +134,37 @@ def conns():
         yield boto_resource
 
 
+@pytest.fixture()
+def local_storage_root(tmp_path, monkeypatch):
+    """Copies the test files into a local storage root and selects the local backend"""
+    settings_folder = "datahub/datahub_validator/settings"
+    shutil.copytree(
+        os.path.join(TestDataFolder, settings_folder),
+        os.path.join(tmp_path, "coursera-data-engineering", settings_folder),
+    )
+    shutil.copytree(
+        os.path.join(TestDataFolder, "test"),
+        os.path.join(tmp_path, PartnerBucket, "test"),
+    )
+    monkeypatch.setenv("DATAHUB_STORAGE_BACKEND", "local")
+    monkeypatch.setenv("DATAHUB_STORAGE_ROOT", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture()
+def drop_table():
+    """Creates the DynamoDB table of the claim records of the drops"""
+    with mock_dynamodb():
+        client = boto3.client("dynamodb", region_name="us-east-1")
+        client.create_table(
+            TableName="datahub_validator_drops",
+            KeySchema=[{"AttributeName": "drop_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "drop_id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield client
+
+
 def upload_settings_test_files(res, bucket):
     folder = (
         "tests/test_datahub_degree_validator/" + "datahub/datahub_validator/settings/"
@@ -1,4 +1,13 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import boto3
 import pandas as pd
+import pyarrow.parquet as pq
 import pytest
 from moto import mock_s3, mock_ses
 
@@ -7,11 +16,21 @@ from .test_base import TestBase
 from datahub_degree_validator.datahub_degree_validator import (
     File,
     BucketFileData,
+    ErrorLogging,
+    LocalStorage,
+    RowResults,
+    S3Storage,
     Settings,
+    StorageBackend,
     ValidateFile,
+    parse_partner_contacts,
+    get_storage_backend,
     lambda_handler,
+    schedule_full_validation,
     SendEmail,
+    ValidateDrop,
 )
+from datahub_degree_validator import datahub_degree_validator
 
 
 # pytest --cov-report term-missing --cov=datahub_degree_validator tests/
@@ -222,3 +241,832 @@ class TestSendEmail(TestBase):
     def test_send_email(self, log):
         assert isinstance(SendEmail().send_email(log), type(dict()))
 
+
+
+@mock_ses
+class TestLocalStorage:
+    def test_get_storage_backend_WHEN_local_config_THEN_LocalStorage(
+        self, local_storage_root
+    ):
+        assert isinstance(get_storage_backend(), LocalStorage)
+
+    def test_get_storage_backend_WHEN_no_config_THEN_S3Storage(self):
+        assert isinstance(get_storage_backend(), S3Storage)
+
+    def test_read_csv_WHEN_correct_file_event_THEN_data_frame(
+        self, local_storage_root, correct_files_event, partner_bucket
+    ):
+        event_key = correct_files_event["detail"]["requestParameters"]["key"]
+        assert isinstance(
+            BucketFileData().read_csv(partner_bucket, event_key), type(pd.DataFrame())
+        )
+
+    def test_read_csv_WHEN_file_empty_event_THEN_None(
+        self, local_storage_root, partner_bucket
+    ):
+        event_key = "test/degree/enrollments/terms_20200124.csv"
+        assert None is BucketFileData().read_csv(partner_bucket, event_key)
+
+    def test_lambda_handler_WHEN_correct_files_event_THEN_Success(
+        self, local_storage_root, correct_files_event
+    ):
+        assert "Success" == lambda_handler(correct_files_event)
+
+    def test_lambda_handler_WHEN_file_pk_violation_event_THEN_log_written(
+        self, local_storage_root, file_pk_violation_event
+    ):
+        client = boto3.client("ses", region_name="us-east-1")
+        client.verify_email_identity(EmailAddress="datahub@coursera.org")
+
+        assert isinstance(lambda_handler(file_pk_violation_event), type(tuple()))
+        assert LocalStorage(local_storage_root).list_keys(
+            "coursera-data-engineering", "datahub/datahub_validator/logs/test/degree/"
+        )
+
+    def test_storage_backend_WHEN_method_missing_THEN_not_created(self):
+        class ReadOnlyStorage(StorageBackend):
+            def open(self, bucket, key):
+                return BytesIO(b"")
+
+        with pytest.raises(TypeError):
+            ReadOnlyStorage()
+
+
+
+@mock_ses
+class TestRowResults:
+    def row_results(self, root, file_name):
+        return pq.read_table(
+            LocalStorage(root).get_path(
+                "coursera-data-engineering",
+                "datahub/datahub_validator/row_results/test/degree/" + file_name,
+            )
+        )
+
+    def test_lambda_handler_WHEN_correct_files_event_THEN_no_failing_rows(
+        self, local_storage_root
+    ):
+        event = get_event("test/degree/enrollments/terms_20200128.csv")
+        assert "Success" == lambda_handler(event)
+
+        table = self.row_results(local_storage_root, "terms_20200128.parquet")
+        assert table.column("row_number").to_pylist()[:2] == [1, 2]
+        assert set(table.column("failing_columns").to_pylist()) == {0}
+        assert table.schema.metadata[b"pk_checked"] == b"True"
+
+    def test_lambda_handler_WHEN_wrong_field_datatypes_event_THEN_failing_column_bit(
+        self, local_storage_root
+    ):
+        boto3.client("ses", region_name="us-east-1").verify_email_identity(
+            EmailAddress="datahub@coursera.org"
+        )
+        event = get_event("test/degree/enrollments/terms_20200126.csv")
+        assert isinstance(lambda_handler(event), type(tuple()))
+
+        table = self.row_results(local_storage_root, "terms_20200126.parquet")
+        columns = json.loads(table.schema.metadata[b"columns"])
+        failing = table.column("failing_columns").to_pylist()
+        assert failing[0] == 0
+        assert RowResults(columns, 0).get_failing_column_names(failing[1]) == [
+            "file_post_dt"
+        ]
+
+    def test_lambda_handler_WHEN_file_pk_violation_event_THEN_pk_duplicate_rows(
+        self, local_storage_root
+    ):
+        boto3.client("ses", region_name="us-east-1").verify_email_identity(
+            EmailAddress="datahub@coursera.org"
+        )
+        event = get_event("test/degree/enrollments/terms_20200123.csv")
+        assert isinstance(lambda_handler(event), type(tuple()))
+
+        table = self.row_results(local_storage_root, "terms_20200123.parquet")
+        assert table.column("pk_duplicate").to_pylist()[:2] == [True, True]
+
+
+def get_event(key):
+    return {
+        "detail": {
+            "requestParameters": {"bucketName": "coursera-degrees-data", "key": key}
+        }
+    }
+
+
+@mock_ses
+class TestQuarantine:
+    def read_quarantine(self, root, folder, key):
+        return pd.read_csv(
+            LocalStorage(root).get_path(
+                "coursera-data-engineering",
+                "datahub/datahub_validator/quarantine/" + folder + "/" + key,
+            )
+        )
+
+    def test_lambda_handler_WHEN_wrong_field_datatypes_event_THEN_rows_split(
+        self, local_storage_root, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_QUARANTINE", "1")
+        boto3.client("ses", region_name="us-east-1").verify_email_identity(
+            EmailAddress="datahub@coursera.org"
+        )
+        key = "test/degree/enrollments/terms_20200126.csv"
+        assert isinstance(lambda_handler(get_event(key)), type(tuple()))
+
+        valid = self.read_quarantine(local_storage_root, "valid", key)
+        rejected = self.read_quarantine(local_storage_root, "rejected", key)
+        assert 120155 in list(valid["degree_term_id"])
+        assert 120158 in list(rejected["degree_term_id"])
+        assert len(valid) + len(rejected) == 18
+        assert "wrong field datatypes: file_post_dt" in set(
+            rejected["rejection_reason"]
+        )
+
+    def test_lambda_handler_WHEN_file_pk_violation_event_THEN_duplicates_rejected(
+        self, local_storage_root, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_QUARANTINE", "1")
+        boto3.client("ses", region_name="us-east-1").verify_email_identity(
+            EmailAddress="datahub@coursera.org"
+        )
+        key = "test/degree/enrollments/terms_20200123.csv"
+        assert isinstance(lambda_handler(get_event(key)), type(tuple()))
+
+        rejected = self.read_quarantine(local_storage_root, "rejected", key)
+        assert set(rejected["rejection_reason"]) == {"PK Violation"}
+
+    def test_lambda_handler_WHEN_quarantine_off_THEN_no_files(self, local_storage_root):
+        key = "test/degree/enrollments/terms_20200128.csv"
+        assert "Success" == lambda_handler(get_event(key))
+        assert not LocalStorage(local_storage_root).list_keys(
+            "coursera-data-engineering", "datahub/datahub_validator/quarantine/"
+        )
+
+
+@mock_ses
+class TestSampledValidation:
+    key = "test/degree/enrollments/terms_20200201.csv"
+
+    def write_large_file(self, root, bad_row=None, term_name="Term {}"):
+        rows = ['"degree_term_id","degree_term_name","degree_term_start_dt",'
+                '"degree_term_end_dt","degree_term_is_admittable","file_post_dt"']
+        for i in range(5000):
+            file_post_dt = "2020/02-01" if i == bad_row else "2020-02-01"
+            name = term_name.format(i)
+            rows.append(
+                f'"{i}","{name}","2015-05-18","2015-08-08","TRUE","{file_post_dt}"'
+            )
+        LocalStorage(root).put_object(
+            "coursera-degrees-data", self.key, "\n".join(rows) + "\n"
+        )
+
+    def read_logs(self, root):
+        storage = LocalStorage(root)
+        (log_key,) = storage.list_keys(
+            "coursera-data-engineering", "datahub/datahub_validator/logs/test/degree/"
+        )
+        return pd.read_csv(storage.get_path("coursera-data-engineering", log_key))
+
+    def test_read_csv_sample_WHEN_large_file_THEN_complete_unique_rows(
+        self, local_storage_root
+    ):
+        self.write_large_file(local_storage_root)
+        file_data, sampled_bytes, size = BucketFileData().read_csv_sample(
+            "coursera-degrees-data", self.key, 4, 2048
+        )
+        assert sampled_bytes < size
+        assert 0 < len(file_data) < 5000
+        assert file_data["degree_term_id"].is_unique
+        assert not file_data.isna().any().any()
+
+    def test_validate_sample_WHEN_bad_row_sampled_THEN_provisional_log(
+        self, local_storage_root, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_SAMPLE_BYTES", "2048")
+        self.write_large_file(local_storage_root, bad_row=1)
+        validate_file = ValidateFile(Settings())
+
+        log = validate_file.validate_sample(self.key.split("/"))
+
+        assert log[1]["error_code"] == 4
+        assert log[1]["verdict"] == "provisional"
+        assert log[1]["verdict_confidence"] == 1.0
+        # the sample does not tell the number of rows of the file
+        assert log[1]["file_no_of_rows"] is None
+        assert validate_file.error_logs.verdict == "final"
+
+    def test_validate_sample_WHEN_newlines_in_quoted_fields_THEN_inconclusive(
+        self, local_storage_root, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_SAMPLE_BYTES", "2048")
+        self.write_large_file(local_storage_root, term_name="Term\n{}\nof the year")
+        validate_file = ValidateFile(Settings())
+
+        file_data, _, _ = BucketFileData().read_csv_sample(
+            "coursera-degrees-data", self.key, 4, 2048
+        )
+        assert file_data is None
+        assert "Success" == validate_file.validate_sample(self.key.split("/"))
+        assert validate_file.error_logs.verdict_confidence == 0.0
+
+    def test_is_row_aligned_WHEN_chunk_starts_in_quoted_field_THEN_False(self):
+        header = b'"id","name","file_post_dt"'
+        # the range started after the newline of a quoted field: 2 columns
+        misaligned = b'of the year","2020-02-01"\n"2","Term 2","2020-02-01"\n'
+        aligned = b'"1","Term\n1","2020-02-01"\n"2","Term 2","2020-02-01"\n'
+
+        assert not BucketFileData().is_row_aligned(header, [aligned, misaligned])
+        assert not BucketFileData().is_row_aligned(header, [b'"1","Term 1\n'])
+        assert BucketFileData().is_row_aligned(header, [aligned])
+
+    def test_validate_sample_WHEN_sample_valid_THEN_Success_with_confidence(
+        self, local_storage_root, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_SAMPLE_BYTES", "2048")
+        self.write_large_file(local_storage_root)
+        validate_file = ValidateFile(Settings())
+
+        assert "Success" == validate_file.validate_sample(self.key.split("/"))
+        assert 0 < validate_file.error_logs.verdict_confidence < 1
+
+    def test_lambda_handler_WHEN_large_file_THEN_provisional_and_final_logs(
+        self, local_storage_root, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_SAMPLE_THRESHOLD_BYTES", "1024")
+        monkeypatch.setenv("DATAHUB_SAMPLE_BYTES", "2048")
+        boto3.client("ses", region_name="us-east-1").verify_email_identity(
+            EmailAddress="datahub@coursera.org"
+        )
+        self.write_large_file(local_storage_root, bad_row=1)
+        threads, emails = [], []
+        monkeypatch.setattr(
+            datahub_degree_validator,
+            "schedule_full_validation",
+            lambda event, context, log: threads.append(
+                schedule_full_validation(event, context, log)
+            ),
+        )
+        monkeypatch.setattr(
+            SendEmail,
+            "send_message",
+            lambda self, log, subject, message: emails.append(subject),
+        )
+
+        assert isinstance(lambda_handler(get_event(self.key)), type(tuple()))
+        threads[0].join()
+
+        logs = self.read_logs(local_storage_root)
+        assert list(logs["verdict"]) == ["provisional", "final"]
+        # the final verdict confirms the provisional one, the partner is alerted once
+        assert len(emails) == 1 and emails[0].startswith("PROVISIONAL")
+
+    def test_lambda_handler_WHEN_full_validation_passes_THEN_provisional_retracted(
+        self, local_storage_root, monkeypatch
+    ):
+        self.write_large_file(local_storage_root)
+        emails = []
+        monkeypatch.setattr(
+            SendEmail,
+            "send_message",
+            lambda self, log, subject, message: emails.append(log),
+        )
+        event = dict(
+            get_event(self.key), validation_mode="full", provisional_error_code=4
+        )
+
+        assert lambda_handler(event) == "Success"
+
+        logs = self.read_logs(local_storage_root)
+        assert list(logs["error_code"]) == [0]
+        assert list(logs["verdict"]) == ["final"]
+        assert len(emails) == 1
+        assert "provisional wrong field data types alert is retracted" in (
+            emails[0]["description"]
+        )
+
+
+@mock_ses
+class TestJobDispatch:
+    key = "test/degree/enrollments/terms_20200128.csv"
+
+    @pytest.fixture()
+    def job_runner(self, local_storage_root, monkeypatch):
+        from benchmarks.mega_stub import MegaStub
+        from datahub_common import mega
+
+        monkeypatch.setenv("DATAHUB_DISPATCH_JOBS", "1")
+        monkeypatch.setattr(
+            mega,
+            "get_job_keys",
+            lambda: {
+                "test/degree/enrollments/terms_{DATE_PLACEHOLDER}.csv": [
+                    "job-1",
+                    "https://mega/job-1",
+                ]
+            },
+        )
+        monkeypatch.setattr(mega, "send_email", lambda *args: None)
+        with MegaStub() as stub:
+            monkeypatch.setattr(mega, "MEGA_BASE_URL", stub.base_url)
+            monkeypatch.setattr(mega, "_latest_ids", {})
+            yield stub
+
+    def test_lambda_handler_WHEN_file_passes_THEN_job_executed(self, job_runner):
+        assert "Success" == lambda_handler(get_event(self.key))
+        assert job_runner.requests == [("getLatest", "job-1"), ("execute", "job-1~v1")]
+
+    def test_lambda_handler_WHEN_file_fails_THEN_no_job_executed(self, job_runner):
+        boto3.client("ses", region_name="us-east-1").verify_email_identity(
+            EmailAddress="datahub@coursera.org"
+        )
+        event = get_event("test/degree/enrollments/terms_20200123.csv")
+        assert isinstance(lambda_handler(event), tuple)
+        assert job_runner.requests == []
+
+    def test_lambda_handler_WHEN_dispatch_off_THEN_no_job_executed(
+        self, job_runner, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_DISPATCH_JOBS", "0")
+        assert "Success" == lambda_handler(get_event(self.key))
+        assert job_runner.requests == []
+
+    def test_dispatch_job_WHEN_no_job_mapped_THEN_None(self, job_runner):
+        validate_file = ValidateFile(Settings())
+        key = "test/degree/enrollments/degree_term_memberships_20200805.csv"
+        assert "Success" == validate_file.validate(key.split("/"))
+        assert validate_file.dispatch_job(key) is None
+        assert job_runner.requests == []
+
+
+class TestPartnerContacts:
+    def test_add_common_fields_to_log_WHEN_several_partners_THEN_own_contacts(
+        self, local_storage_root
+    ):
+        settings = Settings()
+        settings.set_file_settings()
+        error_logs = ErrorLogging(settings)
+        penn = File(["penn", "mcit", "enrollments", "terms_20200128.csv"])
+        hse = File(["hse", "master-of-data-science-hse", "enrollments", "terms.csv"])
+
+        penn_log = error_logs.add_common_fields_to_log({}, penn)
+        hse_log = error_logs.add_common_fields_to_log({}, hse)
+
+        assert penn_log["partner_emails"] == ""
+        assert penn_log["internal_emails"].endswith(";penn@coursera.org")
+        assert hse_log["partner_emails"].startswith("kabashidze@hse.ru;")
+        assert len(settings.ps_data) == len(settings.get_partner_schedule())
+        # one contacts index, shared with the emails of the settings
+        assert settings.partner_contacts is settings.get_partner_contacts()
+        assert "partner_contacts" not in vars(error_logs)
+
+    def test_parse_partner_contacts_WHEN_missing_emails_THEN_no_recipients(self):
+        contacts = parse_partner_contacts(float("nan"), " a@b.org; c@d.org ")
+        assert contacts == {
+            "partner_emails": "",
+            "partner_recipients": [],
+            "internal_emails": "a@b.org; c@d.org",
+            "internal_recipients": ["a@b.org", "c@d.org"],
+        }
+        assert parse_partner_contacts("fernando@x.org", None)["partner_recipients"] == [
+            "fernando@x.org"
+        ]
+
+    def test_send_email_WHEN_partner_contacts_THEN_recipients_from_index(
+        self, log, monkeypatch
+    ):
+        sent = []
+        monkeypatch.setattr(
+            datahub_degree_validator.boto3,
+            "client",
+            lambda *args, **kwargs: type(
+                "Client", (), {"send_email": lambda self, **email: sent.append(email)}
+            )(),
+        )
+        settings = Settings()
+        settings.partner_contacts = {
+            "test": parse_partner_contacts("p@x.org", "i@x.org;j@x.org")
+        }
+
+        SendEmail(settings).send_email(log)
+        SendEmail().send_email(log)
+
+        assert sent[0]["Destination"] == {
+            "ToAddresses": ["p@x.org"],
+            "BccAddresses": ["i@x.org", "j@x.org"],
+        }
+        assert sent[1]["Destination"] == {
+            "ToAddresses": [],
+            "BccAddresses": ["piusnig@gmail.com", "pmukiibi@coursera.org"],
+        }
+
+
+class TestValidateDrop:
+    date = "20200901"
+    drop_files = {
+        "terms": "terms_20200128.csv",
+        "degree_course_memberships": "degree_course_memberships_20200724.csv",
+        "degree_term_memberships": "degree_term_memberships_20200805.csv",
+        "degree_program_memberships": "degree_program_memberships_20200828.csv",
+        "degree_term_courses": "degree_term_courses_20200830.csv",
+    }
+
+    @pytest.fixture()
+    def drop(self, local_storage_root, drop_table, monkeypatch):
+        storage = LocalStorage(local_storage_root)
+        folder = "test/degree/enrollments/"
+        for name, source in self.drop_files.items():
+            with storage.open("coursera-degrees-data", folder + source) as body:
+                storage.put_object(
+                    "coursera-degrees-data",
+                    folder + name + "_" + self.date + ".csv",
+                    body.read(),
+                )
+        emails = []
+        monkeypatch.setattr(
+            SendEmail,
+            "send_message",
+            lambda self, log, subject, message: emails.append((subject, message)),
+        )
+        monkeypatch.setattr(
+            datahub_degree_validator,
+            "schedule_drop_validation",
+            lambda drop, delay, context=None: self.scheduled.append((drop, delay)),
+        )
+        self.scheduled = []
+        return emails
+
+    def get_drop_event(self, name):
+        return get_event("test/degree/enrollments/" + name + "_" + self.date + ".csv")
+
+    def ignore_missing_files(self, root):
+        path = LocalStorage(root).get_path(
+            "coursera-data-engineering",
+            "datahub/datahub_validator/settings/partner_schedule.csv",
+        )
+        ps_data = pd.read_csv(path)
+        ps_data.loc[ps_data["partner"] == "test", "ignore_files"] = (
+            "degree:applications,degree_courses,students"
+        )
+        ps_data.to_csv(path, index=False)
+
+    def test_lambda_handler_WHEN_drop_event_THEN_one_log_and_alert(
+        self, local_storage_root, drop, monkeypatch
+    ):
+        set_file_settings = Settings.set_file_settings
+        calls = []
+        monkeypatch.setattr(
+            Settings,
+            "set_file_settings",
+            lambda self, *args: calls.append(args) or set_file_settings(self, *args),
+        )
+        event = {"drop": {"partner": "test", "program": "degree", "date": self.date}}
+
+        drop_log = lambda_handler(event)
+
+        assert calls == [()]
+        assert (drop_log["status"], drop_log["passed"], drop_log["failed"]) == (
+            "failed",
+            4,
+            1,
+        )
+        assert drop_log["missing_files"] == [
+            "applications",
+            "degree_courses",
+            "students",
+        ]
+        assert len(drop) == 1
+        assert "1 file(s): degree_program_memberships_20200901.csv" in drop[0][0]
+        assert json.loads(
+            LocalStorage(local_storage_root)
+            .open(
+                "coursera-data-engineering",
+                "datahub/datahub_validator/drops/test/degree/"
+                "datahub_drop_test_degree_20200901.json",
+            )
+            .read()
+        )["files"] == drop_log["files"]
+
+    def test_lambda_handler_WHEN_drop_mode_THEN_waits_for_the_drop(
+        self, local_storage_root, drop, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_DROP_MODE", "1")
+        event = get_event("test/degree/enrollments/terms_" + self.date + ".csv")
+
+        assert lambda_handler(event) == "pending"
+        assert drop == []
+        assert self.scheduled == [
+            (
+                {
+                    "partner": "test",
+                    "program": "degree",
+                    "date": self.date,
+                    "bucket_name": "coursera-degrees-data",
+                },
+                21600,
+            )
+        ]
+
+        self.ignore_missing_files(local_storage_root)
+        drop_log = lambda_handler(event)
+        assert drop_log["no_of_files"] == 5
+        assert drop_log["missing_files"] == []
+        assert len(drop) == 1
+        assert len(self.scheduled) == 1
+
+    def test_lambda_handler_WHEN_last_files_land_together_THEN_validated_once(
+        self, local_storage_root, drop, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_DROP_MODE", "1")
+        self.ignore_missing_files(local_storage_root)
+        # both landings load the drop record before either claims it
+        barrier = threading.Barrier(2, timeout=30)
+        start_drop = ValidateDrop.start_drop
+        monkeypatch.setattr(
+            ValidateDrop,
+            "start_drop",
+            lambda self, *args: (start_drop(self, *args), barrier.wait())[0],
+        )
+        events = [
+            self.get_drop_event("terms"),
+            self.get_drop_event("degree_term_courses"),
+        ]
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            results = list(pool.map(lambda_handler, events))
+
+        assert sorted(x == "claimed" for x in results) == [False, True]
+        assert [x for x in results if x != "claimed"][0]["no_of_files"] == 5
+        assert len(drop) == 1
+        assert len(self.scheduled) == 1
+        assert lambda_handler({"drop": self.scheduled[0][0]}) == "done"
+        assert len(drop) == 1
+
+    def test_lambda_handler_WHEN_file_uploaded_again_THEN_only_file_validated(
+        self, local_storage_root, drop, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_DROP_MODE", "1")
+        self.ignore_missing_files(local_storage_root)
+        assert lambda_handler(self.get_drop_event("terms"))["no_of_files"] == 5
+        assert len(drop) == 1
+        validate_key = ValidateDrop.validate_key
+        keys = []
+        monkeypatch.setattr(
+            ValidateDrop,
+            "validate_key",
+            lambda self, key: keys.append(key) or validate_key(self, key),
+        )
+
+        assert lambda_handler(self.get_drop_event("terms")) == "Success"
+        log = lambda_handler(self.get_drop_event("degree_program_memberships"))
+
+        assert log[1]["file_name"] == "degree_program_memberships_20200901.csv"
+        assert keys == [
+            "test/degree/enrollments/terms_20200901.csv",
+            "test/degree/enrollments/degree_program_memberships_20200901.csv",
+        ]
+        # the error was alerted with the drop already
+        assert len(drop) == 1
+
+    def test_lambda_handler_WHEN_file_lands_while_validated_THEN_validated_after(
+        self, local_storage_root, drop, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_DROP_MODE", "1")
+        monkeypatch.setenv("DATAHUB_DROP_DEADLINE", "0")
+        storage = LocalStorage(local_storage_root)
+        late_key = "test/degree/enrollments/degree_term_courses_" + self.date + ".csv"
+        with storage.open("coursera-degrees-data", late_key) as body:
+            late_body = body.read()
+        os.remove(storage.get_path("coursera-degrees-data", late_key))
+        validate, landings = ValidateDrop.validate, []
+
+        def land_late_file(self, *args):
+            storage.put_object("coursera-degrees-data", late_key, late_body)
+            landings.append(lambda_handler(get_event(late_key)))
+            return validate(self, *args)
+
+        monkeypatch.setattr(ValidateDrop, "validate", land_late_file)
+        validate_key, keys = ValidateDrop.validate_key, []
+        monkeypatch.setattr(
+            ValidateDrop,
+            "validate_key",
+            lambda self, key: keys.append(key) or validate_key(self, key),
+        )
+
+        drop_log = lambda_handler(self.get_drop_event("terms"))
+
+        assert landings == ["claimed"]
+        assert drop_log["no_of_files"] == 4
+        assert keys.count(late_key) == 1 and keys[-1] == late_key
+
+    def test_add_logs_to_bucket_WHEN_files_logged_together_THEN_no_log_lost(
+        self, local_storage_root, log, monkeypatch
+    ):
+        settings = Settings()
+        read_csv = BucketFileData.read_csv
+
+        def slow_read_csv(self, *args):
+            # widens the window between reading and writing the log file
+            data = read_csv(self, *args)
+            time.sleep(0.05)
+            return data
+
+        monkeypatch.setattr(BucketFileData, "read_csv", slow_read_csv)
+        logs = [
+            dict(
+                log, description="file " + str(i), verdict="final", verdict_confidence=1
+            )
+            for i in range(6)
+        ]
+
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            list(
+                pool.map(
+                    lambda x: ErrorLogging(settings).add_logs_to_bucket(
+                        settings.logs_bucket, x
+                    ),
+                    logs,
+                )
+            )
+
+        logged = BucketFileData().read_csv(settings.logs_bucket, log["log_file_path"])
+        assert sorted(logged["description"]) == sorted(x["description"] for x in logs)
+
+    def test_lambda_handler_WHEN_deadline_passed_THEN_landed_files_validated(
+        self, local_storage_root, drop, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_DROP_MODE", "1")
+        monkeypatch.setenv("DATAHUB_DROP_DEADLINE", "0")
+
+        drop_log = lambda_handler(self.get_drop_event("terms"))
+
+        assert drop_log["no_of_files"] == 5
+        assert drop_log["missing_files"] == [
+            "applications",
+            "degree_courses",
+            "students",
+        ]
+        assert len(drop) == 1
+
+    def test_get_pk_cols_WHEN_files_share_settings_THEN_settings_unchanged(
+        self, local_storage_root
+    ):
+        settings = Settings()
+        validate_file = ValidateFile(settings)
+        no_of_rows = len(settings.mt_data), len(settings.fn_data)
+
+        for key in [
+            "test/degree/enrollments/terms_20200123.csv",
+            "test/degree/enrollments/degree_course_memberships_20200724.csv",
+        ]:
+            validate_file.validate(key.split("/"))
+
+        assert (len(settings.mt_data), len(settings.fn_data)) == no_of_rows
+        assert "Success" == validate_file.validate(
+            "test/degree/enrollments/terms_20200128.csv".split("/")
+        )
+
+
+class TestReferentialIntegrity:
+    date = "20200901"
+    folder = "test/degree/enrollments/"
+    orphan_row = (
+        '"650036519","120205","999999","ENROLLED","2020-05-05 00:00:00.000","0",'
+        '"2020-08-05"'
+    )
+
+    @pytest.fixture()
+    def storage(self, local_storage_root, monkeypatch):
+        monkeypatch.setenv("DATAHUB_CHECK_REFERENCES", "1")
+        storage = LocalStorage(local_storage_root)
+        for name, source in [
+            ("terms", "terms_20200128.csv"),
+            ("degree_term_memberships", "degree_term_memberships_20200805.csv"),
+        ]:
+            with storage.open("coursera-degrees-data", self.folder + source) as body:
+                data = body.read().decode("utf8")
+            if name == "degree_term_memberships":
+                data = data.rstrip("\n") + "\n" + self.orphan_row
+            storage.put_object(
+                "coursera-degrees-data",
+                self.folder + name + "_" + self.date + ".csv",
+                data.encode("utf8"),
+            )
+        return storage
+
+    def validate(self, name):
+        key = self.folder + name + "_" + self.date + ".csv"
+        return ValidateFile(Settings()).validate(key.split("/"))
+
+    def test_validate_WHEN_keys_missing_in_parent_THEN_referential_integrity(
+        self, storage
+    ):
+        assert self.validate("terms") == "Success"
+        log = self.validate("degree_term_memberships")
+
+        assert log[1]["error_code"] == 6
+        assert log[1]["error_type"] == "referential integrity"
+        assert (
+            "academic_term_id: not in terms_20200901.csv: degree_term_id: Orphans: 1"
+            in log[1]["description"]
+        )
+        assert "For: 999999" in log[1]["description"]
+
+    def test_validate_WHEN_parent_indexed_THEN_persisted_index_reused(
+        self, storage, local_storage_root
+    ):
+        self.validate("terms")
+        assert (
+            "datahub/datahub_validator/key_indexes/test/degree/enrollments/"
+            "terms_20200901/degree_term_id.npy"
+            in storage.list_keys("coursera-data-engineering", "datahub/")
+        )
+        os.remove(
+            storage.get_path(
+                "coursera-degrees-data", self.folder + "terms_" + self.date + ".csv"
+            )
+        )
+
+        log = self.validate("degree_term_memberships")
+        assert log[1]["error_code"] == 6
+
+    def test_validate_WHEN_parent_not_validated_THEN_index_not_persisted(self, storage):
+        log = self.validate("degree_term_memberships")
+
+        assert log[1]["error_code"] == 6
+        assert not storage.list_keys(
+            "coursera-data-engineering", "datahub/datahub_validator/key_indexes/"
+        )
+
+    def fail_terms(self, storage):
+        key = self.folder + "terms_" + self.date + ".csv"
+        with storage.open("coursera-degrees-data", key) as body:
+            rows = body.read().decode("utf8").rstrip("\n").split("\n")
+        # the first row again violates the primary key
+        storage.put_object(
+            "coursera-degrees-data", key, "\n".join(rows + rows[1:2]).encode("utf8")
+        )
+        assert self.validate("terms")[1]["error_code"] == 5
+
+    def test_validate_WHEN_parent_fails_again_THEN_persisted_index_removed(
+        self, storage
+    ):
+        assert self.validate("terms") == "Success"
+        self.fail_terms(storage)
+
+        assert storage.list_keys(
+            "coursera-data-engineering", "datahub/datahub_validator/key_indexes/"
+        ) == [
+            "datahub/datahub_validator/key_indexes/test/degree/enrollments/"
+            "terms_20200901/failed"
+        ]
+
+    def test_validate_WHEN_parent_failed_THEN_child_not_checked(self, storage):
+        self.fail_terms(storage)
+
+        assert self.validate("degree_term_memberships") == "Success"
+
+    def test_key_indexes_WHEN_key_case_differs_THEN_index_found(self, storage):
+        settings = Settings()
+        index = settings.key_indexes.add(
+            "Test/Degree/Enrollments/Terms_20200901.csv",
+            "degree_term_id",
+            pd.Series(["2310", "2260"]),
+        )
+        os.remove(
+            storage.get_path(
+                "coursera-degrees-data", self.folder + "terms_" + self.date + ".csv"
+            )
+        )
+
+        found = Settings().key_indexes.get(
+            "coursera-degrees-data",
+            self.folder + "terms_20200901.csv",
+            "degree_term_id",
+        )
+        assert found.tolist() == index.tolist()
+
+    def test_validate_WHEN_parent_missing_or_disabled_THEN_not_checked(
+        self, storage, monkeypatch
+    ):
+        monkeypatch.setenv("DATAHUB_CHECK_REFERENCES", "0")
+        assert self.validate("degree_term_memberships") == "Success"
+
+        monkeypatch.setenv("DATAHUB_CHECK_REFERENCES", "1")
+        settings = Settings()
+        index = settings.key_indexes.get(
+            "coursera-degrees-data", self.folder + "students_20200901.csv", "student_id"
+        )
+        assert index is None
+
+    def test_validate_drop_WHEN_orphans_THEN_child_failed_in_drop_log(
+        self, storage, drop_table, monkeypatch
+    ):
+        monkeypatch.setattr(
+            SendEmail, "send_message", lambda self, log, subject, message: None
+        )
+        event = {"drop": {"partner": "test", "program": "degree", "date": self.date}}
+
+        drop_log = lambda_handler(event)
+
+        files = {file["file_name"]: file for file in drop_log["files"]}
+        assert files["terms_20200901.csv"]["status"] == "passed"
+        assert files["degree_term_memberships_20200901.csv"]["error_code"] == 6
@@ -0,0 +1,104 @@
+from datahub_degree_validator import history
+from datahub_degree_validator.datahub_degree_validator import (
+    LocalStorage,
+    Settings,
+    ValidateFile,
+)
+from datahub_degree_validator.history import HistoryStore, main
+
+PkViolationKeys = [
+    "test/degree/enrollments/terms_20200123.csv",
+    "test/degree/enrollments/degree_program_memberships_20200828.csv",
+]
+
+
+def validate(*keys):
+    for key in keys:
+        ValidateFile(Settings()).validate(key.split("/"))
+
+
+class TestHistoryStore:
+    def test_sync_WHEN_csv_logs_THEN_logs_counted(self, local_storage_root):
+        validate(*PkViolationKeys, "test/degree/enrollments/terms_20200126.csv")
+        store = HistoryStore(str(local_storage_root / "history.sqlite"))
+
+        assert store.sync() == {"listed": 1, "read": 1, "added": 3}
+        assert store.count() == [{"partner": "test", "count": 3}]
+        assert store.count(group_by=["error_type"], error_code=5, days=1) == [
+            {"error_type": "PK Violation", "count": 2}
+        ]
+        assert store.count(group_by=None, start_date="20200101", end_date="20200102")[
+            0
+        ] == {"count": 0}
+
+    def test_sync_WHEN_synced_again_THEN_changed_logs_only(self, local_storage_root):
+        validate(PkViolationKeys[0])
+        store = HistoryStore(str(local_storage_root / "history.sqlite"))
+        store.sync()
+
+        assert store.sync() == {"listed": 1, "read": 0, "added": 0}
+        validate(PkViolationKeys[1])
+        assert store.sync() == {"listed": 1, "read": 1, "added": 1}
+        assert store.count(group_by=["file_name"]) == [
+            {"file_name": "degree_program_memberships_20200828.csv", "count": 1},
+            {"file_name": "terms_20200123.csv", "count": 1},
+        ]
+
+    def test_sync_WHEN_log_files_listed_THEN_sizes_not_requested(
+        self, local_storage_root, monkeypatch
+    ):
+        validate(PkViolationKeys[0])
+        store = HistoryStore(str(local_storage_root / "history.sqlite"))
+
+        def get_size(self, bucket, key):
+            raise AssertionError("the size comes from the listing")
+
+        monkeypatch.setattr(LocalStorage, "get_size", get_size)
+
+        assert store.sync() == {"listed": 1, "read": 1, "added": 1}
+        assert store.sync() == {"listed": 1, "read": 0, "added": 0}
+
+    def test_add_logs_to_bucket_WHEN_same_settings_THEN_one_connection(
+        self, local_storage_root, monkeypatch
+    ):
+        path = str(local_storage_root / "history.sqlite")
+        monkeypatch.setenv("DATAHUB_HISTORY_DB", path)
+        connections = []
+
+        def connect(*args, **kwargs):
+            connections.append(args)
+            return sqlite3_connect(*args, **kwargs)
+
+        sqlite3_connect = history.sqlite3.connect
+        monkeypatch.setattr(history.sqlite3, "connect", connect)
+        settings = Settings()
+
+        for key in PkViolationKeys:
+            ValidateFile(settings).validate(key.split("/"))
+
+        assert len(connections) == 1
+        assert settings.get_history_store().count() == [{"partner": "test", "count": 2}]
+
+    def test_add_logs_to_bucket_WHEN_history_db_THEN_log_added_once(
+        self, local_storage_root, monkeypatch
+    ):
+        path = str(local_storage_root / "history.sqlite")
+        monkeypatch.setenv("DATAHUB_HISTORY_DB", path)
+        validate(*PkViolationKeys)
+        store = HistoryStore(path)
+
+        assert store.count(group_by=["program", "error_code"]) == [
+            {"program": "degree", "error_code": 5, "count": 2}
+        ]
+        # the logs synced from the csv logs are the same logs
+        assert store.sync()["added"] == 0
+
+    def test_main_WHEN_query_THEN_counts(self, local_storage_root, capsys):
+        validate(*PkViolationKeys)
+        db = "--db=" + str(local_storage_root / "history.sqlite")
+        main(["sync", db])
+
+        result = main(["query", db, "--group-by=partner", "--error-code=5"])
+
+        assert result == [{"partner": "test", "count": 2}]
+        assert '{"partner": "test", "count": 2}' in capsys.readouterr().out
@@ -0,0 +1,132 @@
+import json
+import os
+
+import pytest
+
+from datahub_common.partner_artifact import (
+    ScheduleMismatch,
+    build_artifact,
+    check_artifact,
+    main,
+)
+from datahub_degree_validator.datahub_degree_validator import Settings
+
+from .conftest import TestDataFolder
+
+ScheduleFile = os.path.join(
+    TestDataFolder, "..", "..", "datahub_daily_check", "partner_schedule.csv"
+)
+SettingsFolder = os.path.join(
+    TestDataFolder, "datahub", "datahub_validator", "settings"
+)
+JobKey = "hse/master-of-data-science-hse/enrollments/terms_{DATE_PLACEHOLDER}.csv"
+
+
+def get_sources(tmp_path):
+    jobs_file = tmp_path / "s3_import_jobs.csv"
+    jobs_file.write_text(
+        "s3_key,mega_job_id,script_url\n" + JobKey + ",job-1,https://mega/job-1\n"
+    )
+    return (os.path.join(SettingsFolder, "partner_schedule.csv"), str(jobs_file))
+
+
+def write_artifact(artifact, path):
+    path.write_text(json.dumps(artifact))
+    return json.loads(path.read_text())
+
+
+class TestPartnerArtifact:
+    def test_build_artifact_WHEN_sources_THEN_sections(self, tmp_path):
+        artifact = build_artifact(*get_sources(tmp_path))
+
+        assert artifact["format"] == 1
+        assert artifact["jobs"] == {JobKey: ["job-1", "https://mega/job-1"]}
+        assert artifact["partners"]["penn"]["programs"] == ["mcit"]
+        assert artifact["partners"]["umich"]["ignore_files"] == {
+            "umich/master-of-applied-data-science-umich": ["applications"],
+            "umich/mph-umich": ["applications"],
+        }
+        assert "metadata" not in artifact and "fieldnames" not in artifact
+
+    def test_build_artifact_WHEN_date_offsets_THEN_partner_rules(self, tmp_path):
+        artifact = build_artifact(ScheduleFile)
+
+        assert artifact["partners"]["macquarie"]["date_offsets"] == {
+            "macquarie/mq-global-mba": {"applications": -1}
+        }
+        assert artifact["jobs"] == {}
+
+    def test_build_artifact_WHEN_schedule_copy_differs_THEN_mismatch(self, tmp_path):
+        schedule_file = os.path.join(SettingsFolder, "partner_schedule.csv")
+        copy_file = tmp_path / "partner_schedule.csv"
+        with open(schedule_file) as schedule:
+            copy_file.write_text(schedule.read().replace("mcit", "mcit-online"))
+
+        assert build_artifact(schedule_file, schedule_copies=[schedule_file])
+        with pytest.raises(ScheduleMismatch, match="for partners: penn"):
+            build_artifact(schedule_file, schedule_copies=[str(copy_file)])
+        assert (
+            main(
+                [
+                    "build",
+                    "--output",
+                    str(tmp_path / "a.json"),
+                    "--schedule",
+                    schedule_file,
+                    "--schedule-copy",
+                    str(copy_file),
+                ]
+            )
+            == 1
+        )
+        assert not (tmp_path / "a.json").exists()
+
+    def test_check_artifact_WHEN_sources_unchanged_THEN_consistent(self, tmp_path):
+        sources = get_sources(tmp_path)
+        artifact = write_artifact(build_artifact(*sources), tmp_path / "a.json")
+
+        assert check_artifact(artifact, *sources) == []
+
+    def test_check_artifact_WHEN_source_changed_THEN_out_of_date(self, tmp_path):
+        sources = get_sources(tmp_path)
+        artifact = write_artifact(build_artifact(*sources), tmp_path / "a.json")
+        with open(sources[1], "a") as jobs_file:
+            jobs_file.write("hse/x/enrollments/students_{DATE_PLACEHOLDER}.csv,j,u\n")
+
+        assert check_artifact(artifact, *sources) == [
+            "source jobs: s3_import_jobs.csv changed since the build",
+            "section jobs is out of date",
+        ]
+
+    def test_main_WHEN_build_then_check_THEN_exit_codes(self, tmp_path):
+        schedule, jobs = get_sources(tmp_path)
+        output = str(tmp_path / "partner_artifact.json")
+        args = ["--schedule", schedule, "--jobs", jobs]
+
+        assert main(["build", "--output", output] + args) == 0
+        assert main(["check", "--artifact", output] + args) == 0
+        assert main(["check", "--artifact", output, "--schedule", ScheduleFile]) == 1
+
+    def test_settings_WHEN_artifact_THEN_same_schedule_and_swaps(
+        self, tmp_path, local_storage_root, monkeypatch
+    ):
+        settings_folder = "datahub/datahub_validator/settings/"
+        csv_settings = Settings(folder=settings_folder)
+        artifact_key = settings_folder + "partner_artifact.json"
+        artifact = build_artifact(*get_sources(tmp_path))
+        (local_storage_root / "coursera-data-engineering" / artifact_key).write_text(
+            json.dumps(artifact)
+        )
+        monkeypatch.setenv("DATAHUB_PARTNER_ARTIFACT", artifact_key)
+        artifact_settings = Settings(folder=settings_folder)
+
+        assert artifact_settings.get_swap_rules() == csv_settings.get_swap_rules()
+        ps_data = artifact_settings.get_partner_schedule()
+        csv_ps_data = csv_settings.get_partner_schedule()
+        assert list(ps_data["partner"]) == list(csv_ps_data["partner"])
+        assert (
+            ps_data["partner_emails"].astype(str).tolist()
+            == csv_ps_data["partner_emails"].astype(str).tolist()
+        )
+        fn_data = artifact_settings.get_fieldnames()
+        assert list(fn_data["file"]) == list(csv_settings.get_fieldnames()["file"])
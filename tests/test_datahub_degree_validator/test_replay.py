@@ -0,0 +1,102 @@
+import json
+
+from datahub_degree_validator.datahub_degree_validator import LocalStorage
+from datahub_degree_validator.replay import ReplayEngine, main
+
+
+class TestReplayEngine:
+    def test_list_files_WHEN_date_range_THEN_files_in_range(self, local_storage_root):
+        engine = ReplayEngine(checkpoint_path=str(local_storage_root / "c.jsonl"))
+        keys = engine.list_files("20200801", "20200831", partners=["test"])
+        assert keys == [
+            "test/degree/enrollments/degree_program_memberships_20200828.csv",
+            "test/degree/enrollments/degree_term_courses_20200830.csv",
+            "test/degree/enrollments/degree_term_memberships_20200805.csv",
+        ]
+
+    def test_run_WHEN_historical_files_THEN_report_without_bucket_logs(
+        self, local_storage_root
+    ):
+        engine = ReplayEngine(checkpoint_path=str(local_storage_root / "c.jsonl"))
+        report = engine.run("20200101", "20201231", partners=["test"])
+
+        assert report["total"] == report["passed"] + report["failed"]
+        assert report["passed"] == 4
+        assert report["by_error_type"]["PK Violation"] == 2
+        assert not LocalStorage(local_storage_root).list_keys(
+            "coursera-data-engineering", "datahub/datahub_validator/logs/"
+        )
+
+    def test_run_WHEN_checkpoint_exists_THEN_resumes(self, local_storage_root):
+        checkpoint_path = local_storage_root / "c.jsonl"
+        key = "test/degree/enrollments/terms_20200128.csv"
+
+        engine = ReplayEngine(checkpoint_path=str(checkpoint_path))
+        result = {"key": key, "status": "failed", "error_type": "PK Violation"}
+        result["settings_version"] = engine.settings_version
+        checkpoint_path.write_text(json.dumps(result) + "\n")
+        engine.validate_key = lambda key: {"key": key, "status": "passed"}
+        report = engine.run("20200128", "20200128", partners=["test"])
+
+        assert report["failed_files"] == [key]
+
+    def test_run_WHEN_settings_changed_THEN_checkpoint_not_resumed(
+        self, local_storage_root
+    ):
+        checkpoint_path = local_storage_root / "c.jsonl"
+        engine = ReplayEngine(checkpoint_path=str(checkpoint_path))
+        engine.validate_key = lambda key: {
+            "key": key,
+            "status": "failed",
+            "error_type": "PK Violation",
+        }
+        engine.run("20200128", "20200128", partners=["test"])
+
+        metadata = LocalStorage(local_storage_root).get_path(
+            "coursera-data-engineering",
+            "datahub/datahub_validator/settings/metadata.csv",
+        )
+        with open(metadata, "a") as metadata_file:
+            metadata_file.write("\n")
+        engine = ReplayEngine(checkpoint_path=str(checkpoint_path))
+        engine.validate_key = lambda key: {"key": key, "status": "passed"}
+        report = engine.run("20200128", "20200128", partners=["test"])
+
+        assert report["passed"] == report["total"] and report["failed_files"] == []
+
+    def test_settings_version_WHEN_verdict_flags_changed_THEN_changed(
+        self, local_storage_root, monkeypatch
+    ):
+        version = ReplayEngine().settings_version
+
+        monkeypatch.setenv("DATAHUB_CHECK_REFERENCES", "1")
+        references_version = ReplayEngine().settings_version
+        artifact = LocalStorage(local_storage_root).get_path(
+            "coursera-data-engineering",
+            "datahub/datahub_validator/settings/partner_artifact.json",
+        )
+        with open(artifact, "w") as artifact_file:
+            artifact_file.write("{}")
+        monkeypatch.setenv(
+            "DATAHUB_PARTNER_ARTIFACT",
+            "datahub/datahub_validator/settings/partner_artifact.json",
+        )
+        artifact_version = ReplayEngine().settings_version
+        with open(artifact, "w") as artifact_file:
+            artifact_file.write('{"swap_rules": []}')
+
+        assert len({version, references_version, artifact_version}) == 3
+        assert ReplayEngine().settings_version != artifact_version
+
+    def test_main_WHEN_cli_args_THEN_report_file(self, local_storage_root):
+        report_path = local_storage_root / "report.json"
+        main(
+            [
+                "--start=20200801",
+                "--end=20200831",
+                "--partner=test",
+                "--checkpoint=" + str(local_storage_root / "c.jsonl"),
+                "--report=" + str(report_path),
+            ]
+        )
+        assert json.loads(report_path.read_text())["total"] == 3
@@ -0,0 +1,95 @@
+import boto3
+import pytest
+from moto import mock_s3
+
+try:
+    from moto import mock_dynamodb
+except ImportError:  # moto < 3
+    from moto import mock_dynamodb2 as mock_dynamodb
+
+from benchmarks.mega_stub import MegaStub
+
+JobKey = "hse/master-of-data-science-hse/enrollments/terms_{DATE_PLACEHOLDER}.csv"
+
+
+def get_jobs_csv(*jobs):
+    return "s3_key,mega_job_id,script_url\n" + "".join(
+        "{},{},https://mega/{}\n".format(key, job_id, job_id) for key, job_id in jobs
+    )
+
+
+@pytest.fixture()
+def s3_client():
+    with mock_s3():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="oaljadda")
+        client.put_object(
+            Bucket="oaljadda",
+            Key="jobs/s3_import_jobs.csv",
+            Body=get_jobs_csv((JobKey, "job-1")),
+        )
+        yield client
+
+
+@pytest.fixture()
+def mega_stub(monkeypatch):
+    from datahub_common import mega
+
+    with MegaStub() as stub:
+        monkeypatch.setattr(mega, "MEGA_BASE_URL", stub.base_url)
+        monkeypatch.setattr(mega, "_latest_ids", {})
+        yield stub
+
+
+JobKeys = [
+    (
+        "hse/master-of-data-science-hse/enrollments/terms_{DATE_PLACEHOLDER}.csv",
+        "job-1",
+    ),
+    (
+        "hse/master-of-data-science-hse/enrollments/students_{DATE_PLACEHOLDER}.csv",
+        "job-1",
+    ),
+    ("penn/mcit/enrollments/students_{DATE_PLACEHOLDER}.csv", "job-2"),
+]
+
+
+@pytest.fixture()
+def dispatch_table():
+    with mock_dynamodb():
+        client = boto3.client("dynamodb", region_name="us-east-1")
+        client.create_table(
+            TableName="datahub_job_runner_dispatches",
+            KeySchema=[{"AttributeName": "dispatch_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "dispatch_id", "AttributeType": "S"}
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield client
+
+
+@pytest.fixture()
+def job_runner(s3_client, mega_stub, dispatch_table, monkeypatch):
+    """Runs the job runner against moto buckets and table and the MEGA stand-in"""
+    from datahub_common import mega
+    from datahub_job_runner import datahub_job_runner
+
+    s3_client.put_object(
+        Bucket="oaljadda", Key="jobs/s3_import_jobs.csv", Body=get_jobs_csv(*JobKeys)
+    )
+    s3_client.create_bucket(Bucket="coursera-degrees-data")
+    monkeypatch.setattr(datahub_job_runner, "s3", s3_client)
+    monkeypatch.setattr(mega, "job_index", mega.JobIndex(client=s3_client))
+    monkeypatch.setattr(datahub_job_runner, "send_email", lambda *args: None)
+    monkeypatch.setattr(datahub_job_runner, "_dynamodb_client", dispatch_table)
+    return datahub_job_runner
+
+
+def get_file_event(key, time="2020-09-02T23:59:10Z"):
+    return {
+        "time": time,
+        "detail": {
+            "requestParameters": {"bucketName": "coursera-degrees-data", "key": key}
+        },
+    }
@@ -0,0 +1,461 @@
+import json
+import threading
+import time
+
+import pytest
+import requests
+from botocore.exceptions import ClientError
+
+from datahub_common import mega
+from datahub_common.mega import JobIndex, MegaJob, post_mega
+from datahub_job_runner import datahub_job_runner
+from datahub_job_runner.datahub_job_runner import number_of_records_in_s3_file
+
+from .conftest import JobKey, get_file_event, get_jobs_csv
+
+
+class CountingClient:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def get_object(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.client.get_object(**kwargs)
+
+
+def get_lookup_metrics(capsys):
+    return [
+        json.loads(line)
+        for line in capsys.readouterr().out.splitlines()
+        if '"job_index_lookup"' in line
+    ]
+
+
+class TestJobIndex:
+    def test_get_WHEN_warm_THEN_not_downloaded_again(self, s3_client, capsys):
+        client = CountingClient(s3_client)
+        job_index = JobIndex(client=client)
+
+        assert job_index.get() == {JobKey: ["job-1", "https://mega/job-1"]}
+        assert job_index.get() is job_index.get()
+
+        assert len(client.calls) == 1
+        metrics = get_lookup_metrics(capsys)
+        assert [m["result"] for m in metrics] == ["refreshed", "hit", "hit"]
+        assert metrics[-1]["hit_rate"] == "0.667"
+        assert "latency_ms" in metrics[0]
+
+    def test_get_WHEN_ttl_expired_and_unchanged_THEN_revalidated(
+        self, s3_client, capsys
+    ):
+        client = CountingClient(s3_client)
+        job_index = JobIndex(ttl=0, client=client)
+
+        keys = job_index.get()
+        assert job_index.get() is keys
+
+        assert client.calls[1]["IfNoneMatch"] == job_index.etag
+        metrics = get_lookup_metrics(capsys)
+        assert [m["result"] for m in metrics] == ["refreshed", "revalidated"]
+
+    def test_get_WHEN_ttl_expired_and_changed_THEN_refreshed(self, s3_client):
+        job_index = JobIndex(ttl=0, client=s3_client)
+        job_index.get()
+        s3_client.put_object(
+            Bucket="oaljadda",
+            Key="jobs/s3_import_jobs.csv",
+            Body=get_jobs_csv((JobKey, "job-2")),
+        )
+
+        assert job_index.get() == {JobKey: ["job-2", "https://mega/job-2"]}
+
+    def test_get_WHEN_jobs_csv_unreadable_THEN_last_index(self, s3_client):
+        job_index = JobIndex(ttl=0, client=s3_client)
+        keys = job_index.get()
+        s3_client.delete_object(Bucket="oaljadda", Key="jobs/s3_import_jobs.csv")
+
+        assert job_index.get() is keys
+
+
+class TestNumberOfRecordsInS3File:
+    @pytest.fixture()
+    def put_file(self, s3_client, monkeypatch):
+        client = CountingClient(s3_client)
+        monkeypatch.setattr(datahub_job_runner, "s3", client)
+
+        def put_file(body):
+            s3_client.put_object(Bucket="oaljadda", Key="file.csv", Body=body)
+            return client
+
+        return put_file
+
+    @pytest.mark.parametrize(
+        "body, records",
+        [
+            (b"", 0),
+            (b"id,name\n", 1),
+            (b"id,name", 1),
+            (b"id,name\r\n\r\n", 1),
+            (b"id,name\r\n1,a", 2),
+            (b"id,name\n1,a\n2,b\n", 2),
+            (b'"id","multi\nline name"\n', 1),
+            (b'"id","multi\nline name"\n1,"a\nb"\n', 2),
+        ],
+    )
+    def test_number_of_records_WHEN_file_THEN_records_up_to_2(
+        self, put_file, body, records
+    ):
+        put_file(body)
+        assert (
+            number_of_records_in_s3_file("oaljadda", "file.csv", probe_bytes=4)
+            == records
+        )
+
+    def test_number_of_records_WHEN_large_file_THEN_only_first_range_read(
+        self, put_file
+    ):
+        client = put_file(b"id,name\n" + b"1,a\n" * 100000)
+
+        assert number_of_records_in_s3_file("oaljadda", "file.csv") == 2
+        assert [call["Range"] for call in client.calls] == ["bytes=0-4095"]
+
+    def test_number_of_records_WHEN_long_header_THEN_growing_ranges(self, put_file):
+        client = put_file(b'"' + b"x" * 100 + b'\n"\n1\n')
+
+        assert number_of_records_in_s3_file("oaljadda", "file.csv", probe_bytes=16) == 2
+        assert [call["Range"] for call in client.calls] == [
+            "bytes=0-15",
+            "bytes=16-47",
+            "bytes=48-111",
+        ]
+
+    def test_number_of_records_WHEN_file_missing_THEN_raised(self, put_file):
+        with pytest.raises(ClientError):
+            number_of_records_in_s3_file("oaljadda", "missing.csv")
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(str(self.status_code))
+
+
+class FakeSession:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeResponse(outcome)
+
+
+class TestMegaJob:
+    def test_mega_job_WHEN_same_job_triggered_THEN_latest_id_cached(self, mega_stub):
+        for _ in range(3):
+            MegaJob("job-1").execute_mega_job()
+        MegaJob("job-2").execute_mega_job()
+
+        assert [r for r in mega_stub.requests if r[0] == "getLatest"] == [
+            ("getLatest", "job-1"),
+            ("getLatest", "job-2"),
+        ]
+        assert [r for r in mega_stub.requests if r[0] == "execute"] == [
+            ("execute", "job-1~v1")
+        ] * 3 + [("execute", "job-2~v1")]
+        # one keep-alive connection for all the requests
+        assert len(mega_stub.connections) == 1
+
+    def test_mega_job_WHEN_latest_id_expired_THEN_fetched_again(
+        self, mega_stub, monkeypatch
+    ):
+        monkeypatch.setattr(mega, "LATEST_ID_TTL", 0)
+        MegaJob("job-1")
+        MegaJob("job-1")
+
+        assert mega_stub.requests == [("getLatest", "job-1")] * 2
+
+    @pytest.mark.parametrize(
+        "outcomes, idempotent, calls",
+        [
+            ([500, 503, 200], True, 3),
+            ([requests.exceptions.ReadTimeout(), 200], True, 2),
+            ([503, 200], False, 2),
+            ([requests.exceptions.ConnectTimeout(), 200], False, 2),
+        ],
+    )
+    def test_post_mega_WHEN_transient_failure_THEN_retried(
+        self, monkeypatch, outcomes, idempotent, calls
+    ):
+        session = FakeSession(*outcomes)
+        monkeypatch.setattr(mega, "get_mega_session", lambda: session)
+
+        assert (
+            post_mega("http://mega", idempotent=idempotent, delay=0).status_code == 200
+        )
+        assert session.calls == calls
+
+    @pytest.mark.parametrize(
+        "outcomes, idempotent, error",
+        [
+            ([500], False, requests.exceptions.HTTPError),
+            (
+                [requests.exceptions.ReadTimeout()],
+                False,
+                requests.exceptions.ReadTimeout,
+            ),
+            ([503, 503, 503], True, requests.exceptions.HTTPError),
+            ([404], True, requests.exceptions.HTTPError),
+        ],
+    )
+    def test_post_mega_WHEN_not_retryable_THEN_raised(
+        self, monkeypatch, outcomes, idempotent, error
+    ):
+        session = FakeSession(*outcomes)
+        monkeypatch.setattr(mega, "get_mega_session", lambda: session)
+
+        with pytest.raises(error):
+            post_mega("http://mega", idempotent=idempotent, delay=0)
+        assert session.outcomes == []
+
+
+class TestBatchHandler:
+    files = [
+        "hse/master-of-data-science-hse/enrollments/terms_20200902.csv",
+        "hse/master-of-data-science-hse/enrollments/students_20200902.csv",
+        "penn/mcit/enrollments/students_20200902.csv",
+    ]
+
+    def put_files(self, s3_client, files, body=b"id,name\n1,a\n"):
+        for key in files:
+            s3_client.put_object(Bucket="coursera-degrees-data", Key=key, Body=body)
+
+    def get_sqs_batch(self, events):
+        return {
+            "Records": [
+                {"messageId": "m%d" % i, "body": json.dumps(event)}
+                for i, event in enumerate(events)
+            ]
+        }
+
+    def get_executions(self, mega_stub):
+        return [r for r in mega_stub.requests if r[0] == "execute"]
+
+    def test_batch_handler_WHEN_files_of_same_job_THEN_dispatched_once(
+        self, job_runner, s3_client, mega_stub
+    ):
+        self.put_files(s3_client, self.files)
+        batch = self.get_sqs_batch([get_file_event(key) for key in self.files])
+
+        assert job_runner.lambda_handler(batch, None) == {"batchItemFailures": []}
+        assert sorted(self.get_executions(mega_stub)) == [
+            ("execute", "job-1~v1"),
+            ("execute", "job-2~v1"),
+        ]
+
+    def test_batch_handler_WHEN_retried_THEN_not_executed_again(
+        self, job_runner, s3_client, mega_stub
+    ):
+        self.put_files(s3_client, self.files)
+        events = [get_file_event(key) for key in self.files]
+
+        job_runner.batch_handler(self.get_sqs_batch(events))
+        job_runner.batch_handler(self.get_sqs_batch(events))
+        job_runner.batch_handler(events[:1])
+
+        assert len(self.get_executions(mega_stub)) == 2
+
+    def test_batch_handler_WHEN_file_lands_after_dispatch_THEN_executed_again(
+        self, job_runner, s3_client, mega_stub
+    ):
+        self.put_files(s3_client, self.files)
+
+        job_runner.batch_handler([get_file_event(self.files[0])])
+        job_runner.batch_handler([get_file_event(self.files[1])])
+
+        assert self.get_executions(mega_stub) == [("execute", "job-1~v1")] * 2
+
+    def test_batch_handler_WHEN_next_window_THEN_executed_again(
+        self, job_runner, s3_client, mega_stub
+    ):
+        self.put_files(s3_client, self.files[:1])
+        event = get_file_event(self.files[0])
+
+        job_runner.batch_handler([event])
+        job_runner.batch_handler([dict(event, time="2020-09-03T00:10:00Z")])
+
+        assert self.get_executions(mega_stub) == [("execute", "job-1~v1")] * 2
+
+    def test_batch_handler_WHEN_not_enough_records_THEN_not_dispatched(
+        self, job_runner, s3_client, mega_stub
+    ):
+        self.put_files(s3_client, self.files, body=b"id,name\n")
+
+        job_runner.batch_handler([get_file_event(key) for key in self.files])
+
+        assert self.get_executions(mega_stub) == []
+
+    def test_batch_handler_WHEN_execute_fails_THEN_message_failed_and_retryable(
+        self, job_runner, s3_client, mega_stub, monkeypatch
+    ):
+        self.put_files(s3_client, self.files[:1])
+        batch = self.get_sqs_batch([get_file_event(self.files[0])])
+        monkeypatch.setattr(mega, "MEGA_RETRY_DELAY", 0)
+        mega.get_latest_id("job-1")
+        # MEGA refuses the execute requests: the job did not run
+        mega_stub.error_rate = 1.0
+
+        assert job_runner.batch_handler(batch) == {
+            "batchItemFailures": [{"itemIdentifier": "m0"}]
+        }
+
+        mega_stub.error_rate = 0.0
+        assert job_runner.batch_handler(batch) == {"batchItemFailures": []}
+        assert mega_stub.executions == {"job-1~v1": 1}
+
+    def test_batch_handler_WHEN_execute_sent_then_fails_THEN_not_executed_again(
+        self, job_runner, s3_client, mega_stub, monkeypatch
+    ):
+        self.put_files(s3_client, self.files[:1])
+        batch = self.get_sqs_batch([get_file_event(self.files[0])])
+        execute_mega_job = job_runner.MegaJob.execute_mega_job
+
+        def execute(self):
+            # MEGA runs the job, the response is lost
+            execute_mega_job(self)
+            raise requests.exceptions.ReadTimeout("read timed out")
+
+        monkeypatch.setattr(job_runner.MegaJob, "execute_mega_job", execute)
+
+        assert job_runner.batch_handler(batch) == {
+            "batchItemFailures": [{"itemIdentifier": "m0"}]
+        }
+
+        monkeypatch.setattr(job_runner.MegaJob, "execute_mega_job", execute_mega_job)
+        assert job_runner.batch_handler(batch) == {"batchItemFailures": []}
+        assert mega_stub.executions == {"job-1~v1": 1}
+        window = 1599090900
+        record, _ = job_runner.DispatchStore().load("job-1", window)
+        assert record["status"] == "unknown"
+        assert record["keys"] == [self.files[0]]
+
+
+class TestDispatchPipeline:
+    def put_jobs(self, s3_client, no_of_jobs):
+        keys = [
+            (
+                "p%d/program/enrollments/students_{DATE_PLACEHOLDER}.csv" % i,
+                "job-%d" % i,
+            )
+            for i in range(no_of_jobs)
+        ]
+        s3_client.put_object(
+            Bucket="oaljadda", Key="jobs/s3_import_jobs.csv", Body=get_jobs_csv(*keys)
+        )
+        files = [key.format(DATE_PLACEHOLDER="20200902") for key, _ in keys]
+        for key in files:
+            s3_client.put_object(
+                Bucket="coursera-degrees-data", Key=key, Body=b"id\n1\n"
+            )
+        return files
+
+    def test_batch_handler_WHEN_many_jobs_THEN_dispatched_concurrently(
+        self, job_runner, s3_client, mega_stub, monkeypatch, capsys
+    ):
+        files = self.put_jobs(s3_client, 8)
+        # every execute waits for the 8 jobs to be in flight, which jobs dispatched
+        # one after the other never are: the barrier times out and breaks
+        barrier = threading.Barrier(8, timeout=10)
+        execute_mega_job = job_runner.MegaJob.execute_mega_job
+
+        def execute(self):
+            barrier.wait()
+            return execute_mega_job(self)
+
+        monkeypatch.setattr(job_runner.MegaJob, "execute_mega_job", execute)
+        job_runner.batch_handler([get_file_event(key) for key in files])
+
+        assert not barrier.broken
+        assert len([r for r in mega_stub.requests if r[0] == "execute"]) == 8
+        latencies = [
+            json.loads(line)
+            for line in capsys.readouterr().out.splitlines()
+            if '"dispatch_latency"' in line
+        ]
+        assert sorted(x["job"] for x in latencies) == ["job-%d" % i for i in range(8)]
+        assert all(float(x["latency_ms"]) > 0 for x in latencies)
+
+    def test_batch_handler_WHEN_concurrency_limit_THEN_never_exceeded(
+        self, job_runner, s3_client, mega_stub, monkeypatch
+    ):
+        files = self.put_jobs(s3_client, 6)
+        monkeypatch.setattr(job_runner, "DISPATCH_CONCURRENCY", 2)
+        active, peak, lock = [0], [0], threading.Lock()
+        number_of_records_in_s3_file = job_runner.number_of_records_in_s3_file
+
+        def probe(bucket, key):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return number_of_records_in_s3_file(bucket, key)
+
+        monkeypatch.setattr(job_runner, "number_of_records_in_s3_file", probe)
+        job_runner.batch_handler([get_file_event(key) for key in files])
+
+        assert peak[0] == 2
+        assert len([r for r in mega_stub.requests if r[0] == "execute"]) == 6
+
+    def test_batch_handler_WHEN_windows_of_same_job_THEN_dispatched_in_order(
+        self, job_runner, s3_client, mega_stub
+    ):
+        files = self.put_jobs(s3_client, 1)
+        saved = []
+
+        class RecordingStore(job_runner.DispatchStore):
+            def save(self, jobId, window, record, version):
+                saved.append(window)
+                time.sleep(0.05)
+                return super().save(jobId, window, record, version)
+
+        events = [
+            get_file_event(files[0], time="2020-09-03T00:%02d:00Z" % minute)
+            for minute in (40, 20, 0)
+        ]
+        job_runner.batch_handler(events, store=RecordingStore())
+
+        assert saved == sorted(saved) and len(saved) == 3
+
+
+class TestLoadJobRunner:
+    def test_mega_stub_WHEN_errors_injected_THEN_retried_until_failed(self, mega_stub):
+        mega_stub.error_rate = 1.0
+        url = mega_stub.base_url + "/api/megaJobManager.v1?action=execute&id=job-1~v1"
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            post_mega(url, idempotent=False, delay=0)
+
+        assert mega_stub.errors == mega.MEGA_RETRIES
+        assert not mega_stub.executions
+
+    def test_load_test_WHEN_batches_redelivered_THEN_no_duplicate_executions(self):
+        from benchmarks.load_job_runner import main
+
+        args = "--jobs 3 --files 2 --days 2 --latency 0 --redeliver 0.5"
+        single, batch = main(args.split())
+
+        assert single["events"] == batch["events"] == 12
+        assert batch["executions"] == 6
+        assert batch["duplicates"] == batch["missed"] == 0
+        # the previous trigger runs the job for every delivered file
+        assert single["executions"] == single["invocations"] > 12
+        assert single["duplicates"] == single["invocations"] - 6